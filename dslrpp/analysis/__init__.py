@@ -1,8 +1,21 @@
 """
 """
-from .photometry import SNR, instrumental_flux, lightcurve, save_lcData
-from .period import periodogram, est_period
+from .photometry import (
+        photometry, SNR, instrumental_flux, lightcurve, save_lcData
+        )
+from .period import (
+        periodogram, est_period, pdm_power, string_length_power,
+        multiband_periodogram, batch_periodogram, bootstrap, false_alarm,
+        period_interval, clear_cache
+        )
+from .masks import MaskCache
+from .background import clipped_stats
+from .ensemble import ensemble
+from .store import ColumnStore, open_store
 __all__ = [
-        "SNR", "instrumental_flux", "lightcurve", "save_lcData",
-        "periodogram", "est_period",
+        "photometry", "SNR", "instrumental_flux", "lightcurve", "save_lcData",
+        "periodogram", "est_period", "pdm_power", "string_length_power",
+        "multiband_periodogram", "batch_periodogram", "bootstrap",
+        "false_alarm", "period_interval", "MaskCache", "clipped_stats",
+        "ensemble", "ColumnStore", "open_store", "clear_cache",
         ]
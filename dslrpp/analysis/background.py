@@ -0,0 +1,61 @@
+"""A submodule for estimating the sky background of many stars (and frames) at
+once.
+
+The annulus pixels of the stars are packed into a single array padded with
+NaNs, and sigma clipping is done on all of its rows simultaneously.
+"""
+import warnings
+import numpy as np
+
+__all__ = ["pack", "clipped_stats"]
+
+
+def pack(arrays):
+    """Packs one-dimensional arrays of different lengths into the rows of a
+    two-dimensional array, padded with NaNs.
+    """
+    lengths = [len(a) for a in arrays]
+    packed = np.full((len(arrays), max(lengths, default=0)), np.nan)
+    for row, a, n in zip(packed, arrays, lengths):
+        row[:n] = a
+    return packed
+
+
+def clipped_stats(data, sigma=3., maxiters=5):
+    """Computes sigma-clipped statistics along the last axis of the data.
+
+    Works like astropy.stats.sigma_clipped_stats with its default arguments
+    (the median as the center, the standard deviation as the spread), but
+    clips every row at once. NaNs are ignored, so rows of different lengths
+    can be packed with the pack function.
+
+    Parameters
+    ----------
+    data : `numpy.ndarray`
+        The data; the statistics are computed along the last axis.
+    sigma : `float`, optional
+        The number of standard deviations used as the clipping limit.
+    maxiters : `int`, optional
+        The maximum number of clipping iterations.
+
+    Returns
+    -------
+    mean, median, std : `numpy.ndarray`\0s
+        The statistics of the clipped data, one per row.
+    """
+    data = np.array(data, dtype=np.float64)
+    with warnings.catch_warnings():
+        # rows consisting only of NaNs give NaNs
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for _ in range(maxiters):
+            cen = np.nanmedian(data, axis=-1, keepdims=True)
+            std = np.nanstd(data, axis=-1, keepdims=True)
+            # rows which have converged don't change anymore
+            clip = (data < cen - sigma*std) | (data > cen + sigma*std)
+            if not clip.any():
+                break
+            data[clip] = np.nan
+        return (
+                np.nanmean(data, axis=-1), np.nanmedian(data, axis=-1),
+                np.nanstd(data, axis=-1)
+                )
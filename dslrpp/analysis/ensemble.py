@@ -0,0 +1,125 @@
+"""A submodule for ensemble differential photometry.
+
+The instrumental magnitude of star j in frame i is modelled as
+
+    m[i, j] = M[j] + Z[i]
+
+where M[j] is the mean magnitude of the star and Z[i] the zero point of the
+frame (extinction, transparency, exposure...). The zero points are solved for
+by weighted least squares over the comparison stars, alternating between the
+zero points and the mean magnitudes. The weight of every measurement includes
+the excess scatter of the star, so variable and badly measured comparison
+stars are down-weighted, and outlying measurements are rejected in every
+iteration. The zero points start from the median offsets of the frames, so
+a minority of bad measurements in a frame (e.g. a passing cloud) can not
+pull the first estimate far enough to reject the good ones. All arrays have
+the shape of the magnitude table, so the memory footprint is linear in the
+number of stars and frames.
+"""
+import warnings
+import numpy as np
+
+__all__ = ["ensemble"]
+
+
+def __wmean(x, w, axis):
+    """Auxiliary function; weighted mean, ignoring zero weights."""
+    sw = w.sum(axis=axis)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (w * x).sum(axis=axis) / sw, sw
+
+
+def ensemble(mags, errors, ref=None, iters=10, nsigma=3., tol=1e-6):
+    """Computes differential light curves of all stars using an ensemble of
+    comparison stars.
+
+    Parameters
+    ----------
+    mags : `numpy.ndarray`
+        The instrumental magnitudes, of shape (number of frames, number of
+        stars). Missing measurements are NaN.
+    errors : `numpy.ndarray`
+        The errors of the magnitudes
+    ref : array_like, optional
+        A boolean mask of the stars used as comparison stars (all stars by
+        default)
+    iters : `int`, optional
+        The maximum number of iterations
+    nsigma : `float`, optional
+        The rejection threshold for the normalized residuals
+    tol : `float`, optional
+        The iterations stop when the zero points change by less than this
+
+    Returns
+    -------
+    corrected : `numpy.ndarray`
+        The magnitudes with the zero points subtracted
+    corr_errors : `numpy.ndarray`
+        Their errors, including the errors of the zero points
+    zero_points : `numpy.ndarray`
+        The zero points of the frames, relative to their weighted mean
+    used : `numpy.ndarray`
+        The mask of the measurements used for the zero points
+    """
+    mags = np.asarray(mags, dtype=np.float64)
+    errors = np.asarray(errors, dtype=np.float64)
+    if ref is None:
+        ref = np.ones(mags.shape[1], dtype=bool)
+    ref = np.asarray(ref, dtype=bool)
+    if not ref.any():
+        raise ValueError("At least one comparison star is needed")
+    m = mags[:, ref]
+    var = errors[:, ref]**2
+    valid = np.isfinite(m) & np.isfinite(var) & (var > 0)
+    with warnings.catch_warnings():
+        # frames and stars without any measurements give NaNs
+        warnings.simplefilter('ignore', RuntimeWarning)
+        star_median = np.nanmedian(np.where(valid, m, np.nan), axis=0)
+        zp = np.nanmedian(np.where(valid, m - star_median, np.nan), axis=1)
+    zp = np.nan_to_num(zp)
+    zp -= np.average(zp)
+    used = valid.copy()
+    m = np.where(valid, m, 0.)
+    var = np.where(valid, var, 1.)
+
+    excess = np.zeros(m.shape[1])
+    for _ in range(iters):
+        w = used / (var + excess)
+        mean, _ = __wmean(m - zp[:, np.newaxis], w, axis=0)
+        resid = m - mean - zp[:, np.newaxis]
+        # the excess scatter of every star, above its measurement errors
+        n = used.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            excess = np.where(
+                    n > 1,
+                    (used * (resid**2 - var)).sum(axis=0) / n,
+                    0.
+                    )
+        excess = np.maximum(np.nan_to_num(excess), 0.)
+        # the measurements are rejected against the current zero points
+        # before these are updated; the rejection is redone from all valid
+        # measurements, so the ones rejected earlier can come back
+        norm = np.abs(resid) / np.sqrt(var + excess)
+        new_used = valid & (norm <= nsigma)
+        w = new_used / (var + excess)
+        new_zp, _ = __wmean(m - mean, w, axis=1)
+        new_zp = np.nan_to_num(new_zp)
+        new_zp -= np.average(new_zp)
+        converged = (
+                np.max(np.abs(new_zp - zp)) < tol
+                and np.array_equal(new_used, used)
+                )
+        zp = new_zp
+        used = new_used
+        if converged:
+            break
+
+    w = used / (var + excess)
+    sw = w.sum(axis=1)
+    with np.errstate(divide='ignore'):
+        zp_err = np.sqrt(1 / sw)
+    corrected = mags - zp[:, np.newaxis]
+    corr_errors = np.sqrt(errors**2 + zp_err[:, np.newaxis]**2)
+    full = np.zeros(mags.shape, dtype=bool)
+    full[:, ref] = used
+    return corrected, corr_errors, zp, full
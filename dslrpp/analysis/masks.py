@@ -0,0 +1,128 @@
+"""A submodule for caching the aperture and annulus weight masks (stencils)
+used in photometry.
+
+The radii of the apertures are constant during a run, and only the sub-pixel
+position of the star changes from frame to frame. The position is therefore
+quantised to a grid of sub-pixel offsets, and the stencil for each offset is
+computed only once.
+"""
+from collections import OrderedDict
+import numpy as np
+from photutils.geometry import circular_overlap_grid
+
+__all__ = ["MaskCache"]
+
+
+def __overlap(r, h, dx, dy, exact):
+    """Auxiliary function; computes the overlap of a circle with radius r with
+    a (2h+1)x(2h+1) grid of pixels, where the circle is offset by (dx, dy)
+    from the center of the middle pixel.
+    """
+    if r <= 0:
+        return np.zeros((2*h + 1, 2*h + 1))
+    return circular_overlap_grid(
+            -h - 0.5 - dx, h + 0.5 - dx, -h - 0.5 - dy, h + 0.5 - dy,
+            2*h + 1, 2*h + 1, r, 1 if exact else 0, 1
+            )
+
+
+def _stencils(r, r_in, r_out, dx, dy):
+    # the stencils of the aperture and of the annulus (exact, and by pixel
+    # centers) for the given offset
+    h = int(np.ceil(r_out)) + 1
+    aperture = __overlap(r, h, dx, dy, True)
+    annulus = (
+            __overlap(r_out, h, dx, dy, True)
+            - __overlap(r_in, h, dx, dy, True)
+            )
+    center = (
+            __overlap(r_out, h, dx, dy, False)
+            - __overlap(r_in, h, dx, dy, False)
+            ) > 0
+    return h, aperture, annulus, center
+
+
+class MaskCache:
+    """Stores the weight stencils of apertures and annuli for a grid of
+    sub-pixel offsets, with least recently used stencils discarded when the
+    cache is full.
+
+    Parameters
+    ----------
+    steps : `int`, optional
+        The number of sub-pixel offsets per pixel along each axis; the
+        positions are rounded to 1/steps of a pixel.
+    maxsize : `int`, optional
+        The maximum number of cached stencil sets.
+    """
+    def __init__(self, steps=20, maxsize=4096):
+        self.steps = steps
+        self.maxsize = maxsize
+        self._stencils = OrderedDict()
+
+    def stencils(self, x, y, r, r_in, r_out):
+        """Returns the stencils for a star at (x, y).
+
+        Returns
+        -------
+        ix, iy : `int`
+            The pixel the stencils are centered on
+        h : `int`
+            The half-size of the stencils, which are (2h+1)x(2h+1)
+        aperture : `numpy.ndarray`
+            The exact overlap of the aperture with each pixel
+        annulus : `numpy.ndarray`
+            The exact overlap of the annulus with each pixel
+        center : `numpy.ndarray`
+            The pixels whose centers lie in the annulus
+        """
+        ix, kx = self.__quantise(x)
+        iy, ky = self.__quantise(y)
+        key = (r, r_in, r_out, kx, ky)
+        try:
+            stencils = self._stencils[key]
+            self._stencils.move_to_end(key)
+        except KeyError:
+            stencils = _stencils(
+                    r, r_in, r_out, kx/self.steps, ky/self.steps
+                    )
+            self._stencils[key] = stencils
+            if len(self._stencils) > self.maxsize:
+                self._stencils.popitem(last=False)
+        return (ix, iy) + stencils
+
+    def measure(self, data, x, y, r, r_in, r_out):
+        """Measures a star at (x, y) in the data.
+
+        Returns the aperture sum, the annulus sum and the pixels of the
+        annulus (by pixel centers). Pixels outside the data count as zeros,
+        as they do in photutils.
+        """
+        ix, iy, h, aperture, annulus, center = self.stencils(
+                x, y, r, r_in, r_out
+                )
+        cutout = _cutout(data, ix, iy, h)
+        return (
+                np.vdot(aperture, cutout), np.vdot(annulus, cutout),
+                cutout[center]
+                )
+
+    def __quantise(self, p):
+        # splits the coordinate into the pixel and the sub-pixel offset
+        i = int(np.floor(p + 0.5))
+        k = int(np.around((p - i) * self.steps))
+        return i, k
+
+
+def _cutout(data, ix, iy, h):
+    # the (2h+1)x(2h+1) window of the data around (ix, iy), filled with zeros
+    # outside the data
+    H, W = data.shape
+    if h <= ix < W - h and h <= iy < H - h:
+        return data[iy-h:iy+h+1, ix-h:ix+h+1]
+    cutout = np.zeros((2*h + 1, 2*h + 1), dtype=data.dtype)
+    y1, y2 = max(iy - h, 0), min(iy + h + 1, H)
+    x1, x2 = max(ix - h, 0), min(ix + h + 1, W)
+    if y1 < y2 and x1 < x2:
+        cutout[y1-iy+h:y2-iy+h, x1-ix+h:x2-ix+h] = data[y1:y2, x1:x2]
+    return cutout
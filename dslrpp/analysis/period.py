@@ -1,11 +1,32 @@
 """
 """
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from astropy.timeseries import LombScargle as lsp
 from matplotlib import pyplot as plt
 from scipy.signal import find_peaks
+from .store import open_store, _store_name, _encode_text, PG_DTYPE
 
-__all__ = ["periodogram", "est_period", "save_pgData"]
+__all__ = [
+        "periodogram", "est_period", "save_pgData", "frequency_grid",
+        "cached_power", "pdm_power", "string_length_power",
+        "multiband_power", "multiband_periodogram", "batch_periodogram",
+        "bootstrap", "false_alarm", "period_interval", "clear_cache"
+        ]
+
+MEMORY_BUDGET = 2**28
+# the maximum amount of memory (in bytes) used for the trig terms of one grid
+CACHE_BUDGET = 2**29
+# the maximum amount of memory (in bytes) held by the cached trig terms; the
+# other caches hold at most a sixteenth of this
+
+_grids = OrderedDict()
+_trig = OrderedDict()
+_sums = OrderedDict()
+# cached frequency grids, trig terms and their weighted sums, least recently
+# used first, as (value, size in bytes) pairs
 
 
 def __intercept(y, x1, y1, x2, y2):
@@ -19,26 +40,619 @@ def __round_up(x):
     return np.around(x, int(np.ceil(-np.log10(x))))
 
 
+def __key(*arrays):
+    # a key identifying the contents of the arrays
+    h = hashlib.sha1()
+    for a in arrays:
+        a = np.ascontiguousarray(a, dtype=np.float64)
+        h.update(repr(a.shape).encode())
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+
+def __nbytes(value):
+    # the memory held by the arrays in the (nested) value
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(__nbytes(v) for v in value)
+    return 0
+
+
+def __cached(cache, key, compute, budget):
+    """Auxiliary function; looks the key up in the LRU cache, computing the
+    value if it's missing.
+
+    The least recently used values are evicted until the cache holds at most
+    budget bytes; values larger than the budget are not cached at all.
+    """
+    try:
+        cache.move_to_end(key)
+        return cache[key][0]
+    except KeyError:
+        pass
+    value = compute()
+    size = __nbytes(value)
+    if size <= budget:
+        cache[key] = (value, size)
+        while sum(n for _, n in cache.values()) > budget:
+            cache.popitem(last=False)
+    return value
+
+
+def clear_cache():
+    """Frees the memory held by the cached frequency grids and trig terms."""
+    _grids.clear()
+    _trig.clear()
+    _sums.clear()
+
+
+def frequency_grid(times, min_period, max_period, oversampling=5):
+    """Returns a uniform frequency grid covering the periods from min_period to
+    max_period.
+
+    The spacing of the grid is 1/(oversampling * baseline), which resolves
+    every peak of the periodogram with about oversampling points. The grids
+    are cached, so repeated calls with the same timestamps are free.
+    """
+    times = np.asarray(times, dtype=np.float64)
+
+    def compute():
+        baseline = times.max() - times.min()
+        df = 1 / (oversampling * baseline)
+        f0 = 1 / max_period
+        n = int(np.ceil((1/min_period - f0) / df)) + 1
+        grid = f0 + df * np.arange(n)
+        grid.setflags(write=False)
+        return grid
+
+    key = (__key(times), float(min_period), float(max_period), oversampling)
+    return __cached(_grids, key, compute, CACHE_BUDGET // 16)
+
+
+def __chunks(n_freq, n_times):
+    # slices of the frequency grid whose trig terms fit in the memory budget
+    step = max(1, MEMORY_BUDGET // (16 * max(n_times, 1)))
+    return [slice(i, min(i + step, n_freq)) for i in range(0, n_freq, step)]
+
+
+def __trig_chunks(t, freq):
+    # the cosines and sines of the frequency grid at the (centered) times, in
+    # chunks of frequencies
+    for sl in __chunks(len(freq), len(t)):
+        arg = 2 * np.pi * np.outer(freq[sl], t)
+        yield sl, np.cos(arg), np.sin(arg)
+
+
+def __trig(times, freq, t0=None, key=None):
+    """Auxiliary function; returns the cosines and sines of the frequency
+    grid at the timestamps (relative to t0, by default their mean), in
+    chunks of frequencies.
+
+    They are cached (under key, if it has already been computed with
+    __key(times, freq, t0)) only if they fit in the memory budget; otherwise
+    they are recomputed on every call.
+    """
+    if t0 is None:
+        t0 = times.mean()
+    t = times - t0
+    if 16 * len(freq) * len(t) > MEMORY_BUDGET:
+        return __trig_chunks(t, freq)
+    if key is None:
+        key = __key(times, freq, t0)
+    return __cached(
+            _trig, key, lambda: list(__trig_chunks(t, freq)), CACHE_BUDGET
+            )
+
+
+def __sums(cos, sin, w):
+    """Auxiliary function; computes the weighted sums of the trig terms of the
+    generalized Lomb-Scargle periodogram for the weights (one set per row).
+    """
+    C = w @ cos.T
+    S = w @ sin.T
+    CC = w @ (cos**2).T - C**2
+    SS = w @ (sin**2).T - S**2
+    CS = w @ (cos * sin).T - C * S
+    return C, S, CC, SS, CS
+
+
+def cached_power(times, mags, errors, freq):
+    """Computes the Lomb-Scargle power (with a floating mean and the standard
+    normalization, as LombScargle.power does by default) on the frequency
+    grid.
+
+    The trig terms, which depend only on the timestamps and the grid, are
+    cached, as are their sums for the given errors; repeated calls (e.g. for
+    other stars, or resampled magnitudes) then only cost two matrix products.
+
+    mags may also hold several light curves with the same timestamps, as the
+    rows of a 2D array; errors then holds either the shared errors, or the
+    errors of every light curve. Measurements which are NaN are ignored.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    freq = np.asarray(freq, dtype=np.float64)
+    y = np.asarray(mags, dtype=np.float64)
+    errors = np.asarray(errors, dtype=np.float64)
+    t0 = times.mean()
+    tkey = __key(times, freq, t0)
+    shared = errors.ndim <= 1 and np.isfinite(y).all()
+    if shared:
+        w = np.broadcast_to(1 / errors**2, times.shape)
+        w = w / w.sum()
+
+        def compute():
+            sums = [np.empty(len(freq)) for _ in range(5)]
+            for sl, cos, sin in __trig(times, freq, t0, tkey):
+                for a, b in zip(sums, __sums(cos, sin, w)):
+                    a[sl] = b
+            return sums
+
+        # the sums are kept apart from the trig terms, so new errors never
+        # evict them; the errors are short, and are used as they are
+        key = (tkey, errors.shape, errors.tobytes())
+        C, S, CC, SS, CS = __cached(
+                _sums, key, compute, CACHE_BUDGET // 16
+                )
+    else:
+        valid = np.isfinite(y) & np.isfinite(errors)
+        w = np.where(valid, 1 / np.where(valid, errors, 1.)**2, 0.)
+        w = w / w.sum(axis=-1, keepdims=True)
+        y = np.where(valid, y, 0.)
+        C, S, CC, SS, CS = (
+                np.empty(y.shape[:-1] + freq.shape) for _ in range(5)
+                )
+    y = y - (y * w).sum(axis=-1, keepdims=True)
+    yw = y * w
+    YY = (y * yw).sum(axis=-1)[..., np.newaxis]
+    YC = np.empty(y.shape[:-1] + freq.shape)
+    YS = np.empty_like(YC)
+    for sl, cos, sin in __trig(times, freq, t0, tkey):
+        if not shared:
+            sums = __sums(cos, sin, w)
+            for a, b in zip((C, S, CC, SS, CS), sums):
+                a[..., sl] = b
+        YC[..., sl] = yw @ cos.T
+        YS[..., sl] = yw @ sin.T
+    return (SS * YC**2 + CC * YS**2 - 2 * CS * YC * YS) / (
+            YY * (CC * SS - CS**2)
+            )
+
+
+def __phases(times, freq):
+    # the phases of the timestamps for every frequency, in chunks of
+    # frequencies
+    t = times - times.min()
+    for sl in __chunks(len(freq), len(t)):
+        yield sl, np.outer(freq[sl], t) % 1
+
+
+def pdm_power(times, mags, freq, n_bins=10):
+    """Computes the phase dispersion minimization statistic (Stellingwerf
+    1978) on the frequency grid, as a power: one minus the ratio of the
+    variance within the phase bins to the total variance.
+
+    The light curve is folded with all frequencies of a chunk at once; the
+    sums over the phase bins of every frequency are computed with a single
+    bincount.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    freq = np.asarray(freq, dtype=np.float64)
+    y = np.asarray(mags, dtype=np.float64)
+    valid = np.isfinite(y)
+    times, y = times[valid], y[valid] - y[valid].mean()
+    n = len(y)
+    total = (y**2).sum() / (n - 1)
+    power = np.empty(len(freq))
+    for sl, phase in __phases(times, freq):
+        rows = len(phase)
+        b = np.minimum((phase * n_bins).astype(np.intp), n_bins - 1)
+        b += n_bins * np.arange(rows)[:, np.newaxis]
+        size = rows * n_bins
+        count = np.bincount(b.ravel(), minlength=size).reshape(rows, -1)
+        s1 = np.bincount(
+                b.ravel(), np.broadcast_to(y, b.shape).ravel(), size
+                ).reshape(rows, -1)
+        s2 = np.bincount(
+                b.ravel(), np.broadcast_to(y**2, b.shape).ravel(), size
+                ).reshape(rows, -1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            within = np.where(count > 0, s2 - s1**2 / count, 0.).sum(axis=1)
+        used = (count > 0).sum(axis=1)
+        power[sl] = 1 - within / (n - used) / total
+    return power
+
+
+def string_length_power(times, mags, freq):
+    """Computes the string length statistic (Lafler & Kinman 1965) on the
+    frequency grid, as a power: one minus half the ratio of the sum of the
+    squared differences between consecutive points of the folded light curve
+    to the sum of the squared deviations. Noise has a power around zero.
+
+    The light curves folded with all frequencies of a chunk are sorted at
+    once.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    freq = np.asarray(freq, dtype=np.float64)
+    y = np.asarray(mags, dtype=np.float64)
+    valid = np.isfinite(y)
+    times, y = times[valid], y[valid] - y[valid].mean()
+    total = (y**2).sum()
+    power = np.empty(len(freq))
+    for sl, phase in __phases(times, freq):
+        folded = y[np.argsort(phase, axis=1)]
+        # including the step from the end of the cycle back to its start
+        d = np.diff(folded, axis=1, append=folded[:, :1])
+        power[sl] = 1 - 0.5 * (d**2).sum(axis=1) / total
+    return power
+
+
 def periodogram(
         times, mags, errors, min_expected=0.01, max_expected=1, precision=None,
-        plot=True
+        plot=True, grid='period', method='auto', oversampling=5, n_bins=10
         ):
-    if precision is None:
-        precision = np.min(times[1:] - times[:-1])
-    pRange = np.arange(min_expected, max_expected, precision)
-    freq = 1/pRange
+    """Computes the Lomb-Scargle periodogram for periods from min_expected to
+    max_expected.
+
+    With grid='period', the periods are spaced by precision (by default, the
+    smallest interval between the timestamps). With grid='auto', the
+    frequencies are spaced uniformly (see frequency_grid), which needs far
+    fewer points, and allows the fast methods.
+
+    method is passed to LombScargle.power ('fast' and 'fastchi2' need
+    grid='auto'), or is 'cached', which reuses the trig terms of earlier
+    calls with the same timestamps (see cached_power). method may also be
+    'pdm' (phase dispersion minimization with n_bins phase bins, see
+    pdm_power) or 'string' (string length, see string_length_power), which
+    suit non-sinusoidal light curves like those of eclipsing binaries
+    better; the errors are not used by them.
+
+    Returns the periods (in ascending order) and the power.
+    """
+    if grid not in ('period', 'auto'):
+        raise ValueError("Invalid argument for 'grid' parameter")
+    if grid == 'period':
+        if method in ('fast', 'fastchi2'):
+            raise ValueError(
+                    "The '" + method + "' method needs a uniform frequency "
+                    "grid (grid='auto')"
+                    )
+        if precision is None:
+            precision = np.min(times[1:] - times[:-1])
+        pRange = np.arange(min_expected, max_expected, precision)
+        freq = 1/pRange
+    else:
+        freq = frequency_grid(times, min_expected, max_expected, oversampling)
     print(times.shape, mags.shape, errors.shape)
-    ls_power = lsp(times, mags, errors).power(freq)
+    if method == 'cached':
+        ls_power = cached_power(times, mags, errors, freq)
+    elif method == 'pdm':
+        ls_power = pdm_power(times, mags, freq, n_bins)
+    elif method == 'string':
+        ls_power = string_length_power(times, mags, freq)
+    else:
+        ls_power = lsp(times, mags, errors).power(freq, method=method)
+    if grid == 'auto':
+        # ascending periods
+        pRange = 1/freq[::-1]
+        ls_power = ls_power[::-1]
     if plot:
         plt.figure()
-        plt.title('Lomb-Scargle periodogram')
+        name = {
+                'pdm': 'Phase dispersion', 'string': 'String length'
+                }.get(method, 'Lomb-Scargle')
+        plt.title(name + ' periodogram')
         plt.xlabel('Period')
-        plt.ylabel('Lomb-Scargle power')
+        plt.ylabel(name + ' power')
         plt.plot(pRange, ls_power)
     return pRange, ls_power
 
 
-def est_period(pRange, power, n_estimates=1, rnd=True):
+def multiband_power(times, mags, errors, freq):
+    """Computes the multiband Lomb-Scargle power (VanderPlas & Ivezic 2015)
+    of light curves in several bands on the frequency grid.
+
+    The model is a sinusoid shared by all bands, plus a constant offset for
+    every band (nterms_base=1 and nterms_band=0 in their terms). The power is
+    the reduction of chi-square from the model of constant offsets only, so
+    for a single band it is the standard Lomb-Scargle power.
+
+    The weighted sums of every band are computed with the cached trig terms
+    (relative to a common origin of time, so the phases are shared) and
+    added up; the cost is about that of one periodogram of all the
+    measurements.
+
+    Parameters
+    ----------
+    times, mags, errors : sequences of `numpy.ndarray`\0s
+        The light curves, one of each per band. Measurements which are NaN
+        are ignored.
+    freq : `numpy.ndarray`
+        The frequency grid
+    """
+    freq = np.asarray(freq, dtype=np.float64)
+    bands = []
+    for t, y, e in zip(times, mags, errors):
+        t = np.asarray(t, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        e = np.broadcast_to(np.asarray(e, dtype=np.float64), y.shape)
+        valid = np.isfinite(y) & np.isfinite(e)
+        bands.append((t[valid], y[valid], e[valid]))
+    t0 = np.mean(np.concatenate([t for t, _, _ in bands]))
+    YY = 0.
+    YC, YS, CC, SS, CS = (np.zeros(len(freq)) for _ in range(5))
+    for t, y, e in bands:
+        w = 1 / e**2
+        W = w.sum()
+        w = w / W
+        y = y - (y * w).sum()
+        yw = y * w
+        YY += W * (y * yw).sum()
+        for sl, cos, sin in __trig(t, freq, t0):
+            _, _, cc, ss, cs = __sums(cos, sin, w)
+            YC[sl] += W * (yw @ cos.T)
+            YS[sl] += W * (yw @ sin.T)
+            CC[sl] += W * cc
+            SS[sl] += W * ss
+            CS[sl] += W * cs
+    return (SS * YC**2 + CC * YS**2 - 2 * CS * YC * YS) / (
+            YY * (CC * SS - CS**2)
+            )
+
+
+def multiband_periodogram(
+        times, mags, errors, min_expected=0.01, max_expected=1,
+        oversampling=5, plot=True
+        ):
+    """Computes the multiband Lomb-Scargle periodogram (see multiband_power)
+    of the light curves of several bands (e.g. the R, G and B channels) for
+    periods from min_expected to max_expected, on the uniform frequency grid
+    of all their timestamps (see frequency_grid).
+
+    Returns the periods (in ascending order) and the power, like
+    periodogram.
+    """
+    freq = frequency_grid(
+            np.concatenate(times), min_expected, max_expected, oversampling
+            )
+    power = multiband_power(times, mags, errors, freq)[::-1]
+    pRange = 1/freq[::-1]
+    if plot:
+        plt.figure()
+        plt.title('Multiband Lomb-Scargle periodogram')
+        plt.xlabel('Period')
+        plt.ylabel('Lomb-Scargle power')
+        plt.plot(pRange, power)
+    return pRange, power
+
+
+_peak_dtype = np.dtype([('period', np.float64), ('power', np.float64)])
+# fields of the peak table returned by batch_periodogram
+
+
+def __star_power(times, mags, errors, freq, method):
+    # the periodogram of a single star, without the missing measurements
+    valid = np.isfinite(mags) & np.isfinite(errors)
+    return lsp(times[valid], mags[valid], errors[valid]).power(
+            freq, method=method
+            )
+
+
+def __peaks(pRange, power, n_peaks):
+    """Auxiliary function; finds the highest local maxima in every row of the
+    power matrix.
+    """
+    mid = power[:, 1:-1]
+    inner = (mid > power[:, :-2]) & (mid >= power[:, 2:])
+    candidates = np.full(power.shape, -np.inf)
+    candidates[:, 1:-1][inner] = mid[inner]
+    idx = np.argsort(-candidates, axis=1)[:, :n_peaks]
+    found = np.isfinite(np.take_along_axis(candidates, idx, axis=1))
+    peaks = np.empty(idx.shape, dtype=_peak_dtype)
+    peaks['period'] = np.where(found, pRange[idx], np.nan)
+    peaks['power'] = np.where(
+            found, np.take_along_axis(power, idx, axis=1), np.nan
+            )
+    return peaks
+
+
+def batch_periodogram(
+        times, mags, errors, min_expected=0.01, max_expected=1,
+        oversampling=5, method='cached', n_peaks=1, workers=None
+        ):
+    """Computes the periodograms of many stars with the same timestamps.
+
+    Parameters
+    ----------
+    times : `numpy.ndarray`
+        The timestamps
+    mags : `numpy.ndarray`
+        The magnitudes, of shape (number of stars, number of frames). Missing
+        measurements are NaN.
+    errors : `numpy.ndarray`
+        The errors of the magnitudes, of the same shape (or shared by all
+        stars, of shape (number of frames,))
+    min_expected, max_expected : `float`, optional
+        The range of the periods
+    oversampling : `int`, optional
+        The oversampling factor of the frequency grid (see frequency_grid)
+    method : `str`, optional
+        'cached' computes all periodograms at once with matrix products (see
+        cached_power). Any other method is passed to LombScargle.power, and
+        the stars are dispatched to a pool of worker processes.
+    n_peaks : `int`, optional
+        The number of peaks per star in the peak table
+    workers : `int`, optional
+        The number of worker processes
+
+    Returns
+    -------
+    pRange : `numpy.ndarray`
+        The periods of the shared grid, in ascending order
+    power : `numpy.ndarray`
+        The power matrix, of shape (number of stars, number of periods)
+    peaks : `numpy.ndarray`
+        The highest peaks of every star, as a structured array of shape
+        (number of stars, n_peaks) with the fields 'period' and 'power'
+    """
+    times = np.asarray(times, dtype=np.float64)
+    mags = np.atleast_2d(np.asarray(mags, dtype=np.float64))
+    errors = np.asarray(errors, dtype=np.float64)
+    freq = frequency_grid(times, min_expected, max_expected, oversampling)
+    print(
+            "Computing {} periodograms of {} points".format(
+                    len(mags), len(freq)
+                    )
+            )
+    if method == 'cached':
+        power = cached_power(times, mags, errors, freq)
+    else:
+        errors = np.broadcast_to(errors, mags.shape)
+        args = (
+                [times] * len(mags), mags, errors, [freq] * len(mags),
+                [method] * len(mags)
+                )
+        if workers is None or workers < 2:
+            power = np.array(list(map(__star_power, *args)))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                power = np.array(list(executor.map(
+                        __star_power, *args, chunksize=16
+                        )))
+    # ascending periods
+    pRange = 1/freq[::-1]
+    power = power[:, ::-1]
+    return pRange, power, __peaks(pRange, power, n_peaks)
+
+
+def __resample_peaks(times, mags, errors, freq, kind, seed, n):
+    """Auxiliary function; computes the periodograms of n resampled light
+    curves and returns the frequency and the power of the highest peak of
+    each.
+    """
+    rng = np.random.default_rng(seed)
+    m = len(times)
+    if kind == 'fap':
+        # shuffles the magnitudes between the timestamps; the errors stay
+        # with the timestamps, so the weights (and their cached sums) are
+        # shared by all resamples
+        idx = np.argsort(rng.random((n, m)), axis=1)
+        y, e = mags[idx], errors
+    else:
+        # draws the measurements with replacement; a measurement drawn k
+        # times is weighted k times, so the timestamps (and the cached trig
+        # terms) stay the same
+        counts = rng.multinomial(m, np.full(m, 1/m), size=n)
+        y = np.where(counts > 0, mags, np.nan)
+        with np.errstate(divide='ignore'):
+            e = errors / np.sqrt(counts)
+    power = cached_power(times, y, e, freq)
+    k = np.arange(n)
+    best = np.clip(np.nanargmax(power, axis=1), 1, len(freq) - 2)
+    # the vertex of the parabola through the peak and its neighbours, which
+    # resolves the peak far below the grid spacing
+    p0, p1, p2 = power[k, best-1], power[k, best], power[k, best+1]
+    d2 = p0 - 2*p1 + p2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        off = np.where(d2 < 0, 0.5 * (p0 - p2) / d2, 0.)
+    return freq[best] + off * (freq[1] - freq[0]), np.nanmax(power, axis=1)
+
+
+def bootstrap(
+        times, mags, errors, min_expected=0.01, max_expected=1,
+        n_resamples=1000, kind='fap', oversampling=5, seed=None, batch=64,
+        workers=None
+        ):
+    """Computes the periodograms of resampled light curves.
+
+    With kind='fap', the magnitudes are shuffled between the timestamps
+    (keeping the errors in place), which destroys any periodic signal; the highest peaks of these
+    periodograms give the false alarm probabilities of the peaks of the
+    original one (see false_alarm). With kind='period', the measurements are
+    drawn with replacement; the spread of the periods of the highest peaks
+    gives the confidence interval of the period (see period_interval).
+
+    The periodograms are computed on the cached frequency grid with
+    cached_power, in batches of resamples, which can be spread across worker
+    processes. Every batch draws from its own random stream derived from the
+    seed, so the results only depend on the seed and the batch size, not on
+    the number of workers.
+
+    Parameters
+    ----------
+    times, mags, errors : `numpy.ndarray`
+        The light curve
+    min_expected, max_expected : `float`, optional
+        The range of the periods
+    n_resamples : `int`, optional
+        The number of resampled light curves
+    kind : `str`, optional
+        'fap' or 'period'
+    oversampling : `int`, optional
+        The oversampling factor of the frequency grid (see frequency_grid)
+    seed : `int`, optional
+        The seed of the random number generator
+    batch : `int`, optional
+        The number of resamples computed at once
+    workers : `int`, optional
+        The number of worker processes
+
+    Returns
+    -------
+    periods : `numpy.ndarray`
+        The period of the highest peak of every resampled periodogram
+    powers : `numpy.ndarray`
+        The power of these peaks
+    """
+    if kind not in ('fap', 'period'):
+        raise ValueError("Invalid argument for 'kind' parameter")
+    times = np.asarray(times, dtype=np.float64)
+    mags = np.asarray(mags, dtype=np.float64)
+    errors = np.broadcast_to(np.asarray(errors, dtype=np.float64), mags.shape)
+    valid = np.isfinite(mags) & np.isfinite(errors)
+    times, mags, errors = times[valid], mags[valid], errors[valid]
+    freq = frequency_grid(times, min_expected, max_expected, oversampling)
+    sizes = [min(batch, n_resamples - i) for i in range(0, n_resamples, batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = (
+            [times] * len(sizes), [mags] * len(sizes), [errors] * len(sizes),
+            [freq] * len(sizes), [kind] * len(sizes), seeds, sizes
+            )
+    print(
+            "Computing {} resampled periodograms of {} points".format(
+                    n_resamples, len(freq)
+                    )
+            )
+    if workers is None or workers < 2:
+        results = list(map(__resample_peaks, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(__resample_peaks, *args))
+    peak_freq = np.concatenate([f for f, _ in results])
+    peak_power = np.concatenate([p for _, p in results])
+    return 1/peak_freq, peak_power
+
+
+def false_alarm(power, peak_powers):
+    """Returns the false alarm probability of a peak of the given power, as
+    the fraction of the highest peaks of the shuffled light curves (see
+    bootstrap) which are at least as high.
+    """
+    peak_powers = np.asarray(peak_powers)
+    return np.mean(peak_powers[:, np.newaxis] >= np.atleast_1d(power), axis=0)
+
+
+def period_interval(peak_periods, confidence=0.68):
+    """Returns the median and the bounds of the central confidence interval of
+    the periods of the resampled light curves (see bootstrap).
+    """
+    lower, median, upper = np.percentile(
+            peak_periods, [50 * (1-confidence), 50, 50 * (1+confidence)]
+            )
+    return median, lower, upper
+
+
+def est_period(pRange, power, n_estimates=1, rnd=True, peak_powers=None):
     indices = find_peaks(power, distance=20)[0]
     fRange = 1/pRange
     peaks = np.array([power[i] for i in indices])
@@ -99,31 +713,37 @@ def est_period(pRange, power, n_estimates=1, rnd=True):
                         relevant_pPeaks[j], errors[j]
                 )
         )
+        if peak_powers is not None:
+            print(
+                    "\tFalse alarm probability:",
+                    false_alarm(power[i], peak_powers)[0]
+                    )
         j += 1
     return relevant_pPeaks, errors
 
 
-def save_pgData(path, pRange, power, desc="\b"):
+def save_pgData(path, pRange, power, desc="\b", star=0, append=False):
+    """Saves the periodogram in the binary store periodogram_data_<desc> in
+    path (see store.open_store), and returns the store.
+
+    power may also hold the periodograms of several stars on the same
+    periods, as rows, which are numbered in the star column (from star).
+    desc is also written to the channel column. With append=True, the rows
+    are added to the existing store.
+    """
     print("Saving periodogram data...")
-    n = 1
-    data = np.transpose([pRange, power])
-    try:
-        np.savetxt(
-                path + "/periodogram_data_{}.csv".format(desc), data,
-                delimiter=','
-                )
-    except(OSError):
-        error = True
-        while error is True:
-            try:
-                np.savetxt(
-                        path + "/periodogram_data_{}_{}.csv".format(desc, n),
-                        data, delimiter=','
-                        )
-                error = False
-            except OSError:
-                n += 1
-        print(
-                "File of the same name already exists, file written to",
-                path + "/periodogram_data_{}_{}.csv".format(desc, n)
-                )
+    power = np.atleast_2d(np.asarray(power, dtype=np.float64))
+    pRange = np.broadcast_to(np.asarray(pRange, dtype=np.float64), power.shape)
+    stars = np.broadcast_to(
+            star + np.arange(len(power))[:, np.newaxis], power.shape
+            )
+    # checked before the store is created
+    channel = _encode_text(desc.strip("\b"), 'channel', PG_DTYPE['channel'])
+    store = open_store(
+            _store_name(path, "periodogram_data", desc), PG_DTYPE, append
+            )
+    store.append(
+            period=pRange.ravel(), power=power.ravel(), star=stars.ravel(),
+            channel=channel
+            )
+    return store
@@ -1,125 +1,311 @@
 """
 """
 
-from photutils import aperture_photometry
-from astropy.stats import sigma_clipped_stats
+from photutils import aperture_photometry, CircularAperture, CircularAnnulus
+from ..prepare.tracks import positions
+from .background import pack, clipped_stats
+from .ensemble import ensemble
+from .store import open_store, _store_name, _encode_text, LC_DTYPE
 import numpy as np
 from matplotlib import pyplot as plt
 
-__all__ = ["SNR", "instrumental_flux", "lightcurve", "save_lcData"]
-
-
-def SNR(*imgs):
-    stars = []
-    for s in imgs[0].stars:
-        stars.append(s)
-    SNRs = []
-    for img in imgs:
-        _SNRs = []
-        for s in stars:
-            ap = s.apertures[img]
-            signal = aperture_photometry(img.imdata, ap)['aperture_sum'][0]
-            mean_signal = signal/ap.area
-            mask = s.annuli[img].to_mask(method='center')
-            bkg = mask.multiply(img.imdata)
-            noise = bkg[mask.data > 0]
-            std_noise = np.std(noise)
-            SNR = mean_signal / std_noise * np.sqrt(ap.area)
-            # ovako se dobija SNR za CCD
-            # nije pouzdano da li je validno za DSLR
-            _SNRs.append(SNR)
-        SNRs.append(_SNRs)
-    return np.array(SNRs)
+__all__ = [
+        "photometry", "SNR", "instrumental_flux", "lightcurve", "save_lcData"
+        ]
 
 
-def instrumental_flux(*imgs, subtract_bkg=True,
-                      method='median', sigma_clip=True):
-    varstars = []
-    refstars = []
-    fluxes = []
-    for s in imgs[0].stars:
-        if s.isVar:
-            varstars.append(s)
-        else:
-            refstars.append(s)
+_phot_dtype = np.dtype([
+        ('jd', np.float64), ('x', np.float64), ('y', np.float64),
+        ('flux', np.float64), ('bkg', np.float64), ('bkg_std', np.float64),
+        ('snr', np.float64)
+        ])
+# fields of the table returned by the photometry function
+
+
+def __masks(aperture, method):
+    # ApertureMask objects of all positions of the aperture, as a list
+    masks = aperture.to_mask(method=method)
+    if isinstance(masks, list):
+        return masks
+    return [masks]
+
+
+def __radii(s):
+    # aperture radius, inner and outer annulus radius of the star
+    return (s.r, s.r + s.d_d, s.r + s.d_d + s.d_a)
+
+
+def __ordered_stars(img):
+    # variable stars, followed by the reference stars
+    return (
+            [s for s in img.stars if s.isVar]
+            + [s for s in img.stars if not s.isVar]
+            )
+
+
+def __measure(out, signal, noise, ap_area, an_sum, an_area, subtract_bkg,
+              method, sigma_clip):
+    """Auxiliary function; fills the flux, background and SNR fields of the
+    table from the aperture sums and the annulus pixels.
+
+    The last axis of noise runs over the annulus pixels, padded with NaNs;
+    any leading axes match those of out and signal. The background of all
+    stars is estimated at once.
+    """
+    out['bkg_std'] = np.nanstd(noise, axis=-1)
     if sigma_clip:
-        for img in imgs:
-            _fluxes = []
-            for s in varstars + refstars:
-                ap = s.apertures[img]
-                an = s.annuli[img]
-                phot_data = aperture_photometry(img.imdata, ap)
-                mask = an.to_mask(method='center')
-                noise = mask.multiply(img.imdata)[mask.data > 0]
-                bkg_mean_sc, bkg_median_sc, _ = sigma_clipped_stats(noise)
-                if method == 'mean':
-                    bkg = bkg_mean_sc
-                elif method == 'median':
-                    bkg = bkg_median_sc
-                else:
-                    raise ValueError(
-                        "The 'method' argument must be 'mean' or 'median'"
-                        )
-                flux = phot_data['aperture_sum'][0]
-                if subtract_bkg:
-                    _fluxes.append(flux - bkg)
-                else:
-                    _fluxes.append(flux)
-            fluxes.append(_fluxes)
-        return np.array(fluxes)
-    if method == 'mean':
-        for img in imgs:
-            _fluxes = []
-            for s in varstars + refstars:
-                ap = s.apertures[img]
-                an = s.annuli[img]
-                phot_data = aperture_photometry(img.imdata, [ap, an])
-                bkg_avg = phot_data['aperture_sum_1'][0] / an.area
-                bkg = bkg_avg * ap.area
-                flux = phot_data['aperture_sum_0'][0]
-                if subtract_bkg:
-                    _fluxes.append(flux - bkg)
-                else:
-                    _fluxes.append(flux)
-            fluxes.append(_fluxes)
-        return np.array(fluxes)
-    if method == 'median':
-        for img in imgs:
-            _fluxes = []
-            for s in varstars + refstars:
-                ap = s.apertures[img]
-                an = s.annuli[img]
-                phot_data = aperture_photometry(img.imdata, ap)
-                mask = an.to_mask(method='center')
-                noise = mask.multiply(img.imdata)[mask.data > 0]
-                bkg = np.median(noise)
-                flux = phot_data['aperture_sum'][0]
-                if subtract_bkg:
-                    _fluxes.append(flux - bkg)
-                else:
-                    _fluxes.append(flux)
-            fluxes.append(_fluxes)
-        return np.array(fluxes)
-    raise ValueError("The 'method' argument must be 'mean' or 'median'")
+        bkg_mean_sc, bkg_median_sc, _ = clipped_stats(noise)
+        bkg = bkg_mean_sc if method == 'mean' else bkg_median_sc
+        out['bkg'] = bkg
+    elif method == 'mean':
+        out['bkg'] = an_sum / an_area
+        # the background of the whole aperture is subtracted
+        bkg = out['bkg'] * ap_area
+    else:
+        bkg = np.nanmedian(noise, axis=-1)
+        out['bkg'] = bkg
+    out['flux'] = signal - bkg if subtract_bkg else signal
+    # ovako se dobija SNR za CCD
+    # nije pouzdano da li je validno za DSLR
+    out['snr'] = signal / ap_area / out['bkg_std'] * np.sqrt(ap_area)
+
+
+def __store_fluxes(imgs, stars, out):
+    """Auxiliary function; writes the measured fluxes into the track table,
+    if the stars share one with the frames.
+    """
+    tracks = getattr(imgs[0], '_tracks', None)
+    if tracks is None or any(
+            getattr(s, 'tracks', None) is not tracks for s in stars
+            ):
+        return
+    cols = [s.index for s in stars]
+    for img, row in zip(imgs, out):
+        if getattr(img, '_tracks', None) is tracks:
+            tracks.flux[img._row, cols] = row['flux']
+
+
+def __frame_sums(img, stars, masks=None):
+    """Auxiliary function; computes the aperture and annulus sums of all stars
+    in a frame, and collects their annulus pixels.
+
+    Stars sharing the same aperture radii (normally all of them) are measured
+    with a single multi-position aperture. If a MaskCache is given, the
+    cached stencils are used instead.
+
+    Returns a dictionary of arrays with one element per star, and the list of
+    the annulus pixels of each star.
+    """
+    n = len(stars)
+    sums = {k: np.empty(n) for k in (
+            'x', 'y', 'signal', 'ap_area', 'an_sum', 'an_area'
+            )}
+    noise = [None] * n
+    sums['x'], sums['y'] = positions(img, stars)
+    if masks is not None:
+        for i, s in enumerate(stars):
+            x, y = sums['x'][i], sums['y'][i]
+            r, r_in, r_out = __radii(s)
+            signal, an_sum, noise[i] = masks.measure(
+                    img.imdata, x, y, r, r_in, r_out
+                    )
+            sums['signal'][i], sums['an_sum'][i] = signal, an_sum
+            sums['ap_area'][i] = np.pi * r**2
+            sums['an_area'][i] = np.pi * (r_out**2 - r_in**2)
+        return sums, noise
+    groups = dict()
+    for i, s in enumerate(stars):
+        groups.setdefault(__radii(s), []).append(i)
+    for (r, r_in, r_out), idx in groups.items():
+        xy = np.transpose([sums['x'][idx], sums['y'][idx]])
+        ap = CircularAperture(xy, r)
+        an = CircularAnnulus(xy, r_in, r_out)
+        phot_data = aperture_photometry(img.imdata, [ap, an])
+        sums['signal'][idx] = phot_data['aperture_sum_0']
+        sums['an_sum'][idx] = phot_data['aperture_sum_1']
+        sums['ap_area'][idx] = ap.area
+        sums['an_area'][idx] = an.area
+        for i, mask in zip(idx, __masks(an, 'center')):
+            noise[i] = mask.multiply(img.imdata)[mask.data > 0]
+    return sums, noise
+
+
+def __cube_phot(imgs, stars, out, subtract_bkg, method, sigma_clip):
+    """Auxiliary function; measures all stars in all frames of an aligned
+    sequence, where every star has the same position in each frame.
+
+    The aperture masks are computed once per star, and each star is measured
+    in all frames at once.
+    """
+    for i, img in enumerate(imgs):
+        out['x'][i], out['y'][i] = positions(img, stars)
+    for j, s in enumerate(stars):
+        if (out['x'][:, j] != out['x'][0, j]).any() \
+                or (out['y'][:, j] != out['y'][0, j]).any():
+            raise ValueError(
+                    "Star " + s.name + " doesn't have the same position "
+                    "in all frames; the frames must be aligned"
+                    )
+    out['jd'] = np.array([img.jdate for img in imgs])[:, np.newaxis]
+    for j, s in enumerate(stars):
+        r, r_in, r_out = __radii(s)
+        xy = [(out['x'][0, j], out['y'][0, j])]
+        ap = CircularAperture(xy, r)
+        an = CircularAnnulus(xy, r_in, r_out)
+        apmask = __masks(ap, 'exact')[0]
+        cutouts = np.array(
+                [apmask.cutout(img.imdata, fill_value=0.) for img in imgs]
+                )
+        signal = np.sum(cutouts * apmask.data, axis=(1, 2))
+        anmask = __masks(an, 'exact')[0]
+        cutouts = np.array(
+                [anmask.cutout(img.imdata, fill_value=0.) for img in imgs]
+                )
+        an_sum = np.sum(cutouts * anmask.data, axis=(1, 2))
+        anmask = __masks(an, 'center')[0]
+        noise = np.array(
+                [anmask.multiply(img.imdata) for img in imgs]
+                )[:, anmask.data > 0]
+        __measure(
+                out[:, j], signal, noise, ap.area, an_sum, an.area,
+                subtract_bkg, method, sigma_clip
+                )
+
+
+def photometry(*imgs, subtract_bkg=True, method='median', sigma_clip=True,
+               aligned=False, masks=None, batch=64):
+    """Measures the stars in the frames in a single pass.
+
+    Returns a structured array of shape (number of frames, number of stars),
+    with the variable stars first. Its fields are the Julian date ('jd'), the
+    position of the star ('x', 'y'), the instrumental flux ('flux', as
+    returned by instrumental_flux), the background level per pixel ('bkg'),
+    the standard deviation of the background pixels ('bkg_std') and the
+    signal-to-noise ratio ('snr', as returned by SNR).
+
+    All stars of a frame are measured at once. If the frames are aligned
+    (every star has the same position in every frame), aligned=True measures
+    each star in all frames at once.
+
+    If the stars and the frames share a track table, the positions are read
+    from it and the fluxes are written into it.
+
+    If a MaskCache is given, each star is measured with cached stencils at its
+    position rounded to a fraction of a pixel, instead of computing new
+    aperture masks in every frame. Aligned frames need no cache, as their
+    masks are computed only once; giving both raises ValueError.
+
+    The backgrounds are estimated for batch frames at once; a larger batch is
+    faster, but the annulus pixels of all stars in the batch are kept in
+    memory.
+    """
+    if method not in ('mean', 'median'):
+        raise ValueError("The 'method' argument must be 'mean' or 'median'")
+    if aligned and masks is not None:
+        raise ValueError(
+                "A MaskCache can not be used for aligned frames"
+                )
+    stars = __ordered_stars(imgs[0])
+    out = np.empty((len(imgs), len(stars)), dtype=_phot_dtype)
+    if aligned:
+        __cube_phot(imgs, stars, out, subtract_bkg, method, sigma_clip)
+        __store_fluxes(imgs, stars, out)
+        return out
+    # the frames are measured in batches, and the backgrounds of all stars in
+    # a batch are estimated at once
+    for start in range(0, len(imgs), batch):
+        chunk = imgs[start:start + batch]
+        sums, noise = zip(*[__frame_sums(img, stars, masks) for img in chunk])
+        sums = {k: np.array([d[k] for d in sums]) for k in sums[0]}
+        noise = pack([n for frame in noise for n in frame])
+        rows = out[start:start + batch]
+        rows['jd'] = np.array([img.jdate for img in chunk])[:, np.newaxis]
+        rows['x'] = sums['x']
+        rows['y'] = sums['y']
+        __measure(
+                rows, sums['signal'],
+                noise.reshape(len(chunk), len(stars), -1), sums['ap_area'],
+                sums['an_sum'], sums['an_area'], subtract_bkg, method,
+                sigma_clip
+                )
+    __store_fluxes(imgs, stars, out)
+    return out
+
+
+def SNR(*imgs, aligned=False):
+    """Computes the signal-to-noise ratio of the stars in the frames, in the
+    order in which they were added.
+    """
+    order = [__ordered_stars(imgs[0]).index(s) for s in imgs[0].stars]
+    return photometry(*imgs, aligned=aligned)['snr'][:, order]
+
+
+def instrumental_flux(*imgs, subtract_bkg=True,
+                      method='median', sigma_clip=True, aligned=False):
+    """Measures the instrumental fluxes of the stars in the frames.
+
+    Returns an array of shape (number of frames, number of stars), with the
+    variable stars first. All stars of a frame are measured at once. If the
+    frames are aligned (every star has the same position in every frame),
+    aligned=True measures each star in all frames at once.
+    """
+    return photometry(
+            *imgs, subtract_bkg=subtract_bkg, method=method,
+            sigma_clip=sigma_clip, aligned=aligned
+            )['flux']
 
 
 def lightcurve(
         *imgs, return_error=True, include_refstars=False,
-        plot=True, jd_time=True
+        plot=True, jd_time=True, comparison='mean'
                ):
+    """Computes the light curves of the stars.
+
+    With comparison='mean', the mean light curve of the reference stars is
+    subtracted from all light curves. With comparison='ensemble', the zero
+    point of every frame is fitted over all reference stars (see
+    ensemble.ensemble), which also works for hundreds of field stars; the
+    magnitudes are then calibrated against the reference stars with known
+    magnitudes, if there are any.
+    """
+    if comparison not in ('mean', 'ensemble'):
+        raise ValueError("Invalid argument for 'comparison' parameter")
     n_stars = len(imgs[0].stars)
-    if return_error:
-        snrs = SNR(*imgs)
-    fluxes = instrumental_flux(*imgs)
+    phot = photometry(*imgs)
+    snrs = phot['snr']
+    fluxes = phot['flux']
     mags = -2.5 * np.log10(fluxes)
-    ideal_lc = mags[:, 1:].mean(axis=1)  # usrednjavamo krive sjaja ref zvezda
-    for m in mags.T:
-        m -= ideal_lc  # tu krivu oduzimamo od svih
-    ref_mag = np.mean([s.mag for s in imgs[0].stars[1:]])
-    mags += ref_mag
-    if return_error:
-        errors = np.array([1.0857/np.sqrt(snrs[:, i]) for i in range(n_stars)])
-    times = imgs[:].jdate
+    errors = np.array([1.0857/np.sqrt(snrs[:, i]) for i in range(n_stars)])
+    stars = __ordered_stars(imgs[0])
+    if comparison == 'ensemble':
+        ref = np.array([not s.isVar for s in stars])
+        mags, errors, _, _ = ensemble(mags, errors.T, ref)
+        errors = errors.T
+        cat = np.array(
+                [np.nan if s.mag is None else s.mag for s in stars],
+                dtype=np.float64
+                )
+        if np.isfinite(cat).any():
+            mags += np.nanmean(cat - np.nanmean(mags, axis=0))
+    else:
+        # only the reference stars with known magnitudes are used (detected
+        # field stars have none)
+        ref = [
+                i for i, s in enumerate(stars)
+                if not s.isVar and s.mag is not None
+                ]
+        if not ref:
+            raise ValueError(
+                    "No reference stars with known magnitudes, use "
+                    "comparison='ensemble'"
+                    )
+        # usrednjavamo krive sjaja ref zvezda
+        ideal_lc = mags[:, ref].mean(axis=1)
+        for m in mags.T:
+            m -= ideal_lc  # tu krivu oduzimamo od svih
+        ref_mag = np.mean([stars[i].mag for i in ref])
+        mags += ref_mag
+    times = phot['jd'][:, 0]
     if not jd_time:
         times -= times.min()
     plt.figure()
@@ -127,13 +313,16 @@ def lightcurve(
     plt.xlabel('mag')
     plt.ylabel('t')
     if include_refstars:
+        # detected field stars (without known magnitudes) are not plotted,
+        # as there may be hundreds of them
         for i in range(1, n_stars):
-            plt.errorbar(
-                    times, mags[:, i], yerr=errors[i],
-                    label=imgs[0].stars[i].name, capsize=2
-                    )
+            if stars[i].isVar or stars[i].mag is not None:
+                plt.errorbar(
+                        times, mags[:, i], yerr=errors[i],
+                        label=stars[i].name, capsize=2
+                        )
     plt.errorbar(
-        times, mags[:, 0], yerr=errors[0], label=imgs[0].stars[0].name,
+        times, mags[:, 0], yerr=errors[0], label=stars[0].name,
         capsize=2
         )
     if return_error:
@@ -143,30 +332,35 @@ def lightcurve(
     return times, mags[:, 0]
 
 
-def save_lcData(path, t, m, e=None, desc="\b"):
+def save_lcData(
+        path, t, m, e=None, desc="\b", star=0, flags=None, append=False
+        ):
+    """Saves the light curves in the binary store lightcurve_data_<desc> in
+    path (see store.open_store), and returns the store.
+
+    m (and e) may hold the light curves of several stars as rows, which are
+    numbered in the star column (from star); desc is also written to the
+    channel column. flags holds bit flags of the measurements, defined by the
+    caller (zero by default). With append=True, the rows are added to the
+    existing store, e.g. for new frames or other stars.
+    """
     print("Saving lightcurve data...")
-    n = 1
-    if e is not None:
-        data = np.transpose([t, m, e])
-    else:
-        data = np.transpose([t, m])
-    try:
-        np.savetxt(
-                path + "/lightcurve_data_{}.csv".format(desc), data,
-                delimiter=','
-                )
-    except(OSError):
-        error = True
-        while error is True:
-            try:
-                np.savetxt(
-                        path + "/lightcurve_data_{}_{}.csv".format(desc, n),
-                        data, delimiter=','
-                        )
-                error = False
-            except OSError:
-                n += 1
-        print(
-                "File of the same name already exists, file written to",
-                path + "/lightcurve_data_{}_{}.csv".format(desc, n)
-                )
+    m = np.atleast_2d(np.asarray(m, dtype=np.float64))
+    t = np.broadcast_to(np.asarray(t, dtype=np.float64), m.shape)
+    e = np.broadcast_to(np.nan if e is None else np.asarray(e), m.shape)
+    stars = np.broadcast_to(
+            star + np.arange(len(m))[:, np.newaxis], m.shape
+            )
+    # checked before the store is created
+    channel = _encode_text(desc.strip("\b"), 'channel', LC_DTYPE['channel'])
+    store = open_store(
+            _store_name(path, "lightcurve_data", desc), LC_DTYPE, append
+            )
+    store.append(
+            time=t.ravel(), mag=m.ravel(), err=e.ravel(), star=stars.ravel(),
+            channel=channel,
+            flags=np.broadcast_to(
+                    0 if flags is None else flags, m.shape
+                    ).ravel()
+            )
+    return store
@@ -0,0 +1,171 @@
+"""A submodule for storing light curves and periodograms in a binary columnar
+format.
+
+A store is a directory holding one raw binary file per column, and the schema
+of a row (a .npy file of an empty array with the structured dtype). New rows
+are appended to the end of every column file, and the columns are read back
+as memory maps, so nothing is parsed and only the pages which are used are
+ever loaded. The files can also be read without this module, e.g. with
+numpy.fromfile.
+"""
+import os
+import threading
+import numpy as np
+from ..prepare.process import _unique
+
+__all__ = ["ColumnStore", "open_store", "LC_DTYPE", "PG_DTYPE"]
+
+LC_DTYPE = np.dtype([
+        ('time', '<f8'), ('mag', '<f8'), ('err', '<f8'), ('star', '<i4'),
+        ('channel', 'S16'), ('flags', 'u1')
+        ])
+# columns of the light curve stores; flags are bit flags defined by the caller
+# (see save_lcData)
+PG_DTYPE = np.dtype([
+        ('period', '<f8'), ('power', '<f8'), ('star', '<i4'),
+        ('channel', 'S16')
+        ])
+# columns of the periodogram stores
+
+SCHEMA = "schema.npy"
+
+
+def open_store(name, dtype, append=False):
+    """Opens a store with the columns of dtype.
+
+    With append=True, the rows are added to the store in the directory name
+    if it exists. Otherwise, a new store is created: in name, or in name_1,
+    name_2... if the directory already exists.
+    """
+    dtype = np.dtype(dtype)
+    if append and os.path.isdir(name):
+        store = ColumnStore(name)
+        if store.dtype != dtype:
+            raise ValueError(
+                    "The store in " + name + " has different columns"
+                    )
+        return store
+    # the directory is created atomically, so concurrent writers never get
+    # the same one
+    _, path = _unique(name, "", os.mkdir)
+    for field in dtype.names:
+        open(os.path.join(path, field + ".bin"), 'wb').close()
+    np.save(os.path.join(path, SCHEMA), np.empty(0, dtype=dtype))
+    if path != name:
+        print(
+                "Directory of the same name already exists, data written to",
+                path
+                )
+    return ColumnStore(path)
+
+
+def _store_name(path, prefix, desc):
+    # the directory of a store in path; the descriptions "" and "\b" (the
+    # old default, which erased the separator when printed) are omitted
+    desc = desc.strip("\b")
+    return os.path.join(path, prefix + ("_" + desc if desc else ""))
+
+
+def _encode_text(value, field, dtype):
+    # encodes the text of a string column, checking that it fits in the
+    # column instead of letting numpy truncate it
+    value = np.asarray(value)
+    if value.dtype.kind == 'U':
+        try:
+            value = np.char.encode(value, 'ascii')
+        except UnicodeEncodeError:
+            raise ValueError(
+                    "Column '" + field + "' only holds ASCII text"
+                    ) from None
+    if value.dtype.itemsize > dtype.itemsize:
+        raise ValueError(
+                "Column '{}' holds at most {} characters".format(
+                        field, dtype.itemsize
+                        )
+                )
+    return value
+
+
+class ColumnStore:
+    """A store of columns in a directory (see open_store).
+
+    The columns are read with store[name] (as read-only memory maps) and the
+    rows are added with append.
+
+    Attributes
+    ----------
+    path : `str`
+        The directory of the store
+    dtype : `numpy.dtype`
+        The structured dtype of a row
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dtype = np.load(os.path.join(path, SCHEMA)).dtype
+        self._lock = threading.Lock()
+
+    def __file(self, field):
+        return os.path.join(self.path, field + ".bin")
+
+    def __len__(self):
+        # rows which were only partly written are not counted
+        return min(
+                os.path.getsize(self.__file(f)) // self.dtype[f].itemsize
+                for f in self.dtype.names
+                )
+
+    def __getitem__(self, field):
+        if field not in self.dtype.names:
+            raise KeyError(field)
+        n = len(self)
+        if n == 0:
+            return np.empty(0, dtype=self.dtype[field])
+        return np.memmap(
+                self.__file(field), dtype=self.dtype[field], mode='r',
+                shape=(n,)
+                )
+
+    @property
+    def columns(self):
+        """The names of the columns."""
+        return self.dtype.names
+
+    def read(self):
+        """Returns all columns, as a dictionary of memory maps."""
+        return {f: self[f] for f in self.dtype.names}
+
+    def append(self, **columns):
+        """Appends rows to the store.
+
+        The columns are given as keyword arguments; scalars are repeated for
+        all rows, and the columns which are not given are filled with NaN (or
+        zeros, for integer and string columns). Text which is not ASCII, or
+        which does not fit in its column, raises ValueError.
+        """
+        for field in columns:
+            if field not in self.dtype.names:
+                raise ValueError("Invalid column '" + field + "'")
+            if self.dtype[field].kind == 'S':
+                columns[field] = _encode_text(
+                        columns[field], field, self.dtype[field]
+                        )
+        n = max((np.size(v) for v in columns.values()), default=0)
+        with self._lock:
+            # drops the rows left over from an interrupted append, so the
+            # columns stay aligned
+            rows = len(self)
+            for field in self.dtype.names:
+                dtype = self.dtype[field]
+                if field in columns:
+                    value = np.asarray(columns[field], dtype=dtype)
+                elif dtype.kind == 'f':
+                    value = np.array(np.nan, dtype=dtype)
+                else:
+                    value = np.zeros((), dtype=dtype)
+                value = np.ascontiguousarray(np.broadcast_to(value, (n,)))
+                with open(self.__file(field), 'r+b') as f:
+                    f.truncate(rows * dtype.itemsize)
+                    f.seek(0, os.SEEK_END)
+                    value.tofile(f)
+        return n
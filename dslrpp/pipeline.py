@@ -3,21 +3,28 @@ Does the entire photometry process, from DSLR image processing to photometry
 to period analysis.
 """
 import sys
+from types import SimpleNamespace
+import numpy as np
 from dslrpp import sort, get_offsets, lightcurve
-from dslrpp.analysis import save_lcData, periodogram, est_period
+from dslrpp.analysis import (
+        save_lcData, periodogram, est_period, batch_periodogram,
+        multiband_periodogram
+        )
 from dslrpp.analysis.period import save_pgData
 
 
 def printHelpMsg():
     print(
             "Usage:",
-            "pipeline.py x0 y0 (variable star coords)"
-            "<x1> <y1> <m1> [x2] [y2] [m2]..."
+            "pipeline.py <path> <x0> <y0> (variable star coords) "
+            "<x1> <y1> <m1> [x2] [y2] [m2]... "
             "(reference star coords) [optional args]",
             "Optional arguments:",
             "-b <x> [y] (binning)",
             "-c <r/g/b> (color(s) to use)",
             "-p <min> <max> [precision] (periodogram parameters)",
+            "-w <n> (number of processes used for decoding RAW files)",
+            "-f <n> (detect up to n field stars and use ensemble photometry)",
             sep='\n'
             )
     exit()
@@ -38,140 +45,173 @@ def checkIfFloat(x):
         printHelpMsg()
 
 
-if len(sys.argv) < 6:
-    printHelpMsg()
-
-PATH = sys.argv[1]
-
-for i in range(1, 6):
-    checkIfInt(sys.argv[i])
-checkIfFloat(sys.argv[7])
-
-var_coords = (int(sys.argv[2]), int(sys.argv[3]))
-ref_coords = [(int(sys.argv[4]), int(sys.argv[5]))]
-ref_mags = [int(sys.argv[6])]
-N_STARS = len(ref_coords) + 1
-
-if len(sys.argv) == 8:
-    printHelpMsg()
+def parse_args(argv):
+    """Parses the command line arguments (argv, as in sys.argv) and returns
+    the settings of the pipeline. Invalid arguments print the help message
+    and exit.
+    """
+    if len(argv) < 7:
+        printHelpMsg()
 
-red = False
-green = True
-blue = False
-binX = None
-binY = None
-pMin = 0.01
-pMax = 1
-pP = None
+    for arg in argv[2:6]:
+        checkIfInt(arg)
+    checkIfFloat(argv[6])
+
+    args = SimpleNamespace(
+            path=argv[1],
+            var_coords=(int(argv[2]), int(argv[3])),
+            ref_coords=[(int(argv[4]), int(argv[5]))],
+            ref_mags=[float(argv[6])],
+            red=False, green=True, blue=False, binX=None, binY=None,
+            pMin=0.01, pMax=1, pP=None, workers=None, field=0
+            )
 
-if len(sys.argv) >= 9:
-    i = 8
-    while i <= len(sys.argv)+3:
-        if sys.argv[i][0] == '-':
+    # the other reference stars, followed by the options
+    i = 7
+    while i+2 < len(argv):
+        if argv[i][0] == '-':
             break
-        if sys.argv[i+1][0] == '-':
+        if argv[i+1][0] == '-':
             printHelpMsg()
-        if sys.argv[i+2][0] == '-':
+        if argv[i+2][0] == '-':
             printHelpMsg()
-        checkIfInt(sys.argv[i])
-        checkIfInt(sys.argv[i+1])
-        checkIfFloat(sys.argv[i+2])
-        ref_coords.append((int(sys.argv[i]), int(sys.argv[i+1])))
-        ref_mags.append(sys.argv[i+2])
+        checkIfInt(argv[i])
+        checkIfInt(argv[i+1])
+        checkIfFloat(argv[i+2])
+        args.ref_coords.append((int(argv[i]), int(argv[i+1])))
+        args.ref_mags.append(float(argv[i+2]))
         i += 3
-    if i+1 == len(sys.argv):
-        printHelpMsg()
-    if i+2 <= len(sys.argv):
-        for j in range(i, i+3):
-            if sys.argv[i][0] != '-':
-                printHelpMsg()
+    while i < len(argv):
+        if argv[i][0] != '-' or len(argv[i]) != 2:
+            printHelpMsg()
+        option = argv[i][1]
+        i += 1
+        # every option takes at least one argument
+        if i == len(argv):
+            printHelpMsg()
+        if option == 'b':
+            checkIfInt(argv[i])
+            args.binX = int(argv[i])
+            args.binY = args.binX
             i += 1
-            if sys.argv[i][1] == 'b':
-                checkIfInt(sys.argv[i+1])
-                binX = sys.argv[i+1]
-                binY = binX
-                i += 1
-                try:
-                    if sys.argv[i+2][0] != '-':
-                        checkIfInt(sys.argv[i+2])
-                        binY = int(sys.argv[i+2])
-                        i += 1
-                except IndexError:
-                    break
-            elif sys.argv[i][1] == 'c':
-                if len(sys.argv == i+1):
-                    printHelpMsg()
+            if i < len(argv) and argv[i][0] != '-':
+                checkIfInt(argv[i])
+                args.binY = int(argv[i])
                 i += 1
-                if 'r' in sys.argv[i+1]:
-                    red = True
-                else:
-                    red = False
-                if 'g' in sys.argv[i+1]:
-                    green = True
-                else:
-                    green = False
-                if 'b' in sys.argv[i+1]:
-                    blue = True
-                else:
-                    blue = False
-            elif sys.argv[i][1] == 'p':
-                if len(sys.argv <= i+2):
-                    printHelpMsg()
-                i += 1
-                for arg in sys.argv[i:i+2]:
-                    checkIfFloat(arg)
-                pMin = sys.argv[i]
-                pMax = sys.argv[i+1]
-                i += 2
-                if len(sys.argv) == i:
-                    break
-                if sys.argv[i][0] == '-':
-                    pass
-                else:
-                    checkIfFloat(sys.argv[i])
-                    pP = sys.argv[i]
-                    i += 1
+        elif option == 'c':
+            if 'r' in argv[i]:
+                args.red = True
+            else:
+                args.red = False
+            if 'g' in argv[i]:
+                args.green = True
             else:
+                args.green = False
+            if 'b' in argv[i]:
+                args.blue = True
+            else:
+                args.blue = False
+            i += 1
+        elif option == 'p':
+            if len(argv) < i+2:
                 printHelpMsg()
-
-
-imagesR, imagesG, imagesB = *sort(PATH, red, green, blue, binX, binY)
-
-if imagesR.size != 0:
-    imagesR[0].add_star(*var_coords, name="Var")
-    for i in range(N_STARS-1):
-        imagesR[0].add_star(
-                *ref_coords[i], ref_mags[i], name="Ref{}".format(i+1)
-                )
-    get_offsets(imagesR, global_offset=False, gauss=True)
-    times, mags, errs = lightcurve(imagesR)
-    save_lcData(PATH, times, mags, errs, desc='R')
-    pRange, power = periodogram(times, mags, errs, pMin, pMax, pP)
-    save_pgData(PATH, pRange, power, desc='R')
+            for arg in argv[i:i+2]:
+                checkIfFloat(arg)
+            args.pMin = float(argv[i])
+            args.pMax = float(argv[i+1])
+            i += 2
+            if i < len(argv) and argv[i][0] != '-':
+                checkIfFloat(argv[i])
+                args.pP = float(argv[i])
+                i += 1
+        elif option == 'w':
+            checkIfInt(argv[i])
+            args.workers = int(argv[i])
+            i += 1
+        elif option == 'f':
+            checkIfInt(argv[i])
+            args.field = int(argv[i])
+            i += 1
+        else:
+            printHelpMsg()
+    return args
+
+
+def reduce_channel(images, desc, args):
+    images[0].add_star(*args.var_coords, name="Var")
+    for i, (coords, mag) in enumerate(zip(args.ref_coords, args.ref_mags)):
+        images[0].add_star(*coords, mag, name="Ref{}".format(i+1))
+    if args.field:
+        images[0].detect_stars(max_stars=args.field)
+    # the matched stars are already centroided, so the cheap vectorized
+    # method is used instead of a Gaussian fit per star
+    get_offsets(
+            *images, global_offset=False, gauss=True,
+            centroid='marginal' if args.field else 'gauss',
+            match=args.field > 0
+            )
+    times, mags, errs = lightcurve(
+            *images, comparison='ensemble' if args.field else 'mean',
+            include_refstars=args.field > 0
+            )
+    if args.field:
+        # the light curves of all stars, with the variable first
+        field_mags, field_errs = mags, errs
+        mags, errs = mags[0], errs[0]
+    save_lcData(args.path, times, mags, errs, desc=desc)
+    pRange, power = periodogram(
+            times, mags, errs, args.pMin, args.pMax, args.pP
+            )
+    save_pgData(args.path, pRange, power, desc=desc)
     est_period(pRange, power, n_estimates=2)
-
-if imagesG.size != 0:
-    imagesG[0].add_star(*var_coords, name="Var")
-    for i in range(N_STARS-1):
-        imagesG[0].add_star(
-                *ref_coords[i], ref_mags[i], name="Ref{}".format(i+1)
+    if args.field:
+        # looks for new variables among the field stars
+        stars = (
+                [s for s in images[0].stars if s.isVar]
+                + [s for s in images[0].stars if not s.isVar]
                 )
-    get_offsets(imagesG, global_offset=False, gauss=True)
-    times, mags, errs = lightcurve(imagesG)
-    save_lcData(PATH, times, mags, errs, desc='G')
-    pRange, power = periodogram(times, mags, errs, pMin, pMax, pP)
-    save_pgData(PATH, pRange, power, desc='G')
-    est_period(pRange, power, n_estimates=2)
+        save_lcData(
+                args.path, times, field_mags, field_errs, desc=desc+"_field"
+                )
+        field_pRange, field_power, peaks = batch_periodogram(
+                times, field_mags, field_errs, args.pMin, args.pMax,
+                workers=args.workers
+                )
+        save_pgData(
+                args.path, field_pRange, field_power, desc=desc+"_field"
+                )
+        print("Strongest periodic signals in the field:")
+        strongest = np.argsort(np.nan_to_num(peaks['power'][:, 0], nan=-1.))
+        for i in strongest[::-1][:10]:
+            print(
+                    "\t{}: P = {:.5f}, power = {:.3f}".format(
+                            stars[i].name, peaks['period'][i, 0],
+                            peaks['power'][i, 0]
+                            )
+                    )
+    return times, mags, errs
+
+
+# the guard keeps worker processes (spawned on Windows) from re-running
+# the pipeline when they import this module
+if __name__ == '__main__':
+    args = parse_args(sys.argv)
+    imagesR, imagesG, imagesB = sort(
+            args.path, args.red, args.green, args.blue, args.binX, args.binY,
+            workers=args.workers
+            )
 
-if imagesB.size != 0:
-    imagesB[0].add_star(*var_coords, name="Var")
-    for i in range(N_STARS-1):
-        imagesR[0].add_star(
-                *ref_coords[i], ref_mags[i], name="Ref{}".format(i+1)
+    curves = dict()
+    for images, desc in ((imagesR, 'R'), (imagesG, 'G'), (imagesB, 'B')):
+        if images.size != 0:
+            curves[desc] = reduce_channel(images, desc, args)
+
+    if len(curves) > 1:
+        # a joint period search over all channels
+        desc = ''.join(curves)
+        times, mags, errs = zip(*curves.values())
+        pRange, power = multiband_periodogram(
+                times, mags, errs, args.pMin, args.pMax
                 )
-    get_offsets(imagesB, global_offset=False, gauss=True)
-    times, mags, errs = lightcurve(imagesB)
-    save_lcData(PATH, times, mags, errs, desc='B')
-    pRange, power = periodogram(times, mags, errs, pMin, pMax, pP)
-    save_pgData(PATH, pRange, power, desc='B')
-    est_period(pRange, power, n_estimates=2)
+        save_pgData(args.path, pRange, power, desc=desc)
+        est_period(pRange, power, n_estimates=2)
@@ -1,8 +1,18 @@
-from .process import DSLRImage, Monochrome, ImageType, Color, Star
+from .process import (
+        DSLRImage, Monochrome, ImageType, Color, Star, set_dtype, get_dtype,
+        current_frame, frame_context
+        )
 from .sort import sort
 from .calibrate import calibrate
+from .cache import MasterCache
+from .binning import bin_data
+from .centroid import centroids, compare_centroids
+from .tracks import Tracks, FrameTrack, positions
+from .detect import find_stars, match_stars
 
 __all__ = [
         "DSLRImage", "Monochrome", "Star", "sort", "calibrate", "ImageType",
-        "Color"
+        "Color", "MasterCache", "set_dtype", "get_dtype", "bin_data",
+        "centroids", "compare_centroids", "Tracks", "FrameTrack", "positions",
+        "current_frame", "frame_context", "find_stars", "match_stars"
         ]
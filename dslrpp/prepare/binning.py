@@ -0,0 +1,103 @@
+"""This submodule contains the binning engine used by the image classes.
+
+Binning is done by viewing the array as a grid of windows (a reshape, which
+doesn't copy the data) and reducing it over the window axes, so the data is
+read only once and the output array is the only one allocated.
+"""
+import numpy as np
+
+__all__ = ["bin_data"]
+
+
+def __reduce(blocks, mode, dtype, out):
+    """Auxiliary function; reduces the windows of a reshaped array.
+
+    The windows lie along axes 1 and 3 of the given array.
+    """
+    if mode == 'mean':
+        return np.mean(blocks, axis=(1, 3), dtype=dtype, out=out)
+    if mode == 'sum':
+        return np.sum(blocks, axis=(1, 3), dtype=dtype, out=out)
+    if mode == 'median':
+        return np.median(blocks, axis=(1, 3), out=out)
+    raise ValueError("Invalid argument for 'mode' parameter")
+
+
+def __bin_even(imdata, x, y, mode, dtype, out=None):
+    """Auxiliary function; bins an array whose height and width are divisible
+    by the window height and width.
+    """
+    h, w = imdata.shape[:2]
+    blocks = imdata.reshape((h//y, y, w//x, x) + imdata.shape[2:])
+    return __reduce(blocks, mode, dtype, out)
+
+
+def bin_data(imdata, x, y=None, mode='mean', edge='crop', dtype=None):
+    """Bins the array using windows of the specified width and height.
+
+    Parameters
+    ----------
+    imdata : `numpy.ndarray`
+        The array to be binned. Only the first two (height and width) axes
+        are binned; any further axes (e.g. color) are kept.
+    x : `int`
+        The width of the window
+    y : `int`, optional
+        The height of the window. If not specified, the window is square.
+    mode : `str`, optional
+        The function used to combine the windows: 'mean', 'sum' or 'median'.
+    edge : `str`, optional
+        What to do with the rows and columns that don't fill a whole window
+        at the bottom and right edges: 'crop' discards them, while 'pad' bins
+        them into partial windows, which are reduced over the pixels they
+        contain.
+    dtype : `numpy.dtype`, optional
+        The data type of the result (and of the accumulator for 'mean' and
+        'sum'). By default it is the data type of the input if it is a
+        floating point type, and float64 otherwise.
+
+    Returns
+    -------
+    bindata : `numpy.ndarray`
+        The binned array.
+    """
+    if y is None:
+        y = x
+    if edge not in ('crop', 'pad'):
+        raise ValueError("Invalid argument for 'edge' parameter")
+    if dtype is None:
+        if np.issubdtype(imdata.dtype, np.inexact):
+            dtype = imdata.dtype
+        else:
+            dtype = np.float64
+    if mode == 'median':
+        # the median is computed in the input type, then converted
+        dtype_in = None
+    else:
+        dtype_in = dtype
+    h, w = imdata.shape[:2]
+    hb = h - h % y
+    wb = w - w % x
+    if edge == 'crop' or (hb == h and wb == w):
+        out = np.empty((hb//y, wb//x) + imdata.shape[2:], dtype=dtype)
+        __bin_even(imdata[:hb, :wb], x, y, mode, dtype_in, out)
+        return out
+
+    out = np.empty((-(-h//y), -(-w//x)) + imdata.shape[2:], dtype=dtype)
+    __bin_even(imdata[:hb, :wb], x, y, mode, dtype_in, out[:hb//y, :wb//x])
+    if wb < w:  # partial windows along the right edge
+        __bin_even(
+                imdata[:hb, wb:], w - wb, y, mode, dtype_in,
+                out[:hb//y, -1:]
+                )
+    if hb < h:  # partial windows along the bottom edge
+        __bin_even(
+                imdata[hb:, :wb], x, h - hb, mode, dtype_in,
+                out[-1:, :wb//x]
+                )
+    if hb < h and wb < w:  # the bottom right corner
+        __bin_even(
+                imdata[hb:, wb:], w - wb, h - hb, mode, dtype_in,
+                out[-1:, -1:]
+                )
+    return out
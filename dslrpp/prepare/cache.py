@@ -0,0 +1,191 @@
+"""This submodule contains the MasterCache class, which stores master
+calibration frames as FITS files, so that they don't have to be stacked again
+in later runs.
+
+A master frame is identified by a key computed from the content hashes and
+modification times of the frames it was stacked from, their image type, color,
+binning and exposure times, the stacking mode, and the keys of the master
+frames that were used to calibrate them (e.g. the master bias for darks).
+"""
+import os
+import json
+import hashlib
+import numpy as np
+from astropy.io import fits
+from astropy.time import Time
+from .process import Monochrome, ImageType, Color
+
+__all__ = ["MasterCache"]
+
+
+class _Origin:
+    # stands in for the frames a cached master frame was stacked from
+    def __init__(self, header, path):
+        self.exptime = header['EXPTIME']
+        self.jdate = Time(header['DATE-OBS'], format='isot', scale='utc').jd
+        self.impath = path
+        self.imtype = ImageType[header['IMAGETYP']]
+        self._binX = header['XBINNING']
+        self._binY = header['YBINNING']
+        self._lazy = False
+
+
+class MasterCache:
+    """Stores master calibration frames in a folder as FITS files.
+
+    When the total size of the cached files exceeds max_size (in bytes), the
+    least recently used master frames are deleted.
+    """
+    def __init__(self, path, max_size=2**30):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+        self._indexPath = os.path.join(self.path, 'hashes.json')
+        try:
+            with open(self._indexPath) as f:
+                self._hashes = json.load(f)
+        except (OSError, ValueError):
+            self._hashes = dict()
+
+    def fileHash(self, path):
+        """Returns the SHA-1 hash of the file content.
+
+        The hashes are stored along with the modification time and size of the
+        file, so each file is only read again after it changes.
+        """
+        digest, changed = self._hash(path)
+        if changed:
+            self._saveHashes()
+        return digest
+
+    def _hash(self, path):
+        # returns the hash of the file, and whether it had to be computed
+        # (the index is then out of date)
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        try:
+            mtime, size, digest = self._hashes[path]
+            if mtime == st.st_mtime and size == st.st_size:
+                return digest, False
+        except KeyError:
+            pass
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self._hashes[path] = [st.st_mtime, st.st_size, digest]
+        return digest, True
+
+    def _saveHashes(self):
+        with open(self._indexPath + '.part', 'w') as f:
+            json.dump(self._hashes, f)
+        os.replace(self._indexPath + '.part', self._indexPath)
+
+    def key(
+            self, paths, itype, color, exptimes, binning=(1, 1),
+            mode='median', parents=()
+            ):
+        """Computes the key of the master frame stacked from the given files.
+
+        color is None for frames holding the whole Bayer mosaic. parents are
+        the keys of the master frames used to calibrate the frames before
+        stacking.
+        """
+        h = hashlib.sha1()
+        changed = False
+        for p in sorted(os.path.abspath(p) for p in paths):
+            digest, new = self._hash(p)
+            changed |= new
+            h.update(digest.encode())
+            h.update(repr(os.stat(p).st_mtime).encode())
+        # the index is written once for all the files
+        if changed:
+            self._saveHashes()
+        h.update(repr((
+                ImageType(itype).name,
+                'CFA' if color is None else Color(color).name,
+                tuple(int(b) for b in binning),
+                tuple(sorted({float(t) for t in exptimes})),
+                mode,
+                tuple(parents)
+                )).encode())
+        return h.hexdigest()
+
+    def frameKey(self, frames, mode='median', parents=()):
+        """Computes the key of the master frame stacked from the given
+        Monochrome frames.
+        """
+        return self.key(
+                [im.impath for im in frames], frames[0].imtype,
+                frames[0].imcolor, [im.exptime for im in frames],
+                (frames[0]._binX, frames[0]._binY), mode, parents
+                )
+
+    def load(self, key):
+        """Returns the cached master frame as a Monochrome, or None if it
+        isn't cached.
+        """
+        path = self._path(key)
+        try:
+            with fits.open(path) as hdul:
+                header = hdul[0].header
+                data = hdul[0].data
+                data = data.astype(data.dtype.newbyteorder('='))
+        except FileNotFoundError:
+            return None
+        os.utime(path)  # marks the master frame as recently used
+        print("Loaded master frame from cache:", path)
+        color = header['COLOR']
+        master = Monochrome(
+                data, _Origin(header, path),
+                None if color == 'CFA' else Color[color], stacked=True
+                )
+        master.cacheKey = key
+        return master
+
+    def store(self, key, master):
+        """Writes the master frame to the cache, then deletes the least
+        recently used master frames if the cache is too large.
+        """
+        path = self._path(key)
+        hdu = fits.PrimaryHDU(np.asarray(master.imdata))
+        hdu.header['EXPTIME'] = master.exptime
+        hdu.header['DATE-OBS'] = Time(
+                master.jdate, format='jd', scale='utc'
+                ).isot
+        hdu.header['IMAGETYP'] = master.imtype.name
+        hdu.header['XBINNING'] = master._binX
+        hdu.header['YBINNING'] = master._binY
+        hdu.header['COLOR'] = (
+                'CFA' if master.imcolor is None else master.imcolor.name
+                )
+        hdu.writeto(path + '.part', overwrite=True)
+        os.replace(path + '.part', path)
+        master.cacheKey = key
+        print("Stored master frame in cache:", path)
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        """Deletes the least recently used master frames until the size of
+        the cache is within max_size. The file given by keep is never deleted.
+        """
+        files = [
+                os.path.join(self.path, f) for f in os.listdir(self.path)
+                if f.endswith('.fits')
+                ]
+        files = sorted(
+                [(os.stat(f).st_mtime, os.stat(f).st_size, f) for f in files]
+                )
+        size = sum(s for _, s, _ in files)
+        for _, s, f in files:
+            if size <= self.max_size:
+                break
+            if f == keep:
+                continue
+            print("Evicting master frame from cache:", f)
+            os.remove(f)
+            size -= s
+
+    def _path(self, key):
+        return os.path.join(self.path, key + '.fits')
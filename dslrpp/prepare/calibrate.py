@@ -2,13 +2,63 @@
 """
 import numpy as np
 from ..tools.stack import stack
-from .process import ImageType, Monochrome
+from .process import ImageType, Monochrome, Color, _cfaPlanes
 
 __all__ = ["calibrate"]
 
 
+def __frames(frames):
+    # wraps a single (master) frame into a list
+    if isinstance(frames, Monochrome):
+        return [frames]
+    return list(frames)
+
+
+def __normalize(flat):
+    """Auxiliary function; turns the master flat field into the array the
+    light frames are multiplied by.
+
+    The photosites of each color of a RGGB mosaic are normalized separately,
+    as they would be if the channels were calibrated one by one.
+    """
+    imdata = flat.imdata
+    if flat.imcolor is not None:
+        return (imdata.mean(dtype=np.float64)/imdata).astype(imdata.dtype)
+    flatdata = np.empty(imdata.shape, dtype=imdata.dtype)
+    for c in Color:
+        planes = _cfaPlanes(imdata, c)
+        mean = np.mean([p.mean(dtype=np.float64) for p in planes])
+        for p, out in zip(planes, _cfaPlanes(flatdata, c)):
+            np.divide(mean, p, out=out)
+    return flatdata
+
+
+def __master(frames, mode, cache=None, parents=(), prepare=None):
+    """Auxiliary function; stacks the frames into a master frame.
+
+    If the frames are already a master frame, they are returned as they are.
+    If a cache is given, the master frame is loaded from it if possible, and
+    stored in it otherwise. prepare is called on the frames before stacking.
+    """
+    if isinstance(frames, Monochrome):
+        return frames
+    key = None
+    if cache is not None:
+        key = cache.frameKey(frames, mode, parents)
+        master = cache.load(key)
+        if master is not None:
+            return master
+    if prepare is not None:
+        prepare(frames)
+    master = stack(frames, mode=mode)
+    if cache is not None:
+        cache.store(key, master)
+    return master
+
+
 def calibrate(
-        lights, bias, dark, flat, fbias=[], fdark=[], masterMode='median'
+        lights, bias, dark, flat, fbias=[], fdark=[], masterMode='median',
+        cache=None
         ):
     """Calibrates (reduces) the light frames by subtracting bias and dark
     frames from light frames and flat fields, then dividing the calibrated
@@ -16,8 +66,18 @@ def calibrate(
 
     If calibration frames for flat
     fields are not provided, calibration frames for light frames will be used.
+
+    The frames can also hold the whole RGGB mosaic (color None), in which
+    case all channels are calibrated at once.
+
+    Each of bias, dark and flat can also be a single, already stacked master
+    frame. If a MasterCache is given, master frames are loaded from it instead
+    of being stacked whenever possible.
     """
-    images = np.concatenate((lights, bias, dark, flat, fbias, fdark))
+    images = np.concatenate((
+            lights, __frames(bias), __frames(dark), __frames(flat),
+            __frames(fbias), __frames(fdark)
+            ))
 
     print("Calibrating images:", [str(im) for im in lights])
 
@@ -37,60 +97,85 @@ def calibrate(
         raise ValueError(
                 "Light frames must be LIGHT image type; given:", itypes
                 )
-    itypes = {im.imtype for im in np.concatenate((bias, fbias))}
+    itypes = {im.imtype for im in __frames(bias) + __frames(fbias)}
     if itypes != {ImageType.BIAS}:
         raise ValueError("Bias frames must be BIAS image type; given:", itypes)
-    itypes = {im.imtype for im in flat}
+    itypes = {im.imtype for im in __frames(flat)}
     if itypes != {ImageType.FLAT}:
         raise ValueError(
                 "Flat field frames must be FLAT image type; given:", itypes
                 )
-    itypes = {im.imtype for im in np.concatenate((dark, fdark))}
+    itypes = {im.imtype for im in __frames(dark) + __frames(fdark)}
     if itypes != {ImageType.DARK}:
         raise ValueError(
                 "Dark frames must be DARK image type; given:", itypes
                 )
 
     # print("Before dark:", lights[0].imdata.min(), lights[0].imdata.max())
-    bias = stack(bias, mode=masterMode)
-    for im in dark:
-        im.imdata -= bias.imdata
-    dark = stack(dark, mode=masterMode)  # creating master frames
-#    if fbias == []:
-#        fbias = bias
-#    else:
-#        print("fbias:", fbias)
-#        fbias = stack(fbias, mode=masterMode)
-#    if fdark == []:
-#        fdark = dark
-#    else:
-#        print("fdark", fdark)
-#        fdark = stack(fdark, mode=masterMode)
-
-    for im in flat:  # calibrating flat fields
-        if fdark != []:
-            if im.exptime != fdark.exptime:
-                raise ValueError(
-                        "Dark frames must have the same exposure as their "
-                        "respective light frames (provided "
-                        + str(fdark.exptime) + " instead of "
-                        + str(im.exptime) + ")"
-                        )
-            im.imdata -= fdark.imdata
-        if fbias != []:
+    def subtract_bias(frames):
+        for im in frames:
+            im.imdata -= bias.imdata
+
+    # creating master frames
+    bias = __master(bias, masterMode, cache)
+    dark = __master(
+            dark, masterMode, cache,
+            parents=[getattr(bias, 'cacheKey', None)], prepare=subtract_bias
+            )
+
+    # the master frames for the flat fields (None if not given); the flats
+    # are calibrated with these, so their keys are the parents of the flat
+    def subtract_fbias(frames):
+        for im in frames:
             im.imdata -= fbias.imdata
-    flat = stack(flat, mode=masterMode)
-    flat.imdata = flat.imdata.mean()/flat.imdata
+
+    fbias = (
+            __master(fbias, masterMode, cache)
+            if len(__frames(fbias)) else None
+            )
+    fdark = (
+            __master(
+                fdark, masterMode, cache,
+                parents=[getattr(fbias, 'cacheKey', None)],
+                prepare=None if fbias is None else subtract_fbias
+                )
+            if len(__frames(fdark)) else None
+            )
+
+    def calibrate_flats(frames):
+        for im in frames:  # calibrating flat fields
+            if fdark is not None:
+                if im.exptime != fdark.exptime:
+                    raise ValueError(
+                            "Dark frames must have the same exposure as their "
+                            "respective light frames (provided "
+                            + str(fdark.exptime) + " instead of "
+                            + str(im.exptime) + ")"
+                            )
+                im.imdata -= fdark.imdata
+            if fbias is not None:
+                im.imdata -= fbias.imdata
+
+    parents = [
+            getattr(master, 'cacheKey', None) for master in (fbias, fdark)
+            if master is not None
+            ]
+    flat = __master(
+            flat, masterMode, cache, parents=parents,
+            prepare=calibrate_flats
+            )
+    # the master flat itself is left untouched, since it may be reused
+    flatdata = __normalize(flat)
 
     for im in lights:  # calibrating science frames
         if im.exptime != dark.exptime:
             raise ValueError(
                     "Dark frames must have the same exposure as their "
-                    "respective light frames (provided " + str(fdark.exptime)
+                    "respective light frames (provided " + str(dark.exptime)
                     + " instead of " + str(im.exptime) + ")"
                     )
         im.imdata -= dark.imdata
         # print("After dark:", im.imdata.min(), im.imdata.max())
         im.imdata -= bias.imdata
         # print("After bias:", im.imdata.min(), im.imdata.max())
-        im.imdata *= flat.imdata
+        im.imdata *= flatdata
@@ -0,0 +1,213 @@
+"""This submodule contains the centroid engine used for locating stars.
+
+All stars of a frame are measured at once: the windows around the stars are
+cut out into a single (number of stars, 2w, 2w) array, and the centroids are
+computed on the whole array. The available methods are:
+
+    'moments'   the first moments (center of mass) of the background
+                subtracted window
+    'quadratic' the peak of a parabola fitted through the brightest pixel and
+                its neighbours
+    'marginal'  the peaks of Gaussians fitted through the brightest pixel and
+                its neighbours in the marginal (row and column) sums
+    'gauss'     a full 2D Gaussian fit (photutils.centroids.fit_2dgaussian),
+                one star at a time; the slowest, but the most accurate method
+"""
+import time
+import numpy as np
+from photutils.centroids import fit_2dgaussian
+
+__all__ = ["centroids", "fwhm", "compare_centroids", "CENTROID_METHODS"]
+
+CENTROID_METHODS = ('moments', 'quadratic', 'marginal', 'gauss')
+
+
+def __cutouts(imdata, x, y, w):
+    """Auxiliary function; cuts the (2w)x(2w) windows starting at (x-w, y-w)
+    out of the image. Pixels outside the image are replaced by the nearest
+    edge pixels.
+    """
+    r = np.arange(-w, w)
+    iy = np.clip(y[:, np.newaxis] + r, 0, imdata.shape[0] - 1)
+    ix = np.clip(x[:, np.newaxis] + r, 0, imdata.shape[1] - 1)
+    return imdata[iy[:, :, np.newaxis], ix[:, np.newaxis, :]].astype(
+            np.float64
+            )
+
+
+def __moments(cut):
+    """Auxiliary function; computes the first moments and the standard
+    deviations of the windows, after subtracting their median.
+    """
+    cut = cut - np.median(cut, axis=(1, 2), keepdims=True)
+    np.maximum(cut, 0, out=cut)
+    j = np.arange(cut.shape[1])
+    m0 = cut.sum(axis=(1, 2))
+    px = cut.sum(axis=1) / m0[:, np.newaxis]
+    py = cut.sum(axis=2) / m0[:, np.newaxis]
+    xm = px @ j
+    ym = py @ j
+    sx = np.sqrt(np.sum(px * (j - xm[:, np.newaxis])**2, axis=1))
+    sy = np.sqrt(np.sum(py * (j - ym[:, np.newaxis])**2, axis=1))
+    return xm, ym, sx, sy
+
+
+def __peak(cut):
+    """Auxiliary function; returns the position of the brightest pixel of
+    every window, kept off the edges so that it always has neighbours.
+    """
+    n, h, w = cut.shape
+    iy, ix = np.unravel_index(cut.reshape(n, -1).argmax(axis=1), (h, w))
+    return np.clip(iy, 1, h - 2), np.clip(ix, 1, w - 2)
+
+
+def __vertex(f0, f1, f2):
+    """Auxiliary function; returns the offset of the vertex of the parabola
+    through (-1, f0), (0, f1) and (1, f2) from the middle point, and its
+    second derivative.
+    """
+    d2 = f0 - 2*f1 + f2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        off = np.where(d2 < 0, 0.5 * (f0 - f2) / d2, 0.)
+    return off, d2
+
+
+def __quadratic(cut):
+    """Auxiliary function; fits parabolas through the brightest pixel of
+    every window and its neighbours along each axis.
+    """
+    k = np.arange(len(cut))
+    iy, ix = __peak(cut)
+    xoff, _ = __vertex(cut[k, iy, ix-1], cut[k, iy, ix], cut[k, iy, ix+1])
+    yoff, _ = __vertex(cut[k, iy-1, ix], cut[k, iy, ix], cut[k, iy+1, ix])
+    _, _, sx, sy = __moments(cut)
+    return ix + xoff, iy + yoff, sx, sy
+
+
+def __gauss1d(p):
+    """Auxiliary function; fits Gaussians through the brightest element of
+    every row of p and its neighbours. Returns the centers and the standard
+    deviations.
+    """
+    k = np.arange(len(p))
+    i = np.clip(p.argmax(axis=1), 1, p.shape[1] - 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lp = np.log(np.maximum(p, np.finfo(np.float64).tiny))
+        off, d2 = __vertex(lp[k, i-1], lp[k, i], lp[k, i+1])
+        sigma = np.where(d2 < 0, np.sqrt(-1 / d2), np.nan)
+    return i + off, sigma
+
+
+def __marginal(cut):
+    """Auxiliary function; fits Gaussians to the marginal sums of the
+    background subtracted windows.
+    """
+    cut = cut - np.median(cut, axis=(1, 2), keepdims=True)
+    xm, sx = __gauss1d(cut.sum(axis=1))
+    ym, sy = __gauss1d(cut.sum(axis=2))
+    return xm, ym, sx, sy
+
+
+def __gauss(cut):
+    """Auxiliary function; fits a 2D Gaussian to every window."""
+    n = len(cut)
+    xm, ym = np.full(n, cut.shape[2] / 2), np.full(n, cut.shape[1] / 2)
+    sx, sy = np.full(n, np.nan), np.full(n, np.nan)
+    for i, c in enumerate(cut):
+        try:
+            gaussian = fit_2dgaussian(c)
+        except ValueError:
+            print("Gaussian fit failed, keeping the window center")
+            continue
+        xm[i] = gaussian.x_mean.value
+        ym[i] = gaussian.y_mean.value
+        sx[i] = gaussian.x_stddev.value
+        sy[i] = gaussian.y_stddev.value
+    return xm, ym, sx, sy
+
+
+def centroids(imdata, x, y, method='moments', w=5):
+    """Computes the centroids of stars in the image.
+
+    Parameters
+    ----------
+    imdata : `numpy.ndarray`
+        The image data
+    x, y : array_like
+        The (approximate) pixel coordinates of the stars; they are truncated
+        to whole pixels, and the (2w)x(2w) windows starting at (x-w, y-w) are
+        searched. They may be empty, in which case empty arrays are
+        returned.
+    method : `str`, optional
+        'moments', 'quadratic', 'marginal' or 'gauss'
+    w : `int`, optional
+        The half-size of the windows
+
+    Returns
+    -------
+    x, y : `numpy.ndarray`\0s
+        The centroids of the stars
+    sx, sy : `numpy.ndarray`\0s
+        The standard deviations of the star profiles along each axis
+        ('quadratic', and the other methods where the fit fails, use the
+        second moments). They are NaN for windows without any signal.
+    """
+    if method not in CENTROID_METHODS:
+        raise ValueError("Invalid argument for 'method' parameter")
+    x = np.atleast_1d(np.asarray(x)).astype(int)
+    y = np.atleast_1d(np.asarray(y)).astype(int)
+    if not len(x):
+        return tuple(np.empty(0) for _ in range(4))
+    cut = __cutouts(imdata, x, y, w)
+    if method == 'moments':
+        xm, ym, sx, sy = __moments(cut)
+    elif method == 'quadratic':
+        xm, ym, sx, sy = __quadratic(cut)
+    elif method == 'marginal':
+        xm, ym, sx, sy = __marginal(cut)
+    else:
+        xm, ym, sx, sy = __gauss(cut)
+    # failed fits have no widths; the second moments are used instead
+    failed = ~(np.isfinite(sx) & np.isfinite(sy))
+    if method != 'moments' and failed.any():
+        _, _, sx[failed], sy[failed] = __moments(cut[failed])
+    return x - w + xm, y - w + ym, sx, sy
+
+
+def fwhm(sx, sy):
+    """Computes the aperture radius of stars from the standard deviations of
+    their profiles, in the same way as for Gaussian fits.
+    """
+    return 2 * np.sqrt(sx + sy) * np.sqrt(2*np.log(2))
+
+
+def compare_centroids(imdata, x, y, w=5, repeat=10):
+    """Benchmarks the centroid methods against each other.
+
+    Every method is run repeat times on all the stars; the running times and
+    the deviations of the centroids from the ones of the 'gauss' method are
+    printed.
+
+    Returns
+    -------
+    results : `dict`
+        For every method, the mean running time and the centroids
+    """
+    results = dict()
+    for method in CENTROID_METHODS:
+        n = 1 if method == 'gauss' else repeat
+        t = time.perf_counter()
+        for _ in range(n):
+            xc, yc, _, _ = centroids(imdata, x, y, method, w)
+        results[method] = ((time.perf_counter() - t) / n, xc, yc)
+    _, xg, yg = results['gauss']
+    for method, (t, xc, yc) in results.items():
+        d = np.hypot(xc - xg, yc - yg)
+        print(
+                "{}: {:.3g} ms, deviation from 'gauss' max {:.3f} px, "
+                "RMS {:.3f} px".format(
+                        method, t * 1e3, np.nanmax(d),
+                        np.sqrt(np.nanmean(d**2))
+                        )
+                )
+    return results
@@ -0,0 +1,145 @@
+"""This submodule contains the automatic detection of stars, and the matching
+of stars between frames.
+
+Stars are detected as local maxima above a threshold set from the robust
+statistics of the background, and refined with the centroid engine. To track
+the stars of a frame in another one, their positions are shifted by the
+global offset between the frames and matched to the nearest sources detected
+in the other frame, using a KD-tree; the cost per frame barely depends on the
+number of stars.
+"""
+import numpy as np
+from scipy.ndimage import maximum_filter
+from scipy.spatial import cKDTree
+from .centroid import centroids, fwhm
+from .tracks import positions
+
+__all__ = ["find_stars", "match_stars"]
+
+
+def __background(imdata):
+    """Auxiliary function; estimates the level and the noise of the background
+    from a subsample of the image, using the median and the median absolute
+    deviation.
+    """
+    sample = imdata[::4, ::4]
+    level = np.median(sample)
+    noise = 1.4826 * np.median(np.abs(sample - level))
+    return level, noise
+
+
+def find_stars(imdata, nsigma=5., size=5, max_stars=None, method='marginal',
+               w=5):
+    """Detects the stars in the image.
+
+    Parameters
+    ----------
+    imdata : `numpy.ndarray`
+        The image data
+    nsigma : `float`, optional
+        The detection threshold, in standard deviations of the background
+        above the background level
+    size : `int`, optional
+        The size of the neighbourhood in which a star has to be the brightest
+        pixel; sources closer than this are merged.
+    max_stars : `int`, optional
+        The maximum number of stars returned (the brightest ones)
+    method : `str`, optional
+        The centroid method used for refining the positions (see
+        centroid.centroids)
+    w : `int`, optional
+        The half-size of the centroid windows; stars closer to the edge are
+        discarded.
+
+    Returns
+    -------
+    x, y : `numpy.ndarray`\0s
+        The centroids of the stars, brightest first
+    peak : `numpy.ndarray`
+        The brightest pixel of every star
+    r : `numpy.ndarray`
+        The aperture radius of every star, estimated from its profile
+    """
+    level, noise = __background(imdata)
+    peaks = imdata == maximum_filter(imdata, size=size, mode='nearest')
+    peaks &= imdata > level + nsigma * noise
+    border = max(size, w)
+    peaks[:border] = peaks[-border:] = False
+    peaks[:, :border] = peaks[:, -border:] = False
+    y, x = np.nonzero(peaks)
+    peak = imdata[y, x]
+    if not len(x):
+        # nothing above the threshold (e.g. a cloudy frame)
+        empty = np.empty(0)
+        return empty, empty.copy(), peak, empty.copy()
+    order = np.argsort(peak)[::-1]
+    x, y, peak = x[order], y[order], peak[order]
+
+    # flat-topped (e.g. saturated) stars have several maxima; only the first
+    # (brightest) one is kept
+    pairs = cKDTree(np.column_stack([x, y])).query_pairs(
+            size, output_type='ndarray'
+            )
+    keep = np.ones(len(x), dtype=bool)
+    keep[pairs.max(axis=1)] = False
+    x, y, peak = x[keep], y[keep], peak[keep]
+    if max_stars is not None:
+        x, y, peak = x[:max_stars], y[:max_stars], peak[:max_stars]
+
+    xc, yc, sx, sy = centroids(imdata, x, y, method, w)
+    return xc, yc, peak, fwhm(sx, sy)
+
+
+def match_stars(img, parent, shift, radius=3., nsigma=5., size=5,
+                method='marginal', w=5):
+    """Copies the stars of the parent frame into the frame.
+
+    The positions of the stars in the parent frame are shifted by the global
+    offset, and each star is moved to the nearest star detected in the frame
+    within the radius (in pixels). If several stars share the nearest
+    detection, only the closest of them is moved to it; stars without a
+    match keep the shifted position.
+
+    Parameters
+    ----------
+    img : `Monochrome`
+        The frame the stars are copied into
+    parent : `Monochrome`
+        The frame containing the stars
+    shift : array_like
+        The offset of the frame from the parent frame, in a (y, x) format
+
+    Returns
+    -------
+    matched : `numpy.ndarray`
+        For every star of the parent frame, whether it was matched to a
+        detected star
+    """
+    stars = parent.stars
+    x, y = positions(parent, stars)
+    predicted = np.column_stack([x + shift[1], y + shift[0]])
+    xd, yd, _, _ = find_stars(img.imdata, nsigma, size, None, method, w)
+    if len(xd):
+        dist, i = cKDTree(np.column_stack([xd, yd])).query(
+                predicted, distance_upper_bound=radius
+                )
+        matched = np.isfinite(dist)
+        # a detection claimed by several stars goes to the nearest one only;
+        # the others stay unmatched, so their tracks never merge
+        claims = np.nonzero(matched)[0]
+        claims = claims[np.lexsort((dist[claims], i[claims]))]
+        duplicate = i[claims][1:] == i[claims][:-1]
+        matched[claims[1:][duplicate]] = False
+        predicted[matched] = np.column_stack([xd, yd])[i[matched]]
+    else:
+        matched = np.zeros(len(stars), dtype=bool)
+    names = {s.name: s for s in img.stars}
+    for s, (xs, ys) in zip(stars, predicted):
+        s = names.get(s.name, s)
+        if s.name not in names:
+            img.stars.append(s)
+        s._setCoords(img, xs, ys)
+    print(
+            "Matched {} of {} stars".format(matched.sum(), len(stars))
+            )
+    return matched
@@ -5,27 +5,46 @@ for a frame, as well as the methods for binning, extracting monochrome
 channels, and writing the file to FITS format.
 """
 import os
+import mmap
+import threading
+import itertools
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from enum import IntEnum
 from fractions import Fraction
 from datetime import datetime
 from astropy.time import Time
 from astropy.io import fits
 from photutils import CircularAperture, CircularAnnulus
-from photutils.centroids import fit_2dgaussian  # , GaussianConst2D
 from skimage.feature import register_translation
-from skimage.measure import block_reduce
 import exifread
 import numpy as np
 from rawkit.raw import Raw
 import libraw
 from matplotlib import pyplot as plt
+from .binning import bin_data
+from .centroid import centroids, fwhm
+from .tracks import Tracks, _Column, positions
+from .detect import find_stars
 
-__all__ = ["ImageType", "Color", "DSLRImage", "Monochrome", "Star"]
+__all__ = [
+        "ImageType", "Color", "DSLRImage", "Monochrome", "Star", "set_dtype",
+        "get_dtype", "current_frame", "frame_context"
+        ]
 
 w = 5
 # polusirina prozora
 # jos uvek ne znamo koja vrednost bi morala da bude
-CurrentFrame = None
+
+_currentFrame = ContextVar('current_frame', default=None)
+# the frame in which star coordinates are looked up by default; every thread
+# (and every asyncio task) has its own
+
+_fileCounters = defaultdict(itertools.count)
+_starCounter = itertools.count(1)
+_counterLock = threading.Lock()
+# counters for the serialized file names and the default star names
 
 
 class ImageType(IntEnum):
@@ -41,21 +60,186 @@ class Color(IntEnum):
     BLUE = 2
 
 
-def _get_current_frame():
-    return CurrentFrame
+_dtype = ContextVar('dtype', default=np.dtype(np.float32))
+# the data type of the image data once it is converted from the RAW data;
+# like the current frame, it is local to the thread (and the context), so
+# workers started in new threads or processes see the default
+
+
+def __float_dtype(dtype):
+    # checks that the data type is a floating point type
+    dtype = np.dtype(dtype)
+    if not np.issubdtype(dtype, np.floating):
+        raise TypeError("The data type must be a floating point type")
+    return dtype
+
+
+def set_dtype(dtype):
+    """Sets the floating point data type the image data is converted to when
+    channels are extracted from the RAW data (float32 by default), in the
+    current thread.
+
+    The RAW data itself is kept in its original integer type. Setting the type
+    to float64 reproduces the full-precision results. The type can also be
+    passed to sort, stack, binImage or extractChannel directly.
+
+    The type is not seen by threads or processes started afterwards (e.g.
+    the workers of a ThreadPoolExecutor or a ProcessPoolExecutor). Functions
+    of this package which use workers resolve the type in the calling thread
+    and pass it on; code running in workers of its own should pass the type
+    explicitly.
+    """
+    _dtype.set(__float_dtype(dtype))
+
+
+def get_dtype(dtype=None):
+    """Returns the floating point data type used for the image data: dtype, or
+    the type set with set_dtype if it is None. Integer (and other non
+    floating point) types raise TypeError.
+    """
+    if dtype is None:
+        return _dtype.get()
+    return __float_dtype(dtype)
+
+
+def current_frame():
+    """Returns the current frame of this thread (see frame_context)."""
+    return _currentFrame.get()
+
+
+@contextmanager
+def frame_context(frame):
+    """Makes the frame the current frame within the with block.
+
+    Star coordinates (Star.get_x, Star.get_y and the coordinates printed by
+    the Star class) are looked up in the current frame. The current frame is
+    local to the thread, so frames can be processed concurrently.
+    """
+    token = _currentFrame.set(frame)
+    try:
+        yield frame
+    finally:
+        _currentFrame.reset(token)
+
+
+def _unique(name, ext, create):
+    """Calls create on the path name + ext, or name_1 + ext, name_2 + ext...
+    until it doesn't raise FileExistsError, and returns its result along with
+    the path.
+
+    As long as create fails atomically on existing paths (e.g. os.mkdir),
+    concurrent writers never get the same path.
+    """
+    path = name + ext
+    n = 0
+    while True:
+        try:
+            return create(path), path
+        except FileExistsError:
+            n += 1
+            path = name + "_" + str(n) + ext
+
+
+def _exclusive(name, ext):
+    """Creates a new file named name + ext, or name_1 + ext, name_2 + ext...
+    if the file already exists, and returns it opened for writing along with
+    its path.
+
+    The file is created atomically, so concurrent writers never get the same
+    file.
+    """
+    fd, path = _unique(
+            name, ext,
+            lambda p: os.open(p, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+            )
+    return os.fdopen(fd, 'wb'), path
 
 
-def _demosaic(im):
+def _demosaic(im, dtype=None):
     """Demosaics the image,
-    i.e. turns a RGGB monochrome array into a RGB array.
+    i.e. turns a RGGB monochrome array into a RGB array of type dtype (see
+    get_dtype).
+
+    Only the output array is allocated; the channels are read from views of
+    the mosaic.
+    """
+    out = np.empty((len(im)//2, len(im[0])//2, 3), dtype=get_dtype(dtype))
+    for c in Color:
+        _cfaChannel(im, c, out=out[:, :, c.value])
+    return out
+
+
+def _cfaPlanes(im, color):
+    """Returns the views of the RGGB mosaic containing the photosites of the
+    specified color (one for red and blue, two for green).
+    """
+    im = im[:len(im) - len(im) % 2, :len(im[0]) - len(im[0]) % 2]
+    return {
+            Color.RED: [im[0::2, 0::2]],
+            Color.GREEN: [im[0::2, 1::2], im[1::2, 0::2]],
+            Color.BLUE: [im[1::2, 1::2]],
+            }[color]
+
+
+def _cfaChannel(
+        im, color, binX=1, binY=None, out=None, edge='crop', dtype=None
+        ):
+    """Extracts the specified channel from the RGGB mosaic, giving the same
+    result as extracting it from the demosaiced image.
+
+    The green channel is the mean of both green photosites. If binning is
+    specified, the channel is binned (by averaging) at the same time; see
+    bin_data for the edge argument. The channel is computed from views of the
+    mosaic, so only arrays of the size of the output are allocated. The
+    output has the data type dtype (see get_dtype), unless out is given.
     """
-    _im = np.resize(im, (len(im)-len(im) % 2, len(im[0])-len(im[0]) % 2))
-    _im = np.reshape(_im, (len(im)//2, 2, len(im[0])//2, 2))
-    im = np.empty((len(im)//2, len(im[0])//2, 3))
-    im[:, :, 0] = _im[:, 0, :, 0]
-    im[:, :, 1] = (_im[:, 0, :, 1] + _im[:, 1, :, 0])/2
-    im[:, :, 2] = _im[:, 1, :, 1]
-    return im
+    if binY is None:
+        binY = binX
+    dtype = get_dtype(dtype) if out is None else out.dtype
+    planes = _cfaPlanes(im, color)
+    if binX != 1 or binY != 1:
+        planes = [bin_data(p, binX, binY, 'mean', edge, dtype) for p in planes]
+    if out is None:
+        out = np.empty(planes[0].shape, dtype=dtype)
+    out[...] = planes[0]
+    if len(planes) > 1:
+        np.add(out, planes[1], out=out)
+        out /= 2
+    return out
+
+
+def _readRaw(impath):
+    """Decodes a RAW file and reads its metadata.
+
+    Defined at module level so that it can be dispatched to worker processes.
+    Returns the RGGB mosaic (cropped to even dimensions, in the data type of
+    the RAW file), the exposure time and the Julian date.
+    """
+    print("Reading file: " + impath)
+    with Raw(impath) as img:
+        idata = np.array(img.raw_image(), dtype=np.uint16)
+    idata = idata[:len(idata) - len(idata) % 2,
+                  :len(idata[0]) - len(idata[0]) % 2]
+    exptime, jdate = _readExif(impath)
+    return idata, exptime, jdate
+
+
+def _readExif(impath):
+    """Reads the exposure time and the Julian date from the EXIF metadata of a
+    RAW file, without decoding the image.
+    """
+    with open(impath, 'rb') as f:
+        tags = exifread.process_file(f, details=False)
+        exptime = float(
+                Fraction(tags.get('EXIF ExposureTime').printable)
+                )
+        dt = tags.get('EXIF DateTimeOriginal').printable
+        (date, _, time) = dt.partition(' ')
+        dt = tuple([int(i) for i in date.split(':') + time.split(':')])
+        dt = datetime(*dt).isoformat()
+        #ofs = tags.get('EXIF TimeZoneOffset').printable
+        jdate = Time(dt, format='isot', scale='utc').jd
+    return exptime, jdate
 
 
 def isRaw(f):
@@ -74,82 +258,148 @@ def isRaw(f):
 class DSLRImage:
     """Loads an image from RAW format, stores the metadata and writes the image
     as a NumPy array.
-    """
-    fnum = np.zeros((4, 4), dtype=int)
-    # Declares a NumPy 2d array for filename serialization
 
+    The image data is the undemosaiced RGGB mosaic; the color channels are
+    extracted from it with the extractChannel method.
+    """
     def __init__(
-            self, impath, itype=ImageType.LIGHT, color=None
+            self, impath, itype=ImageType.LIGHT, color=None, data=None,
+            lazy=False
             ):
+        # data can hold the output of _readRaw if the file has already been
+        # decoded elsewhere (e.g. in a worker process)
+        #
+        # if lazy is True, the image data is kept in a memory-mapped file in
+        # the temporary folder instead of in memory
         print('Initializing image class from file:', impath)
         self.impath = impath
         self.imtype = itype
         self.imcolor = None
-        self.imdata, self.exptime, self.jdate = self.__parseData(impath)
+        if data is None:
+            data = _readRaw(impath)
         self._genPath()  # generates the serialized filename
+        self._lazy = lazy
+        imdata, self.exptime, self.jdate = data
+        self.imdata = imdata
         self._binX = 1
         self._binY = 1
         print("Initialized image class: " + str(self))
 
-    def binImage(self, x, y=None):
+    def binImage(self, x, y=None, fn='mean', edge='crop', dtype=None):
         """Bins the data from the image. Requires the window width.
         If window height is not specified, the window is assumed to be square.
+
+        Photosites of the same color are binned together, so the data remains
+        a RGGB mosaic. See bin_data for the fn (mode) and edge arguments. The
+        binned data has the type dtype (see get_dtype).
         """
         if y is None:
             y = x
         print(
                 "Binning image: " + str(self) + " (" + str(x) + "x" + str(y)
                 + ")")
-#        h = len(self.imdata)
-#        w = len(self.imdata[0])
-#        hb = h - h%y
-#        wb = w - w%x
-#        # reduces the image size in case it isn't divisible by window size
-#        imdata_resized = np.resize(self.imdata, (hb, w, 3))
-#        imdata_resized1 = np.empty((hb, wb, 3))
-#        for r in range(len(imdata_resized)):
-#            imdata_resized1[r] = np.resize(imdata_resized[r], (wb, 3))
-#        imdata_resized1 = imdata_resized1.reshape((h//x, wb, y, 3), order='A')
-#        imdata_resized1 = imdata_resized1.reshape(
-#                (h//y, w//x, y, x, 3), order='F'
-#                )
-#        bindata=np.empty((h//y, w//x, 3))
-#        # reshapes the matrix into a set of arrays with length x*y
-#        for r in range(len(bindata)):
-#            for c in range(len(bindata[r])):
-#                # bins the arrays using the specified function
-#                if fn is 'mean':
-#                    bindata[r][c] = np.mean(imdata_resized1[r][c])
-#                elif fn is 'median':
-#                    bindata[r][c] = np.median(imdata_resized1[r][c])
-#                else:
-#                    raise ValueError('Invalid argument for \'fn\' parameter')
-#        bindata = np.resize(bindata, (h//y, w//x, 1, 1, 3))
-#        bindata = bindata.reshape(h//y, w//x, 3)
-#        # reshapes the matrix back to its original form
-        bindata = block_reduce(
-                self.imdata, (x, y, 1), np.mean, np.mean(self.imdata)
+        imdata = self.imdata
+        h, w = imdata.shape
+        # the mosaic is viewed as an array of 2x2 cells, binned as if the
+        # cells were the pixels
+        cells = imdata.reshape(h//2, 2, w//2, 2).transpose(0, 2, 1, 3)
+        bindata = bin_data(cells, x, y, fn, edge, get_dtype(dtype))
+        bindata = bindata.transpose(0, 2, 1, 3).reshape(
+                2*len(bindata), 2*len(bindata[0])
                 )
         self.imdata = bindata
         self._binX *= x
         self._binY *= y
 
-    def extractChannel(self, color):
-        """Extracts the specified channel (R,G,B) from the RGB image."""
+    def extractChannel(self, color, binX=1, binY=None, dtype=None):
+        """Extracts the specified channel (R,G,B) from the RGGB mosaic.
+
+        If binning is specified, the channel is binned at the same time. The
+        full RGB image is never created. The channel is converted to dtype
+        (by default, the type set with set_dtype).
+        """
+        if binY is None:
+            binY = binX
         print("Extracting " + color.name + " channel from image " + str(self))
-        try:
-            imdata = self.imdata[:, :, color.value]
-        except AttributeError:
-            print("AttributeError for", str(self))
-        return Monochrome(imdata, self, color)
+        im = Monochrome(
+                _cfaChannel(self.imdata, color, binX, binY, dtype=dtype),
+                self, color
+                )
+        im._binX *= binX
+        im._binY *= binY
+        return im
+
+    @property
+    def imdata(self):
+        """The image data.
 
-    #def getData(self):
+        In lazy mode, the data is memory-mapped from the temporary folder, so
+        it is only read from the disk when it is accessed. In-place changes are
+        written back to the file.
+        """
+        if getattr(self, '_lazy', False):
+            return self.getData()
+        return self._imdata
+
+    @imdata.setter
+    def imdata(self, idata):
+        if getattr(self, '_lazy', False):
+            self._setData(idata)
+        else:
+            self._imdata = idata
+
+    def getData(self):
         # loads the image data from the temporary folder
-        #return np.load(self.tmpPath + self.fname + '.npy')
+        return np.load(self._dataPath(), mmap_mode='r+')
 
-    #def _setData(self, idata):
+    def _setData(self, idata):
         # writes the image data to the temporary folder
-        #np.save(self.tmpPath + self.fname, idata)
+        path = self._dataPath()
+        if(
+                isinstance(idata, np.memmap)
+                and isinstance(idata.base, mmap.mmap)
+                and idata.filename == os.path.abspath(path)
+                ):
+            # the data was modified in place, it only needs to be flushed
+            idata.flush()
+            return
+        # the data is written to a new file which then replaces the old one,
+        # so that arrays still mapped to the old file stay valid
+        os.makedirs(self.tmpPath, exist_ok=True)
+        with open(path + '.part', 'wb') as f:
+            np.save(f, idata)
+        os.replace(path + '.part', path)
+
+    def _dataPath(self):
+        # the path of the file holding the image data (see _genPath)
+        return self._datafile
+
+    def release(self):
+        """Deletes the temporary file holding the image data (lazy mode only).
+
+        The image data can not be accessed afterwards. This is also done when
+        the instance is deleted, or on exit when it is used as a context
+        manager.
+        """
+        if not getattr(self, '_lazy', False):
+            return
+        print("Releasing image data: " + str(self))
+        self._lazy = False
+        self._imdata = None
+        try:
+            os.remove(self._dataPath())
+        except OSError:
+            pass
+        try:
+            os.rmdir(self.tmpPath)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
 
     def _genPath(self):
         # generates a serialized file name in the format
@@ -157,47 +407,27 @@ class DSLRImage:
         #
         # if the image is monochrome, the format is
         # imagetype_ordinalnumber_color
-        cls = type(self)
         itype = self.imtype
         try:
             color = self.imcolor.value
         except(AttributeError):
             color = 3
-        if(cls.fnum[itype][color] is None):
-            cls.fnum[itype][color] = 0
+        with _counterLock:
+            n = next(_fileCounters[int(itype), color])
         ftype = {0: "light", 1: "bias", 2: "dark", 3: "flat"}[itype]
         try:
-            self.fname = (
-                    ftype + "_" + str(cls.fnum[itype][color])
-                    + '_' + self.imcolor.name
-                    )
+            self.fname = ftype + "_" + str(n) + '_' + self.imcolor.name
         except AttributeError:
-            self.fname = ftype + "_" + str(cls.fnum[itype][color])
-        cls.fnum[itype][color] += 1
+            self.fname = ftype + "_" + str(n)
 
+        # the folder is only created when the data is written to it (lazy
+        # mode), e.g. not for master frames loaded from a MasterCache
         self.tmpPath = os.path.dirname(self.impath) + '/temp/'
-        try:
-            os.makedirs(self.tmpPath)
-        except(OSError):
-            pass
-
-    def __parseData(self, impath):
-        # reads the metadata from the RAW file
-        print("Reading file: " + impath)
-        with Raw(impath) as img:
-            idata = _demosaic(img.raw_image())
-        with open(impath, 'rb') as f:
-            tags = exifread.process_file(f)
-            exptime = float(
-                    Fraction(tags.get('EXIF ExposureTime').printable)
-                    )
-            dt = tags.get('EXIF DateTimeOriginal').printable
-            (date, _, time) = dt.partition(' ')
-            dt = tuple([int(i) for i in date.split(':') + time.split(':')])
-            dt = datetime(*dt).isoformat()
-            #ofs = tags.get('EXIF TimeZoneOffset').printable
-            jdate = Time(dt, format='isot', scale='utc').jd
-        return idata, exptime, jdate
+        # the ID of the creating process keeps the file names of workers
+        # apart; it is fixed here, so the image finds its file in any process
+        self._datafile = (
+                self.tmpPath + self.fname + '_' + str(os.getpid()) + '.npy'
+                )
 
     def __str__(self):
         try:
@@ -217,17 +447,16 @@ class DSLRImage:
     def __del__(self):
         # deletes the temporary file/folder
         print("Deleting image class: " + str(self))
-#        os.remove(self.tmpPath + self.fname + '.npy')
-#        try:
-#            os.rmdir(self.tmpPath)
-#        except OSError:
-#            pass
+        self.release()
 
 
 class Monochrome(DSLRImage):
     """A subtype of DSLRImage for single-color images.
     Is meant to be generated from the extractChannel method. Avoid using the
     class directly.
+
+    A Monochrome with no color (imcolor is None) holds the whole RGGB mosaic;
+    it is used for calibrating all channels at once.
     """
     def __init__(
             self, imdata, origin, color=Color.GREEN,
@@ -239,16 +468,23 @@ class Monochrome(DSLRImage):
         self.imtype = origin.imtype
         self._binX = origin._binX
         self._binY = origin._binY
-        if type(origin) == Monochrome:
+        self._lazy = getattr(origin, '_lazy', False)
+        if type(origin) == Monochrome and origin.imcolor is not None:
             self.imcolor = origin.imcolor
         else:
             self.imcolor = color
         self._genPath()
         self.imdata = imdata
         self.stars = []
+        self._tracks = None
+        self._row = None
 
     def saveFITS(self, path, fname=None):
-        """Writes the data to a FITS file."""
+        """Writes the data to a FITS file.
+
+        If the file already exists, a number is appended to the file name.
+        The name is reserved atomically, so frames can be written in parallel.
+        """
         impath = path + (self.fname if fname is None else fname)
         hdu = fits.PrimaryHDU(self.imdata.astype('uint16'))
         print("Writing image " + str(self) + " to file: " + impath + ".fits")
@@ -258,29 +494,21 @@ class Monochrome(DSLRImage):
         hdu.header['IMAGETYP'] = self.imtype.name
         hdu.header['XBINNING'] = self._binX
         hdu.header['YBINNING'] = self._binY
-        n = 1
-        try:
-            hdu.writeto(impath + ".fits")
-        except OSError as e:
-            if(type(e) == FileNotFoundError):
-                os.makedirs(path)
-                hdu.writeto(impath + ".fits")
-                return
-            error = True
-            while(error is True):
-                try:
-                    hdu.writeto(impath + "_" + str(n) + ".fits")
-                    error = False
-                except OSError:
-                    n += 1
+        if os.path.dirname(impath):
+            os.makedirs(os.path.dirname(impath), exist_ok=True)
+        f, fpath = _exclusive(impath, ".fits")
+        with f:
+            hdu.writeto(f)
+        if fpath != impath + ".fits":
             print(
                     "File of the same name already exists, file written to",
-                    impath + "_" + str(n) + ".fits"
+                    fpath
                   )
 
-    def binImage(self, x, y=None, fn='mean'):
+    def binImage(self, x, y=None, fn='mean', edge='crop', dtype=None):
         """Same as the binImage method in the superclass, but optimized for
-        monochrome arrays.
+        monochrome arrays. By default, the data keeps its (floating point)
+        type.
         """
         if y is None:
             y = x
@@ -288,39 +516,12 @@ class Monochrome(DSLRImage):
                 "Binning monochrome image: " + str(self)
                 + " (" + str(x) + "x" + str(y) + ")"
                 )
-#        h = len(self.imdata)
-#        w = len(self.imdata[0])
-#        hb = h - h%y
-#        wb = w - w%x
-#        imdata_resized = np.resize(self.imdata, (hb, w))
-#        imdata_resized1 = np.empty((hb, wb))
-#        for r in range(len(imdata_resized)):
-#            imdata_resized1[r] = np.resize(imdata_resized[r], wb)
-#        imdata_resized1 = imdata_resized1.reshape((h//x, wb, y), order='A')
-#        imdata_resized1 = imdata_resized1.reshape(
-#                (h//y, w//x, y, x), order='F'
-#                )
-#        bindata=np.empty((h//y, w//x))
-#        for r in range(len(bindata)):
-#            for c in range(len(bindata[r])):
-#                if fn is 'mean':
-#                    bindata[r][c] = np.mean(imdata_resized1[r][c])
-#                elif fn is 'median':
-#                    bindata[r][c] = np.median(imdata_resized1[r][c])
-#                else:
-#                    raise ValueError('Invalid argument for \'fn\' parameter')
-#        bindata = np.resize(bindata, (h//y, w//x, 1, 1))
-#        bindata = bindata.reshape(h//y, w//x)
-        bindata = block_reduce(
-                self.imdata, (x, y), np.mean, np.mean(self.imdata)
-                )
-        self.imdata = bindata
+        self.imdata = bin_data(self.imdata, x, y, fn, edge, dtype)
         self._binX *= x
         self._binY *= y
 
     def add_star(self, y, x, mag=None, name=None):
         print("Adding star ({},{})".format(x, y))
-        self.make_current()
         if mag is not None:
             isVar = False
         else:
@@ -330,12 +531,8 @@ class Monochrome(DSLRImage):
         r = np.mean([s.r for s in self.stars])
         d_d = np.mean([s.d_d for s in self.stars])
         d_a = np.mean([s.d_a for s in self.stars])
-        print("Added star", st)
+        print("Added star", st.describe(self))
         for s in self.stars:
-            s.apertures[self] = CircularAperture((s.x[self], s.y[self]), r)
-            s.annuli[self] = CircularAnnulus(
-                    (s.x[self], s.y[self]), r + d_d, r + d_d + d_a
-                    )
             s.r = r
             s.d_d = d_d
             s.d_a = d_a
@@ -349,9 +546,41 @@ class Monochrome(DSLRImage):
                           )
                   )
 
-    def inherit_star(self, s, parent, shift=None, gauss=False, hh=20, hw=20):
+    def detect_stars(self, nsigma=5., max_stars=None, r=None, d_d=None,
+                     d_a=None, method='marginal'):
+        """Detects the stars in the frame and adds them as fixed-magnitude
+        (reference) stars, brightest first.
+
+        By default, the aperture radius of all detected stars is the median
+        of the radii estimated from their profiles. Stars closer than the
+        aperture radius to a star already in the frame are skipped. See
+        detect.find_stars for the other parameters.
+
+        Returns the list of the added stars.
+        """
+        x, y, _, radii = find_stars(
+                self.imdata, nsigma, max_stars=max_stars, method=method, w=w
+                )
+        if r is None:
+            r = np.nanmedian(radii)
+        if self.stars:
+            xs, ys = positions(self, self.stars)
+            near = np.hypot(
+                    x[:, np.newaxis] - xs, y[:, np.newaxis] - ys
+                    ).min(axis=1) < r
+            x, y = x[~near], y[~near]
+        print("Detected {} stars".format(len(x)))
+        added = [
+                Star(self, xi, yi, False, r=r, d_d=d_d, d_a=d_a)
+                for xi, yi in zip(x, y)
+                ]
+        self.stars.extend(added)
+        return added
+
+    def inherit_star(self, s, parent, shift=None, gauss=False, hh=20, hw=20,
+                     method='gauss'):
         hasStar = False
-        print("Inheriting star:", s)
+        print("Inheriting star:", s.describe(parent))
         for _s in self.stars:
             if s.name == _s.name:
                 s = _s
@@ -359,30 +588,56 @@ class Monochrome(DSLRImage):
                 break
         if not hasStar:
             self.stars.append(s)
+        x0 = s.x[parent]
+        y0 = s.y[parent]
         if shift is None:
-            x = int(s.get_x())
-            y = int(s.get_y())
+            x = int(x0)
+            y = int(y0)
             w1 = parent.imdata[y-hh:y+hh, x-hw:x+hw]
             w2 = self.imdata[y-hh:y+hh, x-hw:x+hw]
             shift = -register_translation(w1, w2)[0]
-            print("Local offset for star", s, ":", shift)
+            print("Local offset for star", s.describe(parent), ":", shift)
         print(
                 "(looking around({}, {}))".format(
-                        int(s.get_x() + shift[1]),
-                        int(s.get_y() + shift[0])
+                        int(x0 + shift[1]),
+                        int(y0 + shift[0])
                         )
             )
         s.updateCoords(
-                self, s.get_x() + shift[1], s.get_y() + shift[0], gauss=gauss
+                self, x0 + shift[1], y0 + shift[0], gauss=gauss,
+                method=method
                 )
-        print("Inherited star:", s)
+        print("Inherited star:", s.describe(self))
+
+    def recenter(self, method='moments', stars=None):
+        """Moves the stars (all stars of the frame by default) to their
+        centroids, which are computed for all of them at once using the
+        specified centroid method (see centroid.centroids).
+        """
+        if stars is None:
+            stars = self.stars
+        if not stars:
+            return
+        x, y, _, _ = centroids(self.imdata, *positions(self, stars), method, w)
+        for s, xc, yc in zip(stars, x, y):
+            s._setCoords(self, xc, yc)
+
+    @property
+    def track(self):
+        """The view of the row of the frame in the track table of its stars,
+        or None if the frame has no stars.
+        """
+        if self._tracks is None:
+            return None
+        return self._tracks.frame(self._row)
 
     def make_current(self):
-        global CurrentFrame
-        CurrentFrame = self
+        """Makes the frame the current frame of this thread, for interactive
+        use; frame_context should be preferred in code.
+        """
+        _currentFrame.set(self)
 
     def show(self):
-        self.make_current()
         plt.figure(figsize=(20, 15))
         ax = plt.axes()
         ax.imshow(np.log(self.imdata), cmap='gray')
@@ -392,79 +647,110 @@ class Monochrome(DSLRImage):
 
 
 class Star:
+    """A star, tracked through a sequence of frames.
+
+    The positions (x, y), the aperture radii and the magnitudes of the star
+    are stored in a column of a track table (see tracks.Tracks), shared by all
+    stars of the sequence. x, y and varMag are indexed by frame objects.
+    """
+    __slots__ = ('name', 'mag', 'isVar', 'tracks', 'index', 'x', 'y', 'varMag')
+
     def __init__(
             self, parent, x, y, isVar, mag=None, r=None, d_d=None,
-            d_a=None, name=None
+            d_a=None, name=None, method='gauss', tracks=None
             ):
-        parent.make_current()
-        cls = type(self)
-        if hasattr(cls, 'n'):
-            cls.n += 1
-        else:
-            cls.n = 1
         if name is not None:
             self.name = name
         else:
-            self.name = 'Star_' + str(cls.n)
+            with _counterLock:
+                self.name = 'Star_' + str(next(_starCounter))
         self.mag = mag
         self.isVar = isVar
-        if(self.isVar):
-            self.varMag = dict()
-        self.apertures = dict()
-        self.annuli = dict()
-        self.x = dict()
-        self.y = dict()
+        if tracks is None:
+            tracks = getattr(parent, '_tracks', None)
+        if tracks is None:
+            # the table may be empty (and falsy), but it is still the frame's
+            tracks = Tracks()
+        self.tracks = tracks
+        self.index = tracks.add_star()
+        self.x = _Column(self, 'x')
+        self.y = _Column(self, 'y')
+        self.varMag = _Column(self, 'mag')
         if r is None:
-            gaussian = fit_2dgaussian(parent.imdata[y-w:y+w, x-w:x+w])
-            x += gaussian.x_mean.value - w
-            y += gaussian.y_mean.value - w
-            r = 2 * np.sqrt(
-                            gaussian.x_stddev + gaussian.y_stddev
-                            )*(
-                            np.sqrt(2*np.log(2))
-                            )
+            (x,), (y,), (sx,), (sy,) = centroids(
+                    parent.imdata, x, y, method, w
+                    )
+            r = fwhm(sx, sy)
+            if not np.isfinite(r):
+                raise ValueError(
+                        "Could not estimate the aperture radius of the star "
+                        "at ({}, {}), specify it with the 'r' parameter"
+                        .format(x, y)
+                        )
         if d_d is None:
             d_d = r
         if d_a is None:
             d_a = r
-        R = r + d_d
-        self.apertures[parent] = CircularAperture([x, y], r)
-        self.annuli[parent] = CircularAnnulus([x, y], R, R+d_a)
         self.r = r
         self.d_d = d_d
         self.d_a = d_a
         self.x[parent] = x
         self.y[parent] = y
-        print("Created star", self, "in frame", parent)
+        print("Created star", self.describe(parent), "in frame", parent)
+
+    @property
+    def r(self):
+        return self.tracks.r[self.index]
+
+    @r.setter
+    def r(self, r):
+        self.tracks.r[self.index] = r
 
-    def get_x(self):
-        return self.x[_get_current_frame()]
+    @property
+    def d_d(self):
+        return self.tracks.d_d[self.index]
 
-    def get_y(self):
-        return self.y[_get_current_frame()]
+    @d_d.setter
+    def d_d(self, d_d):
+        self.tracks.d_d[self.index] = d_d
+
+    @property
+    def d_a(self):
+        return self.tracks.d_a[self.index]
+
+    @d_a.setter
+    def d_a(self, d_a):
+        self.tracks.d_a[self.index] = d_a
+
+    def aperture(self, frame):
+        return CircularAperture([self.x[frame], self.y[frame]], self.r)
+
+    def annulus(self, frame):
+        return CircularAnnulus(
+                [self.x[frame], self.y[frame]],
+                self.r + self.d_d, self.r + self.d_d + self.d_a
+                )
+
+    def get_x(self, frame=None):
+        """Returns the x coordinate of the star in the frame (the current
+        frame by default).
+        """
+        return self.x[current_frame() if frame is None else frame]
 
-    def updateCoords(self, frame, x, y, gauss=False):
+    def get_y(self, frame=None):
+        """Returns the y coordinate of the star in the frame (the current
+        frame by default).
+        """
+        return self.y[current_frame() if frame is None else frame]
+
+    def updateCoords(self, frame, x, y, gauss=False, method='gauss'):
         x = int(x)
         y = int(y)
         if gauss:
-            try:
-#                plt.figure()
-#                plt.imshow(frame.imdata[y-2*w:y+2*w, x-2*w:x+2*w], cmap='gray')
-#                plt.title('Gaussian fitting space')
-#                plt.show()
-                gaussian = fit_2dgaussian(frame.imdata[y-w:y+w, x-w:x+w])
-                x += gaussian.x_mean.value - w
-                y += gaussian.y_mean.value - w
-            except ValueError:
-                print(
-                        '({}, {}: [{}:{}, {}:{}]'.format(
-                            self.x[frame], self.y[frame], y-w, y+w, x-w, x+w
-                        )
-                      )
-        self.apertures[frame] = CircularAperture([x, y], self.r)
-        self.annuli[frame] = CircularAnnulus(
-                [x, y], self.r+self.d_d, self.r+self.d_d+self.d_a
-                )
+            (x,), (y,), _, _ = centroids(frame.imdata, x, y, method, w)
+        self._setCoords(frame, x, y)
+
+    def _setCoords(self, frame, x, y):
         self.x[frame] = x
         self.y[frame] = y
 
@@ -475,28 +761,28 @@ class Star:
         self.varMag[frame] = mag
 
     def drawAperture(self, frame, ax):
-        self.apertures[frame].plot(ax, fc='g', ec='g')
-        self.annuli[frame].plot(ax, fc='r', ec='r')
-
-    def FWHM(self, frame):
-        x = int(self.x[frame])
-        y = int(self.y[frame])
-        gaussian = fit_2dgaussian(frame.imdata[y-w:y+w, x-w:x+w])
-        r = 2 * np.sqrt(gaussian.x_stddev + gaussian.y_stddev
-                        )*(
-                                np.sqrt(2*np.log(2))
-                        )
-        return r
-
-    def centroid(self, frame):
-        x = int(self.x[frame])
-        y = int(self.y[frame])
-        gaussian = fit_2dgaussian(frame.imdata[y-w:y+w, x-w:x+w])
-        x += gaussian.x_mean.value - w
-        y += gaussian.y_mean.value - w
+        self.aperture(frame).plot(ax, fc='g', ec='g')
+        self.annulus(frame).plot(ax, fc='r', ec='r')
+
+    def FWHM(self, frame, method='gauss'):
+        _, _, (sx,), (sy,) = centroids(
+                frame.imdata, self.x[frame], self.y[frame], method, w
+                )
+        return fwhm(sx, sy)
+
+    def centroid(self, frame, method='gauss'):
+        (x,), (y,), _, _ = centroids(
+                frame.imdata, self.x[frame], self.y[frame], method, w
+                )
         return x, y
 
     def __str__(self):
+        return self.describe()
+
+    def describe(self, frame=None):
+        """Describes the star, with its coordinates in the frame (the current
+        frame by default).
+        """
         if self.isVar:
             s = "Variable star: "
         else:
@@ -507,8 +793,8 @@ class Star:
             s += "(no name)\n"
         try:
             s += "Centroid: ({}, {})\n".format(
-                    int(np.around(self.get_x())),
-                    int(np.around(self.get_y()))
+                    int(np.around(self.get_x(frame))),
+                    int(np.around(self.get_y(frame)))
                     )
         except KeyError:
             s += "Centroid unknown\n"
@@ -543,3 +829,5 @@ class _debugImage(Monochrome):
         self.imtype = ImageType.LIGHT
         self.imcolor = Color.GREEN
         self.stars = []
+        self._tracks = None
+        self._row = None
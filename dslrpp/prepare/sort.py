@@ -2,7 +2,12 @@
 for further processing.
 """
 import os
-from .process import DSLRImage, Color, ImageType, isRaw
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from .process import (
+        DSLRImage, Monochrome, Color, ImageType, isRaw, _readRaw, _readExif,
+        get_dtype
+        )
 from .calibrate import calibrate
 import numpy as np
 
@@ -10,68 +15,188 @@ __all__ = ["sort"]
 
 
 def __listdir(path):
-    # optimizes the os.listdir function
-    return [
+    # optimizes the os.listdir function; the files are sorted by name, as the
+    # order of os.listdir depends on the file system
+    return sorted(
             path + '/' + d for d in os.listdir(path)
             if os.path.isfile(path + '/' + d)
-            ]
+            )
 
 
 def __listraw(path):
     return [f for f in __listdir(path) if isRaw(f)]
 
 
-def sort(path, red=False, green=True, blue=False, binX=None, binY=None):
+def __load(files, workers=None, lazy=False):
+    """Initializes DSLRImage classes for the given (file, image type) pairs.
+
+    If more than one worker is requested, the RAW files are decoded in a
+    process pool. The classes themselves are always initialized in the parent
+    process, in the order of the given files, so that the serialized file
+    names stay deterministic. Each class is initialized as soon as its data
+    arrives, and at most two frames per worker are decoded ahead, so lazy
+    images are written out before the rest of the frames are decoded.
+    """
+    if workers is None or workers <= 1:
+        return [
+                DSLRImage(f, itype=itype, lazy=lazy)
+                for f, itype in files
+                ]
+
+    def load(f, itype, future):
+        return DSLRImage(f, itype=itype, data=future.result(), lazy=lazy)
+
+    images = []
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for f, itype in files:
+            if len(pending) == 2 * workers:
+                images.append(load(*pending.popleft()))
+            pending.append((f, itype, executor.submit(_readRaw, f)))
+        images.extend(load(*p) for p in pending)
+    return images
+
+
+def __cachedMasters(files, colors, cache, mode):
+    """Loads the master calibration frames for the given colors from the
+    cache, without decoding the RAW files. Returns a dictionary mapping each
+    color to a dictionary which maps image types to master frames (or None if
+    the master frame isn't cached).
+    """
+    exptimes = {f: _readExif(f)[0] for f, itype in files}
+
+    def key(itype, color, parents=()):
+        paths = [f for f, t in files if t == itype]
+        return cache.key(
+                paths, itype, color, [exptimes[f] for f in paths],
+                mode=mode, parents=parents
+                )
+
+    masters = dict()
+    for c in colors:
+        bias_key = key(ImageType.BIAS, c)
+        masters[c] = {
+                ImageType.BIAS: cache.load(bias_key),
+                ImageType.DARK: cache.load(
+                    key(ImageType.DARK, c, parents=[bias_key])
+                    ),
+                ImageType.FLAT: cache.load(key(ImageType.FLAT, c)),
+                }
+    return masters
+
+
+def sort(
+        path, red=False, green=True, blue=False, binX=None, binY=None,
+        workers=None, lazy=False, cache=None, masterMode='median', cfa=False,
+        dtype=None
+        ):
     """Initializes DSLRImage classes for each frame,
     then bins them and stores specified monochrome images to FITS.
+
+    If workers is greater than 1, the RAW files are decoded in parallel using
+    that many processes.
+
+    If lazy is True, the image data is stored in memory-mapped files in the
+    temporary folder and only read when needed. The files of the RGB images are
+    deleted as soon as the monochrome channels are extracted, and the files of
+    the returned images are deleted when they are released or garbage
+    collected.
+
+    If a MasterCache is given, cached master calibration frames are used, and
+    the RAW files they were stacked from are not decoded at all.
+
+    If cfa is True, the frames are calibrated once, on the undemosaiced RGGB
+    mosaic, and the color channels are extracted afterwards. The master frames
+    are then stacked only once regardless of the number of colors.
+
+    The image data is converted to the floating point type dtype (by default,
+    the type set with set_dtype), which is fixed for the whole call.
     """
+    dtype = get_dtype(dtype)
     if binY is None:
         binY = binX
 
-    lights = [
-            DSLRImage(f, itype=ImageType.LIGHT)
-            for f in __listraw(path + "/Light_frames")
+    folders = [
+            ("/Light_frames", ImageType.LIGHT),
+            ("/Bias_frames", ImageType.BIAS),
+            ("/Dark_frames", ImageType.DARK),
+            ("/Flat_fields", ImageType.FLAT),
             ]
-    bias = [
-            DSLRImage(f, itype=ImageType.BIAS)
-            for f in __listraw(path + "/Bias_frames")
+    files = [
+            (f, itype) for folder, itype in folders
+            for f in __listraw(path + folder)
             ]
-    darks = [
-            DSLRImage(f, itype=ImageType.DARK)
-            for f in __listraw(path + "/Dark_frames")
+    colors = [
+            c for c, use in
+            ((Color.RED, red), (Color.GREEN, green), (Color.BLUE, blue))
+            if use
             ]
-    flats = [
-            DSLRImage(f, itype=ImageType.FLAT)
-            for f in __listraw(path + "/Flat_fields")
+
+    # calibration is done on the mosaic (color None) in CFA mode
+    calColors = [None] if cfa else colors
+    masters = {c: dict() for c in calColors}
+    if cache is not None:
+        masters = __cachedMasters(
+                [(f, itype) for f, itype in files if itype != ImageType.LIGHT],
+                calColors, cache, masterMode
+                )
+    cached = {
+            itype for _, itype in folders
+            if all(masters[c].get(itype) is not None for c in calColors)
+            }
+    images = __load(
+            [(f, itype) for f, itype in files if itype not in cached],
+            workers, lazy
+            )
+    lights, bias, darks, flats = [
+            [im for im in images if im.imtype == itype]
+            for _, itype in folders
             ]
 
-    imagesR = np.empty(())
-    imagesG = np.empty(())
-    imagesB = np.empty(())
-
-    if(red):
-        clights = np.array([im.extractChannel(Color.RED) for im in lights])
-        cbias = np.array([im.extractChannel(Color.RED) for im in bias])
-        cflats = np.array([im.extractChannel(Color.RED) for im in flats])
-        cdarks = np.array([im.extractChannel(Color.RED) for im in darks])
-        calibrate(clights, cbias, cdarks, cflats)
-        imagesR = clights
-    if(green):
-        clights = np.array([im.extractChannel(Color.GREEN) for im in lights])
-        cbias = np.array([im.extractChannel(Color.GREEN) for im in bias])
-        cflats = np.array([im.extractChannel(Color.GREEN) for im in flats])
-        cdarks = np.array([im.extractChannel(Color.GREEN) for im in darks])
-        calibrate(clights, cbias, cdarks, cflats)
-        imagesG = clights
-    if(blue):
-        clights = np.array([im.extractChannel(Color.BLUE) for im in lights])
-        cbias = np.array([im.extractChannel(Color.BLUE) for im in bias])
-        cflats = np.array([im.extractChannel(Color.BLUE) for im in flats])
-        cdarks = np.array([im.extractChannel(Color.BLUE) for im in darks])
-        calibrate(clights, cbias, cdarks, cflats)
-        imagesB = clights
-
-    for im in np.concatenate((imagesR, imagesG, imagesB)):
-        im.binImage(binX, binY)
+    def channel(frames, itype, color):
+        # the cached master frame, or the color channel of each frame
+        if masters[color].get(itype) is not None:
+            return masters[color][itype]
+        if color is None:
+            return np.array([
+                    Monochrome(im.imdata.astype(dtype), im, None)
+                    for im in frames
+                    ])
+        return np.array([
+                im.extractChannel(color, dtype=dtype) for im in frames
+                ])
+
+    channels = dict()
+    for c in calColors:
+        clights = channel(lights, ImageType.LIGHT, c)
+        calibrate(
+                clights, channel(bias, ImageType.BIAS, c),
+                channel(darks, ImageType.DARK, c),
+                channel(flats, ImageType.FLAT, c),
+                masterMode=masterMode, cache=cache
+                )
+        channels[c] = clights
+    if cfa:
+        # the channels are binned while they are extracted
+        mosaics = channels.pop(None)
+        for c in colors:
+            channels[c] = np.array([
+                    im.extractChannel(c, binX or 1, binY or 1, dtype)
+                    for im in mosaics
+                    ])
+        for im in mosaics:
+            im.release()
+        del mosaics
+    imagesR, imagesG, imagesB = [
+            channels.get(c, np.empty(0, dtype=object)) for c in Color
+            ]
+
+    for im in images:
+        im.release()
+    del images, lights, bias, darks, flats
+
+    if not cfa and binX is not None:
+        for im in np.concatenate((imagesR, imagesG, imagesB)):
+            im.binImage(binX, binY, dtype=dtype)
 
     return (imagesR, imagesG, imagesB)
@@ -0,0 +1,210 @@
+"""This submodule contains the Tracks class, which stores the positions,
+aperture radii and fluxes of the stars in all frames of a sequence.
+
+The data is kept in arrays of shape (number of frames, number of stars), so it
+can be read and written for all stars (or all frames) at once. Every frame is
+given a row of the table and every star a column; the Star objects and the
+FrameTrack objects returned by Tracks.frame are thin views into the table.
+"""
+import threading
+import numpy as np
+
+__all__ = ["Tracks", "FrameTrack", "positions"]
+
+
+class Tracks:
+    """The track table of a sequence of frames.
+
+    Attributes
+    ----------
+    x, y : `numpy.ndarray`
+        The positions of the stars, of shape (number of frames, number of
+        stars). Unknown positions are NaN.
+    flux : `numpy.ndarray`
+        The instrumental fluxes of the stars, as measured by photometry
+    mag : `numpy.ndarray`
+        The magnitudes defined for the variable stars
+    jd : `numpy.ndarray`
+        The Julian dates of the frames
+    r, d_d, d_a : `numpy.ndarray`
+        The aperture radii of the stars, and the distances from the aperture
+        to the annulus and across the annulus
+    """
+    _frame_fields = ('x', 'y', 'flux', 'mag')
+    _star_fields = ('r', 'd_d', 'd_a')
+
+    def __init__(self, frames=16, stars=4):
+        self._lock = threading.RLock()
+        # guards the growth of the arrays
+        self._nf = 0
+        self._ns = 0
+        self._data = {
+                f: np.full((frames, stars), np.nan)
+                for f in self._frame_fields
+                }
+        self._data['jd'] = np.full(frames, np.nan)
+        for f in self._star_fields:
+            self._data[f] = np.full(stars, np.nan)
+
+    def __getattr__(self, field):
+        # the fields are views of the used part of the arrays
+        try:
+            data = self.__dict__['_data'][field]
+        except KeyError:
+            raise AttributeError(field) from None
+        if field in self._frame_fields:
+            return data[:self._nf, :self._ns]
+        if field == 'jd':
+            return data[:self._nf]
+        return data[:self._ns]
+
+    def __len__(self):
+        return self._nf
+
+    @property
+    def shape(self):
+        """The number of frames and the number of stars."""
+        return self._nf, self._ns
+
+    def add_frame(self, frame):
+        """Adds a row for the frame to the table and returns its index.
+
+        The frame remembers its row, so it can only belong to one table.
+        """
+        with self._lock:
+            if getattr(frame, '_tracks', None) is self:
+                return frame._row
+            if getattr(frame, '_tracks', None) is not None:
+                raise ValueError(
+                        "The frame already belongs to another track table"
+                        )
+            if self._nf == len(self._data['jd']):
+                self.__grow(2 * self._nf, None)
+            row = self._nf
+            self._nf += 1
+            self._data['jd'][row] = getattr(frame, 'jdate', np.nan)
+            frame._tracks = self
+            frame._row = row
+            return row
+
+    def add_star(self):
+        """Adds a column for a new star to the table and returns its index."""
+        with self._lock:
+            if self._ns == len(self._data['r']):
+                self.__grow(None, 2 * self._ns)
+            self._ns += 1
+            return self._ns - 1
+
+    def row(self, frame):
+        """Returns the row of the frame, or raises KeyError if the frame is not
+        in the table.
+        """
+        if getattr(frame, '_tracks', None) is not self:
+            raise KeyError(frame)
+        return frame._row
+
+    def frame(self, frame):
+        """Returns the view of the row of the frame (given as a frame object
+        or a row index).
+        """
+        if not isinstance(frame, (int, np.integer)):
+            frame = self.row(frame)
+        return FrameTrack(self, frame)
+
+    def __grow(self, frames, stars):
+        # reallocates the arrays with a larger capacity
+        nf, ns = self._data['x'].shape
+        frames = max(frames or nf, 1)
+        stars = max(stars or ns, 1)
+        for f in self._frame_fields:
+            data = np.full((frames, stars), np.nan)
+            data[:nf, :ns] = self._data[f]
+            self._data[f] = data
+        data = np.full(frames, np.nan)
+        data[:nf] = self._data['jd']
+        self._data['jd'] = data
+        for f in self._star_fields:
+            data = np.full(stars, np.nan)
+            data[:ns] = self._data[f]
+            self._data[f] = data
+
+
+class FrameTrack:
+    """A view of the row of a frame in the track table."""
+    __slots__ = ('tracks', 'row')
+
+    def __init__(self, tracks, row):
+        self.tracks = tracks
+        self.row = row
+
+    @property
+    def x(self):
+        return self.tracks.x[self.row]
+
+    @property
+    def y(self):
+        return self.tracks.y[self.row]
+
+    @property
+    def flux(self):
+        return self.tracks.flux[self.row]
+
+    @property
+    def jd(self):
+        return self.tracks.jd[self.row]
+
+
+class _Column:
+    """A view of a column of the track table, indexed by frame objects like
+    a dictionary. Frames in which the value is unknown raise KeyError.
+    """
+    __slots__ = ('star', 'field')
+
+    def __init__(self, star, field):
+        self.star = star
+        self.field = field
+
+    def __getitem__(self, frame):
+        tracks = self.star.tracks
+        value = getattr(tracks, self.field)[
+                tracks.row(frame), self.star.index
+                ]
+        if np.isnan(value):
+            raise KeyError(frame)
+        return value
+
+    def __setitem__(self, frame, value):
+        tracks = self.star.tracks
+        with tracks._lock:
+            row = tracks.add_frame(frame)
+            getattr(tracks, self.field)[row, self.star.index] = value
+
+    def __contains__(self, frame):
+        try:
+            self[frame]
+        except KeyError:
+            return False
+        return True
+
+
+def positions(frame, stars):
+    """Returns the positions of the stars in the frame, as arrays of x and y
+    coordinates.
+
+    If the stars share a track table with the frame, the positions are read
+    from it at once.
+    """
+    tracks = getattr(frame, '_tracks', None)
+    if tracks is not None and all(
+            getattr(s, 'tracks', None) is tracks for s in stars
+            ):
+        row = tracks.row(frame)
+        cols = [s.index for s in stars]
+        x, y = tracks.x[row, cols], tracks.y[row, cols]
+        if np.isnan(x).any() or np.isnan(y).any():
+            raise KeyError(frame)
+        return x, y
+    return (
+            np.array([s.x[frame] for s in stars], dtype=np.float64),
+            np.array([s.y[frame] for s in stars], dtype=np.float64)
+            )
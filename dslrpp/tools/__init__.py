@@ -1,5 +1,5 @@
 """
 """
-from .align import get_offsets
+from .align import get_offsets, offset_accuracy
 
-__all__ = ["get_offsets"]
+__all__ = ["get_offsets", "offset_accuracy"]
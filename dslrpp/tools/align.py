@@ -1,12 +1,17 @@
 """A submodule used for aligning several images according to the position of
 stars (or other celestial objects).
 """
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from skimage.feature import register_translation
-from ..prepare import Monochrome
+from ..prepare.process import Monochrome
+from ..prepare.binning import bin_data
+from ..prepare.tracks import positions
+from ..prepare.detect import match_stars
 from matplotlib import pyplot as plt
 
-__all__ = ["get_offsets"]
+__all__ = ["get_offsets", "offset_accuracy"]
 
 
 def __window(imd, center, hh, hw):
@@ -107,6 +112,131 @@ def __get_shift(img1, img2, hh=20, hw=20):
     return -int(y), -int(x)
 
 
+def __register(imd1, imd2, upsample=1, fft1=None):
+    """Auxiliary function; computes the offset between two arrays by
+    cross-correlation, in a (y, x) format.
+
+    If given, fft1 is the Fourier transform of the first array, which is then
+    not computed again.
+    """
+    if fft1 is None:
+        return -register_translation(imd1, imd2, upsample)[0]
+    return -register_translation(
+            fft1, np.fft.fftn(imd2), upsample, space='fourier'
+            )[0]
+
+
+def __reference_fft(img, method, binning):
+    """Auxiliary function; computes the Fourier transform of the reference
+    image that is cross-correlated with the other images by the method.
+    """
+    if method == 'pyramid':
+        return np.fft.fftn(bin_data(img.imdata, binning))
+    return np.fft.fftn(img.imdata)
+
+
+def __pyramid_shift(img1, img2, binning=8, upsample=1, hh=20, hw=20,
+                    fft1=None):
+    """Auxiliary function; computes the offset between two images from coarse
+    to fine.
+
+    The offset is first estimated by cross-correlating binned copies of the
+    images, then refined by cross-correlating windows around the stars of the
+    first image with the windows around their coarse positions in the second
+    one. The refined offset is the median of the offsets of the windows.
+
+    Parameters
+    ----------
+    img1 : `Monochrome`
+        The reference image.
+    img2 : `Monochrome`
+        The image used to compute the offset
+    binning : `int`, optional
+        The size of the bins used for the coarse estimate
+    upsample : `int`, optional
+        The upsampling factor of the refined offset; the offset is computed to
+        1/upsample of a pixel.
+    hh : `int`, optional
+        The half-height of the windows
+    hw : `int`, optional
+        The half-width of the windows
+    fft1 : `numpy.ndarray`, optional
+        The Fourier transform of the binned reference image, if it is already
+        known
+
+    Returns
+    -------
+    offset : `numpy.ndarray`
+        The offset in a (y, x) format
+    """
+    coarse = __register(
+            None if fft1 is not None else bin_data(img1.imdata, binning),
+            bin_data(img2.imdata, binning), fft1=fft1
+            ) * binning
+    dy, dx = np.around(coarse).astype(int)
+    offsets = []
+    for x, y in zip(*positions(img1, img1.stars)):
+        y, x = int(y), int(x)
+        w1 = __window(img1.imdata, (y, x), hh, hw)
+        w2 = __window(img2.imdata, (y + dy, x + dx), hh, hw)
+        if w1.size == 0 or w1.shape != w2.shape:
+            # the star is too close to the edge of either image
+            continue
+        offsets.append(__register(w1, w2, upsample))
+    if not offsets:
+        return coarse
+    return np.array([dy, dx]) + np.median(offsets, axis=0)
+
+
+def __frame_shift(img1, img2, method, binning, upsample, hh, hw, fft1=None):
+    """Auxiliary function; computes the offset between two images in a (y, x)
+    format, using the specified method.
+
+    fft1 is the cached Fourier transform of the first image, as returned by
+    __reference_fft.
+    """
+    if img2 is img1:
+        return np.zeros(2)
+    if method == 'pyramid':
+        return __pyramid_shift(img1, img2, binning, upsample, hh, hw, fft1)
+    return __register(img1.imdata, img2.imdata, upsample, fft1)
+
+
+def __inherit_stars(img, parent, shift, centroid, global_offset, hh, hw,
+                    match=None):
+    """Auxiliary function; copies the stars of the parent image into the
+    image, which is offset from it by shift.
+
+    If match is given, the stars are matched to the stars detected in the
+    image within the match radius. Otherwise, they are looked up one by one.
+    If centroid is a centroid method, the stars are then moved to their
+    centroids, all at once.
+    """
+    if match is not None:
+        match_stars(img, parent, shift, match)
+    else:
+        __lookup_stars(img, parent, shift, global_offset, hh, hw)
+    if centroid is not None:
+        names = {s.name for s in parent.stars}
+        img.recenter(centroid, [s for s in img.stars if s.name in names])
+
+
+def __lookup_stars(img, parent, shift, global_offset, hh, hw):
+    """Auxiliary function; copies the stars of the parent image into the
+    image one by one, using the global offset or the local offsets of the
+    windows around the stars.
+    """
+    for s in parent.stars:
+        if global_offset:
+            img.inherit_star(
+                    s, parent, shift=shift, hh=int(hh//2), hw=int(hw//2)
+                    )
+        else:
+            img.inherit_star(
+                    s, parent, hh=int(hh//2), hw=int(hw//2)
+                    )
+
+
 def __translate(imd, dy, dx):
     """Auxiliary function; translates the specified image by a specified vector
     .
@@ -152,7 +282,9 @@ def __translate(imd, dy, dx):
     return transimd
 
 
-def get_offsets(*imgs, hh=20, hw=20, gauss=False, global_offset=False):
+def get_offsets(*imgs, hh=20, hw=20, gauss=False, global_offset=False,
+                method='full', binning=8, upsample=1, reference=None,
+                workers=None, centroid='gauss', match=False, radius=3.):
     """Computes the offset between images based on star positions.
 
     Computes the offset between images based on star positions, using
@@ -163,28 +295,66 @@ def get_offsets(*imgs, hh=20, hw=20, gauss=False, global_offset=False):
     *imgs : `numpy.ndarray`\0s
         The images whose offsets need to be found. The first image in the
         sequence will have the offset (0,0) by default.
+    reference : `int` or `Monochrome`, optional
+        By default, every image is registered against the previous one, and
+        the offsets are accumulated along the sequence. If a reference is
+        given (the index of one of the images, or a separate image such as a
+        stack), every image is registered against it instead, so the errors
+        don't accumulate; the offsets are then relative to the reference, and
+        the stars of the reference are copied into the images. The Fourier
+        transform of the reference is computed only once.
+    workers : `int`, optional
+        The number of images registered against the reference in parallel
+    method : `str`, optional
+        'full' cross-correlates the whole images. 'pyramid' cross-correlates
+        copies of the images binned by the binning factor, then refines the
+        offset on windows (of half-size hh x hw) around the stars, which is
+        much faster for large images.
+    binning : `int`, optional
+        The binning factor of the coarse estimate of the 'pyramid' method
+    upsample : `int`, optional
+        The upsampling factor; the offsets are computed to 1/upsample of a
+        pixel. By default, they are computed to the whole pixel.
+    gauss : `bool`, optional
+        Whether the stars are moved to their centroids after being copied into
+        the images
+    centroid : `str`, optional
+        The centroid method (see centroid.centroids); 'gauss' fits a 2D
+        Gaussian to each star, while the faster methods measure all stars of
+        a frame at once.
+    match : `bool`, optional
+        If True, the stars are detected in every image, and the stars of the
+        previous image (or the reference) are matched to the nearest detected
+        stars within the radius (in pixels) of their positions shifted by the
+        global offset. This is fast for any number of stars, e.g. the ones
+        added by Monochrome.detect_stars.
+    radius : `float`, optional
+        The matching radius
 
     Returns
     -------
     aligned : `numpy.ndarray`
         The array of tuples representing the offset in a (y, x) format.
     """
+    if method not in ('full', 'pyramid'):
+        raise ValueError("Invalid argument for 'method' parameter")
+    centroid = centroid if gauss else None
+    match = radius if match else None
+    if reference is not None:
+        return __reference_offsets(
+                imgs, reference, hh, hw, centroid, global_offset, method,
+                binning, upsample, workers, match
+                )
     offsets = np.array([[0, 0]])
     for i in range(1, len(imgs)):
         # y, x = __get_shift(imgs[i-1], imgs[i], hh, hw)
-        y, x = -register_translation(imgs[i-1].imdata, imgs[i].imdata)[0]
-        for s in imgs[i-1].stars:
-            if global_offset:
-                imgs[i].inherit_star(
-                        s, imgs[i-1], shift=[y, x], gauss=gauss,
-                        hh=int(hh//2), hw=int(hw//2)
-                        )
-            else:
-                imgs[i].inherit_star(
-                        s, imgs[i-1], gauss=gauss,
-                        hh=int(hh//2), hw=int(hw//2)
-                        )
-        imgs[i].make_current()
+        y, x = __frame_shift(
+                imgs[i-1], imgs[i], method, binning, upsample, hh, hw
+                )
+        __inherit_stars(
+                imgs[i], imgs[i-1], [y, x], centroid, global_offset, hh, hw,
+                match
+                )
         offsets = np.concatenate((offsets, [[y, x]]), axis=0)
         print('diff offset:', offsets[i], '/', offsets[i-1])
         offsets[i] += offsets[i-1]
@@ -193,6 +363,79 @@ def get_offsets(*imgs, hh=20, hw=20, gauss=False, global_offset=False):
     return offsets
 
 
+def __reference_offsets(imgs, reference, hh, hw, centroid, global_offset,
+                        method, binning, upsample, workers, match):
+    """Auxiliary function; registers every image against the reference, with
+    the images dispatched to a pool of workers.
+    """
+    if isinstance(reference, (int, np.integer)):
+        reference = imgs[reference]
+    fft1 = __reference_fft(reference, method, binning)
+
+    def shift(img):
+        return __frame_shift(
+                reference, img, method, binning, upsample, hh, hw, fft1
+                )
+
+    if workers is None or workers < 2:
+        offsets = [shift(img) for img in imgs]
+    else:
+        # the threads share the images and the cached Fourier transform,
+        # without copying them
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            offsets = list(executor.map(shift, imgs))
+    offsets = np.array(offsets)
+    for i, (img, (y, x)) in enumerate(zip(imgs, offsets)):
+        if img is not reference:
+            __inherit_stars(
+                    img, reference, [y, x], centroid, global_offset, hh, hw,
+                    match
+                    )
+        print('offset:', offsets[i])
+        print("{}/{}".format(i + 1, len(imgs)))
+    return offsets
+
+
+def offset_accuracy(*imgs, hh=20, hw=20, binning=8, upsample=1):
+    """Compares the offsets computed by the 'pyramid' method with the ones
+    computed from the whole images.
+
+    Every image is registered against the first one (which must contain the
+    stars) with both methods. The running times and the differences between
+    the offsets are printed.
+
+    Returns
+    -------
+    diff : `numpy.ndarray`
+        The differences between the 'pyramid' and the 'full' offsets of the
+        images, in a (y, x) format
+    """
+    full = np.zeros((len(imgs), 2))
+    pyramid = np.zeros((len(imgs), 2))
+    t_full = t_pyramid = 0.
+    for i in range(1, len(imgs)):
+        t = time.perf_counter()
+        full[i] = __frame_shift(
+                imgs[0], imgs[i], 'full', binning, upsample, hh, hw
+                )
+        t_full += time.perf_counter() - t
+        t = time.perf_counter()
+        pyramid[i] = __frame_shift(
+                imgs[0], imgs[i], 'pyramid', binning, upsample, hh, hw
+                )
+        t_pyramid += time.perf_counter() - t
+    diff = pyramid - full
+    err = np.hypot(diff[:, 0], diff[:, 1])
+    print("Full-frame registration: {:.3f} s".format(t_full))
+    print("Pyramid registration: {:.3f} s".format(t_pyramid))
+    print(
+            "Offset difference: max {:.3f} px, RMS {:.3f} px".format(
+                    err.max(), np.sqrt(np.mean(err**2))
+                    )
+            )
+    return diff
+
+
 def align_imgs(*imgs, hh=20, hw=20):
     """Translates the images in order for star coordinates to match.
 
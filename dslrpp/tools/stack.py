@@ -1,13 +1,42 @@
 """A submodule for combining several frames into one
 """
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from ..prepare import Monochrome
+from ..prepare import Monochrome, get_dtype
 
+MEMORY_BUDGET = 2**28
+# the default amount of memory (in bytes) used for stacking buffers
 
-def stack(images, mode='median'):
+
+def __stack_band(images, mode, out, start, stop):
+    """Auxiliary function; stacks rows start:stop of the images into out."""
+    band = np.empty(
+            (len(images), stop - start) + out.shape[1:], dtype=out.dtype
+            )
+    for i, im in enumerate(images):
+        band[i] = im.imdata[start:stop]
+    if mode == 'median':
+        # the band is a scratch copy, so it is partitioned in place instead
+        # of being copied again, which would double the memory used
+        np.median(band, axis=0, out=out[start:stop], overwrite_input=True)
+    else:
+        np.mean(band, axis=0, out=out[start:stop])
+
+
+def stack(images, mode='median', memory=None, workers=None, dtype=None):
     """Stacks the data from several images using specified function
     (default is median). Raises exception if frames are not monochrome or
     if their types and colors don't match.
+
+    The frames are stacked in bands of rows, so that the buffers used for
+    stacking take up at most the given amount of memory (in bytes; default is
+    MEMORY_BUDGET). The result is the same as stacking the full frames. If
+    workers is greater than 1, that many bands are stacked in parallel, sharing
+    the same memory budget.
+
+    Frames with integer data are stacked into the floating point type dtype
+    (see get_dtype); it is resolved before the worker threads are started,
+    since they do not see the type set with set_dtype.
     """
     print("Stacking images:")
     for im in images:
@@ -24,15 +53,43 @@ def stack(images, mode='median'):
     itypes = {im.imtype for im in images}
     if(len(itypes) > 1):
         raise ValueError("Frames must be the same image type")
+    if mode not in ('median', 'mean'):
+        raise ValueError("Invalid argument for 'mode' parameter")
+    imdata = [im.imdata for im in images]
+    shapes = {d.shape for d in imdata}
+    if(len(shapes) > 1):
+        raise ValueError("Frames must be the same size")
+    result = np.result_type(*imdata)
+    if np.issubdtype(result, np.inexact):
+        dtype = result
+    else:
+        dtype = get_dtype(dtype)
+    del imdata
 
-    imdata = np.array([im.imdata for im in images])
+    if memory is None:
+        memory = MEMORY_BUDGET
+    if workers is None or workers < 1:
+        workers = 1
+    shape = shapes.pop()
+    row_size = len(images) * int(np.prod(shape[1:])) * dtype.itemsize
+    rows = max(1, memory // (workers * row_size))
+    stack = np.empty(shape, dtype=dtype)
+    bands = [(i, min(i + rows, shape[0])) for i in range(0, shape[0], rows)]
+    print("Stacking in {} band(s) of {} row(s)".format(len(bands), rows))
 
-    if mode == 'median':
-        stack = np.median(imdata, axis=0)
-    elif mode == 'mean':
-        stack = np.mean(imdata, axis=0)
+    if workers == 1:
+        for start, stop in bands:
+            __stack_band(images, mode, stack, start, stop)
     else:
-        raise ValueError("Invalid argument for 'mode' parameter")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                    executor.submit(
+                        __stack_band, images, mode, stack, start, stop
+                        )
+                    for start, stop in bands
+                    ]
+            for f in futures:
+                f.result()
 
     return Monochrome(
             stack, images[0], images[0].imcolor,
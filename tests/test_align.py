@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from dslrpp.prepare import Monochrome, ImageType, Color, positions
+from dslrpp.tools import get_offsets
+
+SHIFTS = [(0, 0), (3, -5), (-4, 2), (7, 6)]
+# the offsets (y, x) of the frames from the first one
+
+
+def star_field(shift, stars, shape=(192, 256), seed=0):
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:shape[0], :shape[1]]
+    imdata = rng.normal(100, 2, shape)
+    for x, y, a in stars:
+        imdata += a * np.exp(
+                -((xx - x - shift[1])**2 + (yy - y - shift[0])**2)
+                / (2 * 1.5**2)
+                )
+    return imdata.astype(np.float32)
+
+
+@pytest.fixture
+def frames():
+    rng = np.random.default_rng(1)
+    stars = np.column_stack([
+            rng.uniform(30, 226, 12), rng.uniform(30, 162, 12),
+            rng.uniform(500, 3000, 12)
+            ])
+    origin = SimpleNamespace(
+            exptime=30., jdate=2459000.5, impath='frames/light',
+            imtype=ImageType.LIGHT, _binX=1, _binY=1
+            )
+    frames = [
+            Monochrome(star_field(s, stars, seed=i), origin, Color.GREEN)
+            for i, s in enumerate(SHIFTS)
+            ]
+    frames[0].detect_stars(max_stars=8)
+    return frames
+
+
+def check_stars(frames):
+    x0, y0 = positions(frames[0], frames[0].stars)
+    for img, (dy, dx) in zip(frames, SHIFTS):
+        x, y = positions(img, frames[0].stars)
+        assert np.allclose(x, x0 + dx, atol=0.3)
+        assert np.allclose(y, y0 + dy, atol=0.3)
+
+
+@pytest.mark.parametrize('method', ['full', 'pyramid'])
+def test_sequential(frames, method):
+    offsets = get_offsets(
+            *frames, method=method, binning=4, gauss=True,
+            centroid='marginal', match=True
+            )
+    assert np.allclose(offsets, SHIFTS)
+    check_stars(frames)
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_reference(frames, workers):
+    offsets = get_offsets(
+            *frames, method='pyramid', binning=4, reference=0,
+            workers=workers, gauss=True, centroid='marginal', match=True
+            )
+    assert np.allclose(offsets, SHIFTS)
+    check_stars(frames)
+
+
+def test_reference_image(frames):
+    offsets = get_offsets(
+            *frames, reference=frames[0], gauss=True, centroid='marginal',
+            match=True
+            )
+    assert np.allclose(offsets, SHIFTS)
+    with pytest.raises(ValueError):
+        get_offsets(*frames, method='fast')
@@ -0,0 +1,21 @@
+import numpy as np
+from astropy.stats import sigma_clipped_stats
+from dslrpp.analysis.background import pack, clipped_stats
+
+
+def test_clipped_stats_matches_astropy():
+    rng = np.random.default_rng(0)
+    rows = [rng.normal(100, 5, n) for n in (50, 80, 120)]
+    for row in rows:
+        row[:3] += 200  # stars in the annulus
+    mean, median, std = clipped_stats(pack(rows))
+    for i, row in enumerate(rows):
+        expected = sigma_clipped_stats(row)
+        assert np.allclose((mean[i], median[i], std[i]), expected)
+
+
+def test_pack_pads_with_nan():
+    packed = pack([np.ones(2), np.ones(3)])
+    assert packed.shape == (2, 3)
+    assert np.isnan(packed[0, 2])
+    assert np.isnan(packed).sum() == 1
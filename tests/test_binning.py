@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from dslrpp.prepare.binning import bin_data
+
+
+@pytest.fixture
+def data():
+    return np.arange(7 * 10, dtype=np.uint16).reshape(7, 10)
+
+
+@pytest.mark.parametrize('mode', ['mean', 'sum', 'median'])
+def test_crop(data, mode):
+    fn = {'mean': np.mean, 'sum': np.sum, 'median': np.median}[mode]
+    expected = fn(
+            data[:6, :9].reshape(3, 2, 3, 3).astype(np.float64), axis=(1, 3)
+            )
+    binned = bin_data(data, 3, 2, mode)
+    assert binned.dtype == np.float64
+    assert np.allclose(binned, expected)
+
+
+def test_pad(data):
+    binned = bin_data(data, 3, 2, edge='pad')
+    assert binned.shape == (4, 4)
+    assert binned[-1, -1] == data[6:, 9:].mean()
+    assert binned[0, -1] == data[:2, 9:].mean()
+    assert binned[-1, 0] == data[6:, :3].mean()
+
+
+def test_dtype_and_extra_axes():
+    data = np.ones((4, 4, 3), dtype=np.float32)
+    binned = bin_data(data, 2)
+    assert binned.shape == (2, 2, 3)
+    assert binned.dtype == np.float32
+    assert bin_data(data, 2, dtype=np.float64).dtype == np.float64
+
+
+def test_invalid_arguments(data):
+    with pytest.raises(ValueError):
+        bin_data(data, 2, mode='max')
+    with pytest.raises(ValueError):
+        bin_data(data, 2, edge='wrap')
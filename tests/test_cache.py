@@ -0,0 +1,87 @@
+import os
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from dslrpp.prepare import Monochrome, ImageType, Color, MasterCache, calibrate
+
+
+def frame(tmp_path, name, itype, value, exptime=30.):
+    # a frame of constant value, with a file to hash
+    path = tmp_path / 'frames' / name
+    path.parent.mkdir(exist_ok=True)
+    if not path.exists():
+        path.write_bytes(name.encode())
+    origin = SimpleNamespace(
+            exptime=exptime, jdate=2459000.5, impath=str(path), imtype=itype,
+            _binX=1, _binY=1
+            )
+    return Monochrome(
+            np.full((4, 6), value, dtype=np.float32), origin, Color.GREEN
+            )
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return MasterCache(tmp_path / 'cache')
+
+
+def test_load_round_trip(tmp_path, cache):
+    master = frame(tmp_path, 'bias1', ImageType.BIAS, 7.)
+    cache.store('k', master)
+    loaded = cache.load('k')
+    assert np.array_equal(loaded.imdata, master.imdata)
+    assert loaded.imtype == ImageType.BIAS and loaded.imcolor == Color.GREEN
+    assert loaded.cacheKey == 'k'
+    assert os.listdir(cache.path) == ['k.fits']
+    assert cache.load('missing') is None
+
+
+def test_key_writes_index_once(tmp_path, cache, monkeypatch):
+    paths = []
+    for i in range(3):
+        paths.append(tmp_path / 'f{}'.format(i))
+        paths[-1].write_bytes(bytes([i]))
+    saves = []
+    save = cache._saveHashes
+    monkeypatch.setattr(cache, '_saveHashes', lambda: saves.append(save()))
+    key = cache.key(paths, ImageType.BIAS, Color.GREEN, [0.])
+    assert len(saves) == 1
+    assert cache.key(paths, ImageType.BIAS, Color.GREEN, [0.]) == key
+    assert len(saves) == 1
+    assert MasterCache(cache.path).key(
+            paths, ImageType.BIAS, Color.GREEN, [0.]
+            ) == key
+
+
+def test_flat_calibration_frames(tmp_path, cache):
+    def frames():
+        return dict(
+                lights=[frame(tmp_path, 'light', ImageType.LIGHT, 200.)],
+                bias=[frame(tmp_path, 'bias', ImageType.BIAS, 10.)],
+                dark=[frame(tmp_path, 'dark', ImageType.DARK, 30.)],
+                flat=[frame(tmp_path, 'flat', ImageType.FLAT, 150.,
+                            exptime=2.)],
+                fbias=[frame(tmp_path, 'fbias', ImageType.BIAS, 20.)],
+                fdark=[frame(tmp_path, 'fdark', ImageType.DARK, 25.,
+                             exptime=2.)],
+                )
+
+    first = frames()
+    calibrate(**first, cache=cache)
+    # the light frame: 200 - (30 - 10) - 10, times the normalized flat (1)
+    assert np.allclose(first['lights'][0].imdata, 170.)
+    n_cached = len(os.listdir(cache.path))
+    # the flat is stacked from 150 - (25 - 20) - 20
+    flat = [cache.load(f[:-5]) for f in os.listdir(cache.path)
+            if f.endswith('.fits')]
+    assert any(
+            m.imtype == ImageType.FLAT and np.allclose(m.imdata, 125.)
+            for m in flat
+            )
+
+    # a second run finds every master frame, including the flat, in the cache
+    second = frames()
+    calibrate(**second, cache=cache)
+    assert len(os.listdir(cache.path)) == n_cached
+    assert np.allclose(second['lights'][0].imdata, 170.)
+    assert not os.path.exists(os.path.join(cache.path, 'temp'))
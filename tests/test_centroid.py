@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+from dslrpp.prepare.centroid import centroids, CENTROID_METHODS
+
+
+@pytest.mark.parametrize('method', CENTROID_METHODS)
+def test_no_stars(method):
+    result = centroids(np.zeros((32, 32)), [], [], method)
+    assert len(result) == 4
+    assert all(a.shape == (0,) for a in result)
+
+
+@pytest.mark.parametrize('method', ['moments', 'quadratic', 'marginal'])
+def test_gaussian_star(method):
+    yy, xx = np.mgrid[:32, :32]
+    imdata = 10 + 1000 * np.exp(
+            -((xx - 15.3)**2 + (yy - 16.6)**2) / (2 * 1.5**2)
+            )
+    xc, yc, sx, sy = centroids(imdata, [15], [17], method)
+    assert xc[0] == pytest.approx(15.3, abs=0.1)
+    assert yc[0] == pytest.approx(16.6, abs=0.1)
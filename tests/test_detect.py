@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+from dslrpp.prepare.detect import find_stars
+
+
+def test_blank_frame():
+    x, y, peak, r = find_stars(np.zeros((64, 64)))
+    assert len(x) == len(y) == len(peak) == len(r) == 0
+
+
+def test_finds_stars_brightest_first():
+    rng = np.random.default_rng(0)
+    imdata = rng.normal(100, 3, (64, 64))
+    yy, xx = np.mgrid[:64, :64]
+    for xs, ys, a in [(20.2, 30.7, 500), (45.6, 15.1, 2000)]:
+        imdata += a * np.exp(-((xx - xs)**2 + (yy - ys)**2) / (2 * 1.5**2))
+    x, y, peak, r = find_stars(imdata)
+    assert len(x) == 2
+    assert (x[0], y[0]) == pytest.approx((45.6, 15.1), abs=0.2)
+    assert (x[1], y[1]) == pytest.approx((20.2, 30.7), abs=0.2)
+    assert peak[0] > peak[1]
@@ -0,0 +1,66 @@
+import contextvars
+import threading
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from dslrpp.prepare import Monochrome, ImageType, Color, set_dtype, get_dtype
+from dslrpp.prepare.process import _cfaChannel
+from dslrpp.tools.stack import stack
+
+
+@pytest.fixture
+def mosaic():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 2**16, (8, 12), dtype=np.uint16)
+
+
+def test_only_floating_point_types():
+    assert get_dtype() == np.float32
+    assert get_dtype(np.float64) == np.float64
+    with pytest.raises(TypeError):
+        get_dtype(np.uint16)
+    with pytest.raises(TypeError):
+        set_dtype('int32')
+
+
+def test_uint16_to_float32(mosaic):
+    green = _cfaChannel(mosaic, Color.GREEN)
+    assert green.dtype == np.float32
+    expected = (mosaic[0::2, 1::2].astype(np.float64) + mosaic[1::2, 0::2]) / 2
+    assert np.allclose(green, expected, rtol=1e-7)
+    binned = _cfaChannel(mosaic, Color.RED, 2)
+    assert binned.dtype == np.float32
+    assert np.allclose(
+            binned, mosaic[0::2, 0::2].reshape(2, 2, 3, 2).mean(axis=(1, 3))
+            )
+
+
+def test_set_dtype_is_context_local(mosaic):
+    def run():
+        set_dtype(np.float64)
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(get_dtype()))
+        thread.start()
+        thread.join()
+        return get_dtype(), seen[0]
+
+    # a new thread doesn't see the type set in this one
+    assert contextvars.copy_context().run(run) == (np.float64, np.float32)
+    assert get_dtype() == np.float32
+
+
+def test_stack_passes_the_type_to_its_threads(mosaic):
+    origin = SimpleNamespace(
+            exptime=1., jdate=2459000.5, impath='frames/bias', _binX=1,
+            _binY=1, imtype=ImageType.BIAS
+            )
+    frames = [Monochrome(mosaic + i, origin, Color.GREEN) for i in range(3)]
+
+    def run():
+        set_dtype(np.float64)
+        return stack(frames, memory=1, workers=2)
+
+    master = contextvars.copy_context().run(run)
+    assert master.imdata.dtype == np.float64
+    assert np.array_equal(master.imdata, mosaic + 1.)
+    assert stack(frames, dtype=np.float32).imdata.dtype == np.float32
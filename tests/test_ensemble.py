@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from dslrpp.analysis.ensemble import ensemble
+
+
+@pytest.fixture
+def field():
+    # 40 frames of 200 stars: mean magnitudes, frame zero points and noise
+    rng = np.random.default_rng(0)
+    M = rng.uniform(10, 14, 200)
+    Z = rng.normal(0, 0.3, 40)
+    errors = np.broadcast_to(0.002 * 10**(0.2 * (M - 10)), (40, 200)).copy()
+    mags = M + Z[:, np.newaxis] + rng.normal(0, 1, (40, 200)) * errors
+    return M, Z, mags, errors
+
+
+def test_zero_points(field):
+    M, Z, mags, errors = field
+    corrected, corr_errors, zp, used = ensemble(mags, errors)
+    assert np.allclose(zp, Z - Z.mean(), atol=1e-3)
+    # the corrected magnitudes are constant up to the noise
+    offset = np.mean(corrected - M)
+    assert np.allclose(corrected, M + offset, atol=5 * errors.max())
+    assert (corr_errors >= errors).all()
+    assert used.mean() > 0.98
+
+
+def test_variable_and_outliers(field):
+    M, Z, mags, errors = field
+    # a variable comparison star is down-weighted by its excess scatter
+    mags[:, 0] += 0.5 * np.sin(np.arange(40))
+    mags[5, 1:20] += 1.  # clouds over part of one frame
+    mags[7, 30] = np.nan  # a missing measurement
+    corrected, _, zp, used = ensemble(mags, errors)
+    assert np.allclose(zp, Z - Z.mean(), atol=2e-3)
+    assert not used[5, 1:20].any()
+    assert not used[7, 30] and np.isnan(corrected[7, 30])
+    # the variable keeps its light curve
+    assert np.allclose(
+            corrected[:, 0] - corrected[:, 0].mean(),
+            0.5 * np.sin(np.arange(40)) - np.mean(0.5 * np.sin(np.arange(40))),
+            atol=5 * errors[0, 0]
+            )
+
+
+def test_comparison_stars_only(field):
+    M, Z, mags, errors = field
+    ref = np.arange(200) >= 10
+    mags[:, :10] += np.linspace(0, 1, 40)[:, np.newaxis]  # drifting targets
+    _, _, zp, used = ensemble(mags, errors, ref)
+    assert np.allclose(zp, Z - Z.mean(), atol=1e-3)
+    assert not used[:, :10].any()
+    with pytest.raises(ValueError):
+        ensemble(mags, errors, np.zeros(200, dtype=bool))
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from photutils.geometry import circular_overlap_grid
+from dslrpp.analysis import MaskCache
+
+
+def overlap(shape, x, y, r, exact=True):
+    # the overlap of a circle at (x, y) with every pixel of the data
+    h, w = shape
+    return circular_overlap_grid(
+            -0.5 - x, w - 0.5 - x, -0.5 - y, h - 0.5 - y, w, h, r,
+            1 if exact else 0, 1
+            )
+
+
+@pytest.fixture
+def data():
+    return np.random.default_rng(0).uniform(0, 100, (40, 50))
+
+
+# positions on the grid of sub-pixel offsets, inside and on the edges
+@pytest.mark.parametrize('x, y', [
+        (20.25, 17.6), (24., 19.95), (33.45, 8.3), (1.5, 2.), (48.9, 38.75)
+        ])
+def test_matches_circular_overlap_grid(data, x, y):
+    r, r_in, r_out = 3.2, 5.1, 8.
+    aperture, annulus, pixels = MaskCache(steps=20).measure(
+            data, x, y, r, r_in, r_out
+            )
+    assert aperture == pytest.approx(
+            np.sum(overlap(data.shape, x, y, r) * data), rel=1e-12
+            )
+    expected = overlap(data.shape, x, y, r_out) - overlap(
+            data.shape, x, y, r_in
+            )
+    assert annulus == pytest.approx(np.sum(expected * data), rel=1e-12)
+    # pixels outside the data count as zeros, as they do in photutils
+    padded = np.pad(data, 10)
+    center = (overlap(padded.shape, x + 10, y + 10, r_out, False)
+              - overlap(padded.shape, x + 10, y + 10, r_in, False)) > 0
+    assert np.array_equal(np.sort(pixels), np.sort(padded[center]))
+
+
+def test_positions_are_quantised(data):
+    cache = MaskCache(steps=4)
+    measured = cache.measure(data, 20.3, 17.1, 3., 5., 8.)
+    # 20.3 and 17.1 are rounded to 20.25 and 17
+    assert measured[0] == pytest.approx(
+            np.sum(overlap(data.shape, 20.25, 17., 3.) * data), rel=1e-12
+            )
+    # the stencils of the same sub-pixel offset in another pixel are reused
+    cache.measure(data, 30.3, 9.1, 3., 5., 8.)
+    assert len(cache._stencils) == 1
+
+
+def test_least_recently_used_are_discarded(data):
+    cache = MaskCache(steps=10, maxsize=2)
+    for x in (20., 20.1, 20., 20.2):
+        cache.stencils(x, 10., 3., 5., 8.)
+    # the offset 0.1 was used least recently
+    assert [k[3] for k in cache._stencils] == [0, 2]
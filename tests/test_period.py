@@ -0,0 +1,152 @@
+import numpy as np
+import pytest
+from astropy.timeseries import LombScargle
+from dslrpp.analysis import period
+
+
+@pytest.fixture
+def curve():
+    rng = np.random.default_rng(0)
+    t = np.sort(rng.uniform(0, 3, 300))
+    e = rng.uniform(0.01, 0.03, 300)
+    m = 12 + 0.05 * np.sin(2 * np.pi * t / 0.37) + rng.normal(0, 1, 300) * e
+    return t, m, e
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    period.clear_cache()
+    yield
+    period.clear_cache()
+
+
+def test_cached_power_matches_astropy(curve):
+    t, m, e = curve
+    freq = period.frequency_grid(t, 0.05, 1)
+    expected = LombScargle(t, m, e).power(freq)
+    # the second call is served from the caches
+    for _ in range(2):
+        assert np.allclose(
+                period.cached_power(t, m, e, freq), expected, atol=1e-12
+                )
+
+
+def test_cache_budget(curve, monkeypatch):
+    t, m, e = curve
+    freq = period.frequency_grid(t, 0.05, 1)
+    entry = 16 * len(freq) * len(t)
+    monkeypatch.setattr(period, 'CACHE_BUDGET', 2 * entry)
+    for shift in range(4):
+        period.cached_power(t + shift, m, e, freq)
+    assert sum(n for _, n in period._trig.values()) <= 2 * entry
+    period.clear_cache()
+    assert not period._trig and not period._sums and not period._grids
+
+
+def test_cached_power_rows_with_missing_data(curve):
+    t, m, e = curve
+    freq = period.frequency_grid(t, 0.05, 1)
+    mags = np.array([m, m[::-1]])
+    mags[1, ::7] = np.nan
+    power = period.cached_power(t, mags, e, freq)
+    valid = np.isfinite(mags[1])
+    expected = LombScargle(t[valid], mags[1, valid], e[valid]).power(freq)
+    assert np.allclose(power[1], expected, atol=1e-12)
+
+
+def test_batch_periodogram_matches_single(curve):
+    t, m, e = curve
+    mags = np.array([m, np.roll(m, 50)])
+    pRange, power, peaks = period.batch_periodogram(t, mags, e, 0.05, 1)
+    for row, p in zip(mags, power):
+        _, expected = period.periodogram(
+                t, row, e, 0.05, 1, plot=False, grid='auto', method='slow'
+                )
+        assert np.allclose(p, expected, atol=1e-12)
+    assert peaks['period'][0, 0] == pytest.approx(0.37, rel=0.02)
+
+
+def test_bootstrap_is_reproducible(curve):
+    t, m, e = curve
+    first = period.bootstrap(t, m, e, 0.05, 1, n_resamples=40, seed=1,
+                             batch=16)
+    second = period.bootstrap(t, m, e, 0.05, 1, n_resamples=40, seed=1,
+                              batch=16, workers=2)
+    assert np.array_equal(first[1], second[1])
+    assert period.false_alarm(1., first[1]) == 0
+
+
+def test_bootstrap_fap_shares_the_weights(curve):
+    t, m, e = curve
+    period.bootstrap(t, m, e, 0.05, 1, n_resamples=32, seed=2, batch=16)
+    # the errors stay with the timestamps, so one set of cached sums serves
+    # every resample
+    assert len(period._sums) == 1
+
+
+def _naive_pdm(t, m, freq, n_bins):
+    t = t - t.min()
+    y = m - m.mean()
+    total = np.sum(y**2) / (len(y) - 1)
+    power = []
+    for f in freq:
+        b = np.minimum(((t * f) % 1 * n_bins).astype(int), n_bins - 1)
+        within, used = 0., 0
+        for k in range(n_bins):
+            x = y[b == k]
+            if len(x):
+                within += np.sum((x - x.mean())**2)
+                used += 1
+        power.append(1 - within / (len(y) - used) / total)
+    return np.array(power)
+
+
+def test_pdm_matches_reference(curve):
+    t, m, _ = curve
+    freq = np.linspace(1, 20, 200)
+    assert np.allclose(
+            period.pdm_power(t, m, freq), _naive_pdm(t, m, freq, 10),
+            atol=1e-12
+            )
+
+
+def test_string_length_matches_reference(curve):
+    t, m, _ = curve
+    freq = np.linspace(1, 20, 50)
+    y = m - m.mean()
+    expected = []
+    for f in freq:
+        folded = y[np.argsort(((t - t.min()) * f) % 1)]
+        d = np.diff(np.append(folded, folded[0]))
+        expected.append(1 - 0.5 * np.sum(d**2) / np.sum(y**2))
+    assert np.allclose(
+            period.string_length_power(t, m, freq), expected, atol=1e-12
+            )
+
+
+def test_multiband_single_band(curve):
+    t, m, e = curve
+    freq = period.frequency_grid(t, 0.05, 1)
+    assert np.allclose(
+            period.multiband_power([t], [m], [e], freq),
+            LombScargle(t, m, e).power(freq), atol=1e-12
+            )
+
+
+def test_multiband_matches_astropy(curve):
+    timeseries = pytest.importorskip('astropy.timeseries')
+    if not hasattr(timeseries, 'LombScargleMultiband'):
+        pytest.skip("LombScargleMultiband needs astropy 5.2")
+    t, m, e = curve
+    bands = np.arange(len(t)) % 3
+    mags = m + bands
+    freq = period.frequency_grid(t, 0.05, 1)
+    power = period.multiband_power(
+            *zip(*[(t[bands == b], mags[bands == b], e[bands == b])
+                   for b in range(3)]),
+            freq
+            )
+    expected = timeseries.LombScargleMultiband(
+            t, mags, bands, e, nterms_base=1, nterms_band=0
+            ).power(freq, method='flexible')
+    assert np.allclose(power, expected, atol=1e-6)
@@ -0,0 +1,50 @@
+import pytest
+from dslrpp.pipeline import parse_args
+
+
+def test_minimal():
+    args = parse_args(['pipeline.py', 'data/night1', '10', '20', '30', '40',
+                       '12.5'])
+    assert args.path == 'data/night1'
+    assert args.var_coords == (10, 20)
+    assert args.ref_coords == [(30, 40)]
+    assert args.ref_mags == [12.5]
+    assert (args.red, args.green, args.blue) == (False, True, False)
+    assert args.workers is None and args.field == 0
+
+
+def test_reference_stars_and_options():
+    args = parse_args([
+            'pipeline.py', 'data', '10', '20', '30', '40', '12.5',
+            '50', '60', '13', '-b', '2', '3', '-c', 'rb',
+            '-p', '0.1', '2', '0.001', '-w', '4', '-f', '50'
+            ])
+    assert args.ref_coords == [(30, 40), (50, 60)]
+    assert args.ref_mags == [12.5, 13.]
+    assert (args.binX, args.binY) == (2, 3)
+    assert (args.red, args.green, args.blue) == (True, False, True)
+    assert (args.pMin, args.pMax, args.pP) == (0.1, 2., 0.001)
+    assert args.workers == 4
+    assert args.field == 50
+
+
+def test_single_binning_factor():
+    args = parse_args(['pipeline.py', 'data', '10', '20', '30', '40', '12',
+                       '-b', '2', '-w', '3'])
+    assert (args.binX, args.binY) == (2, 2)
+    assert args.workers == 3
+
+
+@pytest.mark.parametrize('extra', [
+        [],  # no reference magnitude
+        ['50', '60'],  # incomplete reference star
+        ['-w'],  # missing option argument
+        ['-p', '0.1'],
+        ['-x', '1'],
+        ])
+def test_invalid(extra):
+    argv = ['pipeline.py', 'data', '10', '20', '30', '40', '12'] + extra
+    if not extra:
+        argv = argv[:-1]
+    with pytest.raises(SystemExit):
+        parse_args(argv)
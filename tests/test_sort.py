@@ -0,0 +1,75 @@
+import importlib
+import os
+from concurrent.futures import Future
+import numpy as np
+import pytest
+from dslrpp.prepare import ImageType
+
+sort_module = importlib.import_module('dslrpp.prepare.sort')
+load = getattr(sort_module, '__load')
+
+
+def fake_read(path):
+    # stands in for _readRaw; the frame number is the file name
+    n = int(os.path.basename(path))
+    return np.full((4, 6), n, dtype=np.uint16), float(n), 2459000.5 + n
+
+
+class FakeExecutor:
+    # runs the tasks when their results are requested, and keeps track of
+    # the frames which were submitted but not yet consumed
+    def __init__(self, max_workers):
+        self.pending = 0
+        self.max_pending = 0
+
+    def __enter__(self):
+        FakeExecutor.last = self
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def submit(self, fn, *args):
+        self.pending += 1
+        self.max_pending = max(self.max_pending, self.pending)
+        future = Future()
+        result = future.result
+
+        def run(timeout=None):
+            if not future.done():
+                self.pending -= 1
+                future.set_result(fn(*args))
+            return result(timeout)
+
+        future.result = run
+        return future
+
+
+@pytest.fixture
+def files(tmp_path):
+    return [(str(tmp_path / str(n)), ImageType.LIGHT) for n in range(11)]
+
+
+@pytest.mark.parametrize('workers', [2, 3])
+def test_bounded_prefetch(files, monkeypatch, workers):
+    monkeypatch.setattr(sort_module, '_readRaw', fake_read)
+    monkeypatch.setattr(sort_module, 'ProcessPoolExecutor', FakeExecutor)
+    images = load(files, workers, lazy=True)
+    assert FakeExecutor.last.max_pending == 2 * workers
+    assert [im.impath for im in images] == [f for f, _ in files]
+    assert [im.exptime for im in images] == list(range(11))
+    for n, im in enumerate(images):
+        # the data was written out when the image was created
+        assert os.path.exists(im._dataPath())
+        assert np.array_equal(im.imdata, np.full((4, 6), n))
+    temp = images[0].tmpPath
+    for im in images:
+        im.release()
+    assert not os.path.exists(temp)
+
+
+def test_process_pool(files, monkeypatch):
+    monkeypatch.setattr(sort_module, '_readRaw', fake_read)
+    images = load(files, 2)
+    assert [im.impath for im in images] == [f for f, _ in files]
+    assert [int(im.imdata[0, 0]) for im in images] == list(range(11))
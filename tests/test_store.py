@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import pytest
+from dslrpp.analysis import save_lcData, open_store, ColumnStore
+from dslrpp.analysis.period import save_pgData
+from dslrpp.analysis.store import LC_DTYPE, PG_DTYPE
+
+
+def test_lightcurve_round_trip(tmp_path):
+    t = np.linspace(0, 1, 5)
+    m = np.array([np.arange(5.), np.arange(5.) + 10])
+    e = np.full(5, 0.01)
+    store = save_lcData(str(tmp_path), t, m, e, desc='G', star=3)
+    assert store.path == os.path.join(str(tmp_path), 'lightcurve_data_G')
+
+    data = ColumnStore(store.path).read()
+    assert np.array_equal(data['time'], np.tile(t, 2))
+    assert np.array_equal(data['mag'], m.ravel())
+    assert np.array_equal(data['err'], np.full(10, 0.01))
+    assert np.array_equal(data['star'], np.repeat([3, 4], 5))
+    assert set(data['channel']) == {b'G'}
+    assert not data['flags'].any()
+
+
+def test_lightcurve_append(tmp_path):
+    path = str(tmp_path)
+    first = save_lcData(path, [0., 1.], [10., 11.], desc='R')
+    save_lcData(path, [2.], [12.], [0.1], desc='R', flags=4, append=True)
+    store = open_store(first.path, LC_DTYPE, append=True)
+    assert len(store) == 3
+    assert np.array_equal(store['time'], [0., 1., 2.])
+    assert np.array_equal(store['flags'], [0, 0, 4])
+    assert np.isnan(store['err'][:2]).all()
+
+    # without append, a new store is created next to the old one
+    other = save_lcData(path, [0.], [1.], desc='R')
+    assert other.path == first.path + '_1'
+    assert len(ColumnStore(first.path)) == 3
+
+
+def test_periodogram_round_trip(tmp_path):
+    pRange = np.linspace(0.1, 1, 4)
+    power = np.array([[0.1, 0.5, 0.2, 0.1], [0.3, 0.1, 0.1, 0.2]])
+    store = save_pgData(str(tmp_path), pRange, power, desc='B')
+    save_pgData(str(tmp_path), pRange, power[0], desc='B', star=2,
+                append=True)
+    data = open_store(store.path, PG_DTYPE, append=True).read()
+    assert np.array_equal(data['period'], np.tile(pRange, 3))
+    assert np.array_equal(data['power'], np.concatenate([*power, power[0]]))
+    assert np.array_equal(data['star'], np.repeat([0, 1, 2], 4))
+
+
+def test_append_checks_the_columns(tmp_path):
+    store = save_lcData(str(tmp_path), [0.], [1.])
+    with pytest.raises(ValueError):
+        open_store(store.path, PG_DTYPE, append=True)
+    with pytest.raises(ValueError):
+        save_lcData(str(tmp_path), [0.], [1.], desc='x' * 17, append=True)
+
+
+def test_partly_written_rows_are_dropped(tmp_path):
+    store = open_store(str(tmp_path / 'store'), PG_DTYPE)
+    store.append(period=[1., 2.], power=[0.5, 0.6])
+    # an interrupted append left a value in only one column
+    with open(os.path.join(store.path, 'period.bin'), 'ab') as f:
+        np.array([3.]).tofile(f)
+    assert len(store) == 2
+    store.append(period=4., power=0.7)
+    assert np.array_equal(store['period'], [1., 2., 4.])
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from dslrpp.prepare import Tracks, positions
+from dslrpp.prepare.tracks import _Column
+
+
+class Frame:
+    def __init__(self, jdate):
+        self.jdate = jdate
+
+
+class Star:
+    def __init__(self, tracks):
+        self.tracks = tracks
+        self.index = tracks.add_star()
+        self.x = _Column(self, 'x')
+        self.y = _Column(self, 'y')
+
+
+def test_growth_keeps_the_data():
+    tracks = Tracks(frames=1, stars=1)
+    frames = [Frame(2450000. + i) for i in range(5)]
+    stars = [Star(tracks) for _ in range(3)]
+    for i, frame in enumerate(frames):
+        for j, star in enumerate(stars):
+            star.x[frame] = 10 * i + j
+            star.y[frame] = -(10 * i + j)
+    assert tracks.shape == (5, 3)
+    assert len(tracks) == 5
+    expected = 10 * np.arange(5)[:, np.newaxis] + np.arange(3)
+    assert np.array_equal(tracks.x, expected)
+    assert np.array_equal(tracks.y, -expected)
+    assert np.array_equal(tracks.jd, 2450000. + np.arange(5))
+    assert np.array_equal(tracks.frame(frames[2]).x, expected[2])
+
+
+def test_columns_and_positions():
+    tracks = Tracks()
+    a, b = Star(tracks), Star(tracks)
+    frame, other = Frame(1.), Frame(2.)
+    a.x[frame], a.y[frame] = 1.5, 2.5
+    b.x[frame], b.y[frame] = 3.5, 4.5
+    assert a.x[frame] == 1.5 and frame in a.x
+    x, y = positions(frame, [b, a])
+    assert np.array_equal(x, [3.5, 1.5]) and np.array_equal(y, [4.5, 2.5])
+    # the other frame has no positions yet
+    a.x[other] = 0.
+    assert other not in b.x
+    with pytest.raises(KeyError):
+        positions(other, [a, b])
+    with pytest.raises(KeyError):
+        b.y[other]
+
+
+def test_frame_belongs_to_one_table():
+    frame = Frame(1.)
+    first, second = Tracks(), Tracks()
+    assert first.add_frame(frame) == first.add_frame(frame) == 0
+    with pytest.raises(ValueError):
+        second.add_frame(frame)
+    with pytest.raises(KeyError):
+        second.row(frame)